@@ -0,0 +1,108 @@
+"""
+throughput of the CommunicationModule with the messages encoded in the loop
+and by a thread or process pool of 1, 2 and 4 workers (see [encoder] in
+client.config), against the local stand-in server in its own process.
+the measurements are handed to the module as fast as it takes them, with
+pipelined acks, zlib compression and large windows, so encoding is the
+main cost. run from the directory containing client.config:
+
+    python -m benchmarks.encoder_pool --duration 10 --window 500 --encoding pickle
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import multiprocessing
+import tempfile
+import time
+
+from benchmarks import fakes, metrics
+from benchmarks.standin_server import make_self_signed_cert, serve
+from communication.communication import create_ssl_context, CommunicationModule
+from dto.forwardeddatatypes import ForwardedMeasurement
+from rfpi.decoder import create_decoder
+
+
+def create_executor(kind, workers):
+    if not workers:
+        return None
+    if kind == 'process':
+        return concurrent.futures.ProcessPoolExecutor(workers)
+    return concurrent.futures.ThreadPoolExecutor(workers)
+
+
+@asyncio.coroutine
+def feed(cm, readings, duration):
+    """
+    hands the measurements to the module for duration seconds
+    :return: (int) number of measurements handed over
+    """
+    end = time.time() + duration
+    count = 0
+    while time.time() < end:
+        reading = dict(readings[count % len(readings)], seq=count)
+        yield from cm.send(ForwardedMeasurement(reading))
+        count += 1
+    return count
+
+
+def run(kind, workers, duration, port, window, encoding):
+    """
+    :return: (dict) the results of the client and the server
+    """
+    directory = tempfile.mkdtemp()
+    ssl_dict = make_self_signed_cert(directory)
+    results_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=('localhost', port, ssl_dict, {'seed': 1},
+                                                          results_queue, duration + 5))
+    server.start()
+    time.sleep(1)
+
+    decoder = create_decoder()
+    readings = [decoder.decode(line.decode('ascii').strip()).__dict__ for line in fakes.rfpi_lines(4096)]
+    executor = create_executor(kind, workers)
+    settings = {'hello': True, 'window': window, 'max_in_flight': 8,
+                'features': {'framing': ('length',), 'encoding': (encoding,),
+                             'compression': ('zlib',), 'ack': ('pipelined',)}}
+    cm = CommunicationModule('localhost', port, create_ssl_context(ssl_dict), protocol_settings=settings,
+                             executor=executor)
+
+    # a loop of its own per configuration
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(cm.connect())
+    # of this process, the workers of a process pool are not included
+    cpu_before = metrics.cpu_seconds()
+    count = loop.run_until_complete(feed(cm, readings, duration))
+    cpu = metrics.cpu_seconds() - cpu_before
+    cm.disconnect()
+    loop.run_until_complete(asyncio.sleep(0.5))
+    loop.close()
+    if executor is not None:
+        executor.shutdown()
+
+    client = {'kind': kind if workers else 'loop', 'workers': workers, 'handed_over': count,
+              'readings_per_sec': round(count / duration, 1), 'cpu_s': round(cpu, 3)}
+    results = results_queue.get()
+    server.join()
+    return {'client': client, 'server': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=10, help='seconds to run each configuration')
+    parser.add_argument('--port', type=int, default=13458)
+    parser.add_argument('--window', type=int, default=500, help='measurements per message')
+    parser.add_argument('--encoding', choices=('pickle', 'columnar'), default='pickle')
+    parser.add_argument('--kinds', default='thread,process', help='kinds of pools to compare')
+    parser.add_argument('--workers', default='1,2,4', help='numbers of workers to compare')
+    args = parser.parse_args()
+
+    configurations = [('loop', 0)] + [(kind, int(workers)) for kind in args.kinds.split(',')
+                                      for workers in args.workers.split(',')]
+    print('cpus: %s' % multiprocessing.cpu_count())
+    for number, (kind, workers) in enumerate(configurations):
+        print(run(kind, workers, args.duration, args.port + number, args.window, args.encoding))
+
+
+if __name__ == '__main__':
+    main()
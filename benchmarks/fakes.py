@@ -0,0 +1,104 @@
+import time
+
+# temperature/humidity nodes which have a device id in client.config
+TEMP_HUM_NODES = (19, 22, 23, 24)
+
+PLUG_MAC = b'\x00\x13\xa2\x00\x40\x01\x02\x03'
+
+
+def rfpi_lines(count):
+    """
+    synthetic lines of the RFPi, as they are read from the serial port
+    :param count: (int) number of lines
+    :return: list of bytes, each terminated by '\r\n'
+    """
+    lines = []
+    for i in range(count):
+        node_id = TEMP_HUM_NODES[i % len(TEMP_HUM_NODES)]
+        # the temperatures and the humidity carry the line number, so that no two lines are
+        # the same frame for the deduplication of the Reporter, within the ranges of [validation]
+        humidity = (i // 50) % 1000
+        external = (i // 50000) % 1000
+        lines.append(('%s %s 0 %s %s %s %s 30 0\r\n' % (node_id, 200 + i % 50, external % 256, external // 256,
+                                                         humidity % 256, humidity // 256)).encode('ascii'))
+    return lines
+
+
+def xbee_frames(count, mac=PLUG_MAC):
+    """
+    synthetic 'rx' frames of a plug meter, as returned by ZigBee.wait_read_frame
+    :param count: (int) number of frames
+    :param mac: (bytes) 64 bit source address
+    :return: list of dictionaries
+    """
+    frames = []
+    for i in range(count):
+        rf_data = 'POW=ON\nFREQ=50.0%sHz\nVRMS=230V\nLOAD=%sW\nWORK=%.4fkWh\nIRMS=%smA\n' % (
+            i % 10, 100 + i % 50, 1.5 + i / 10000.0, 400 + i % 50)
+        frames.append({'id': 'rx', 'source_addr_long': mac, 'source_addr': b'\xff\xfe',
+                       'options': b'\x01', 'rf_data': rf_data.encode('utf-8')})
+    return frames
+
+
+class _PacedSource():
+    """
+    hands out the given items with a fixed rate,
+    blocks forever once all of them have been handed out
+    """
+    def __init__(self, items, rate, write_delay=0):
+        """
+        :param items: list of the items to hand out
+        :param rate: (float) items per second, 0 for as fast as possible
+        :param write_delay: (float) seconds every write to the device takes
+        """
+        self._write_delay = write_delay
+        self._items = items
+        self._interval = 1.0 / rate if rate else 0
+        self._next = 0
+
+    def _next_item(self):
+        if self._next >= len(self._items):
+            while True:
+                time.sleep(3600)
+        if self._interval:
+            time.sleep(self._interval)
+        item = self._items[self._next]
+        self._next += 1
+        return item
+
+
+class FakeSerial(_PacedSource):
+    """
+    stands in for serial.Serial in RFPi.serial_port
+    """
+    def readline(self):
+        return self._next_item()
+
+    def write(self, data):
+        time.sleep(self._write_delay)
+        return len(data)
+
+    def close(self):
+        pass
+
+
+class FakeXBee(_PacedSource):
+    """
+    stands in for xbee.ZigBee in ZigBeeReader.zigbee
+    """
+    @property
+    def serial(self):
+        # a frame is always on its way, wait_read_frame does the pacing
+        return self
+
+    def inWaiting(self):
+        return 1
+
+    def close(self):
+        pass
+
+    def wait_read_frame(self):
+        return self._next_item()
+
+    def tx(self, **kwargs):
+        time.sleep(self._write_delay)
@@ -0,0 +1,375 @@
+"""
+simulates a fleet of sensors on pseudo terminals, so the real readers of
+clientrun.py can be run without radios: every simulated RFPi and XBee radio
+is a pty, its virtual nodes and plug meters write their frames to it at the
+given rates, with bursts and noise. the XBee radios answer the commands of
+the client with tx_status frames and the plugs follow their 'SET TXT'.
+
+the offered and the written frames per second are printed every --report
+seconds. once the readers do not keep up the writes block, the lag behind
+the schedule grows and the written rate stays below the offered one; with
+--ramp the rate is raised step by step to find that point. run from the
+directory containing client.config:
+
+    python -m benchmarks.fleet --rfpi 1 --nodes 200 --xbee 2 --plugs 300 --config sim.config
+
+then copy sim.config over the client.config of the client (the relative
+paths in it are relative to where clientrun.py is run) and start it.
+"""
+import argparse
+import configparser
+import heapq
+import json
+import multiprocessing
+import os
+import random
+import re
+import select
+import struct
+import time
+import tty
+
+from benchmarks import fakes
+
+# XBee API frames, not escaped (API mode 1 as used by xbee.ZigBee)
+_START = 0x7E
+_RX = 0x90
+_TX_REQUEST = 0x10
+_TX_STATUS = 0x8B
+_DELIVERED = 0x00
+_NOT_DELIVERED = 0x21
+
+_BROADCAST = b'\x00\x00\x00\x00\x00\x00\xff\xff'
+
+_SET_TXT = re.compile(rb'SET TXT=(\d+)')
+
+# counters of an emitter in shared memory, in this order: the frames per second it
+# should write, the frames written, the noise among them, the commands of the
+# client and how many seconds the last frame was written behind its schedule
+_COUNTERS = ('rate', 'written', 'noise', 'commands', 'lag')
+
+
+def api_frame(data):
+    """
+    :param data: (bytes) the frame data, its api id first
+    :return: (bytes) the frame as written by the radio
+    """
+    return struct.pack('>BH', _START, len(data)) + data + bytes([0xFF - (sum(data) & 0xFF)])
+
+
+def rx_frame(address, rf_data):
+    """
+    :return: (bytes) a 'rx' frame of the plug meter with the 64 bit address
+    """
+    return api_frame(bytes([_RX]) + address + b'\xff\xfe\x01' + rf_data)
+
+
+def tx_status_frame(frame_id, delivered=True):
+    return api_frame(bytes([_TX_STATUS, frame_id]) + b'\xff\xfe\x00' +
+                     bytes([_DELIVERED if delivered else _NOT_DELIVERED, 0]))
+
+
+def read_api_frames(buffer):
+    """
+    :param buffer: (bytes) the bytes written by the client, not yet handled
+    :return: (tuple) list of the frame data of the complete frames and the remaining bytes
+    """
+    frames = []
+    while True:
+        start = buffer.find(bytes([_START]))
+        if start < 0:
+            return frames, b''
+        if len(buffer) - start < 3:
+            return frames, buffer[start:]
+        length = struct.unpack_from('>H', buffer, start + 1)[0]
+        end = start + 3 + length + 1
+        if end > len(buffer):
+            return frames, buffer[start:]
+        data = buffer[start + 3:end - 1]
+        if (sum(data) + buffer[end - 1]) & 0xFF == 0xFF:
+            frames.append(data)
+        buffer = buffer[end:]
+
+
+def plug_addresses(count):
+    """
+    :return: list of the 64 bit addresses of the simulated plug meters
+    """
+    return [b'\x00\x13\xa2\x00\x41' + struct.pack('>I', number)[1:] for number in range(1, count + 1)]
+
+
+def mac_to_str(address):
+    return ':'.join('%02X' % c for c in address)
+
+
+class _Node():
+    """
+    a virtual node or plug meter, its values follow a random walk
+    """
+    __slots__ = ('key', 'address', 'interval', 'load', 'work')
+
+    def __init__(self, key, interval, address=None):
+        self.key = key
+        self.address = address
+        self.interval = interval
+        self.load = random.randint(0, 2000)
+        self.work = random.uniform(0, 100)
+
+    def walk(self, interval):
+        self.load = min(3500, max(0, self.load + random.randint(-50, 50)))
+        self.work += self.load * interval / 3600000.0
+
+
+class _Emitter(multiprocessing.Process):
+    """
+    writes the frames of the nodes of one radio to the master side of its pty
+    """
+    def __init__(self, kind, master, nodes, settings, counters, speed):
+        """
+        :param kind: (string) 'rfpi' or 'xbee'
+        :param master: (int) file descriptor of the master side of the pty
+        :param nodes: list of _Node
+        :param settings: (dict) noise, burst_every, burst_size, loss
+        :param counters: multiprocessing.RawArray of _COUNTERS
+        :param speed: multiprocessing.RawValue, factor of all rates
+        """
+        multiprocessing.Process.__init__(self, daemon=True)
+        self._kind = kind
+        self._master = master
+        self._nodes = nodes
+        self._settings = settings
+        self._counters = counters
+        self._speed = speed
+        self._commands = b''
+
+    def _rfpi_line(self, node):
+        node.walk(node.interval)
+        if node.key == 10:
+            values = struct.pack('<hhhhhh', node.load, node.load // 2, 0, 0,
+                                 random.randint(22500, 23500), random.randint(150, 300))
+        else:
+            values = struct.pack('<hhhh', random.randint(150, 300), random.randint(-100, 300),
+                                 random.randint(300, 700), random.randint(28, 32))
+        return ('%s %s\r\n' % (node.key, ' '.join(str(value) for value in values))).encode('ascii')
+
+    def _rfpi_noise(self, node):
+        choice = random.randrange(4)
+        if choice == 0:
+            # a status line of the RFM board
+            return b'> 15i 433 MHz g210\r\n'
+        if choice == 1:
+            # a truncated frame
+            return b' '.join(self._rfpi_line(node).split(b' ')[:random.randint(1, 5)]).strip() + b'\r\n'
+        if choice == 2:
+            # an implausible voltage
+            return b'10 0 0 0 0 0 0 0 0 200 200 0 0\r\n'
+        return bytes(random.randrange(32, 127) for _ in range(random.randint(1, 30))) + b'\r\n'
+
+    def _xbee_frame(self, node):
+        node.walk(node.interval)
+        rf_data = 'POW=ON\nFREQ=50.0%sHz\nVRMS=%sV\nLOAD=%sW\nWORK=%.4fkWh\nIRMS=%smA\n' % (
+            random.randint(0, 9), random.randint(225, 235), node.load, node.work, node.load * 1000 // 230)
+        return rx_frame(node.address, rf_data.encode('ascii'))
+
+    def _xbee_noise(self, node):
+        choice = random.randrange(3)
+        if choice == 0:
+            # a frame with a wrong checksum
+            frame = self._xbee_frame(node)
+            return frame[:-1] + bytes([frame[-1] ^ 0xFF])
+        if choice == 1:
+            # a truncated measurement
+            return rx_frame(node.address, b'POW=ON\nFRE')
+        return bytes(random.randrange(256) for _ in range(random.randint(1, 30)))
+
+    def _frame(self, node):
+        if random.random() < self._settings['noise']:
+            self._counters[2] += 1
+            return self._rfpi_noise(node) if self._kind == 'rfpi' else self._xbee_noise(node)
+        return self._rfpi_line(node) if self._kind == 'rfpi' else self._xbee_frame(node)
+
+    def _write(self, data):
+        """
+        writes a frame, reading the commands of the client meanwhile: a client
+        blocked writing its setup would not read the frames (and vice versa)
+        """
+        view = memoryview(data)
+        while view:
+            readable, writable = select.select([self._master], [self._master], [])[:2]
+            if readable:
+                self._handle_commands()
+            if writable:
+                try:
+                    view = view[os.write(self._master, view):]
+                except BlockingIOError:
+                    pass
+
+    def _rate(self):
+        rate = sum(self._speed.value / node.interval for node in self._nodes)
+        if self._settings['burst_every']:
+            rate += self._settings['burst_size'] / self._settings['burst_every']
+        self._counters[0] = rate
+
+    def _handle_commands(self):
+        """
+        reads what the client wrote, the XBee radios confirm every command
+        with a frame id and the plugs take their new reporting interval
+        """
+        try:
+            data = os.read(self._master, 65536)
+        except OSError:
+            return
+        if self._kind != 'xbee':
+            return
+        frames, self._commands = read_api_frames(self._commands + data)
+        for frame in frames:
+            if frame[0] != _TX_REQUEST:
+                continue
+            self._counters[3] += 1
+            frame_id, destination, rf_data = frame[1], frame[2:10], frame[14:]
+            delivered = random.random() >= self._settings['loss']
+            match = _SET_TXT.match(rf_data)
+            if delivered and match:
+                for node in self._nodes:
+                    if destination in (node.address, _BROADCAST):
+                        node.interval = max(1, int(match.group(1)))
+                self._rate()
+            if frame_id:
+                self._write(tx_status_frame(frame_id, delivered))
+
+    def run(self):
+        os.set_blocking(self._master, False)
+        now = time.time()
+        # (time of the next frame, number of the node)
+        schedule = [(now + random.uniform(0, node.interval), position) for position, node in enumerate(self._nodes)]
+        heapq.heapify(schedule)
+        next_burst = now + self._settings['burst_every'] if self._settings['burst_every'] else None
+        speed = None
+        while True:
+            if speed != self._speed.value:
+                speed = self._speed.value
+                self._rate()
+            due, position = schedule[0]
+            now = time.time()
+            if next_burst is not None and next_burst <= min(due, now):
+                for _ in range(self._settings['burst_size']):
+                    self._write(self._frame(random.choice(self._nodes)))
+                    self._counters[1] += 1
+                next_burst += self._settings['burst_every']
+                continue
+            if due > now:
+                readable = select.select([self._master], [], [], due - now)[0]
+                if readable:
+                    self._handle_commands()
+                continue
+
+            node = self._nodes[position]
+            self._write(self._frame(node))
+            self._counters[1] += 1
+            self._counters[4] = time.time() - due
+            heapq.heapreplace(schedule, (due + node.interval / speed, position))
+
+
+def open_pty():
+    """
+    :return: (tuple) the master file descriptor and the path of the slave side,
+    which is kept open so that the restarts of a reader do not close the pty
+    """
+    master, slave = os.openpty()
+    # no echo and no translation of the line endings, like a serial port
+    tty.setraw(slave)
+    return master, os.ttyname(slave), slave
+
+
+def rfpi_node_keys():
+    """
+    :return: list of the node ids known by the decoder, see [node10] and [temp-hum]
+    """
+    return [10] + list(fakes.TEMP_HUM_NODES)
+
+
+def write_config(file_name, rfpi_ports, xbee_ports, addresses):
+    """
+    writes a copy of client.config reading from the ptys
+    """
+    config = configparser.ConfigParser()
+    config.read('client.config')
+    config['rfpi']['enabled'] = 'true' if rfpi_ports else 'false'
+    if rfpi_ports:
+        config['rfpi']['port'] = ';'.join(rfpi_ports)
+    config['zigbee']['enabled'] = 'true' if xbee_ports else 'false'
+    if xbee_ports:
+        config['zigbee']['port'] = ';'.join(xbee_ports)
+        config['zigbee']['plugmeters'] = ';'.join(mac_to_str(address) for address in addresses)
+    with open(file_name, 'w') as fout:
+        config.write(fout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rfpi', type=int, default=1, help='number of simulated RFPi radios')
+    parser.add_argument('--nodes', type=int, default=100, help='virtual nodes per RFPi, sharing the known node ids')
+    parser.add_argument('--node-interval', type=float, default=5, help='seconds between two lines of a node')
+    parser.add_argument('--xbee', type=int, default=1, help='number of simulated XBee radios')
+    parser.add_argument('--plugs', type=int, default=100, help='plug meters, spread over the XBee radios')
+    parser.add_argument('--plug-interval', type=float, default=4, help='seconds between two frames of a plug, until it gets a SET TXT')
+    parser.add_argument('--noise', type=float, default=0.01, help='share of the frames which are noise, truncated or implausible')
+    parser.add_argument('--burst-every', type=float, default=0, help='seconds between two bursts, 0 for none')
+    parser.add_argument('--burst-size', type=int, default=100, help='frames per burst and radio')
+    parser.add_argument('--loss', type=float, default=0, help='share of the commands to the plugs which are not delivered')
+    parser.add_argument('--speed', type=float, default=1, help='factor of all rates')
+    parser.add_argument('--ramp', type=float, default=0, help='added to the speed every report')
+    parser.add_argument('--report', type=float, default=10, help='seconds between two reports')
+    parser.add_argument('--duration', type=float, default=0, help='seconds to run, 0 for until interrupted')
+    parser.add_argument('--config', help='file to write a copy of client.config reading from the ptys to')
+    args = parser.parse_args()
+
+    settings = {'noise': args.noise, 'burst_every': args.burst_every, 'burst_size': args.burst_size,
+                'loss': args.loss}
+    speed = multiprocessing.RawValue('d', args.speed)
+    emitters = []
+    ports = {'rfpi': [], 'xbee': []}
+    keys = rfpi_node_keys()
+    addresses = plug_addresses(args.plugs)
+    for number in range(args.rfpi + args.xbee):
+        kind = 'rfpi' if number < args.rfpi else 'xbee'
+        if kind == 'rfpi':
+            nodes = [_Node(keys[i % len(keys)], args.node_interval) for i in range(args.nodes)]
+        else:
+            nodes = [_Node(None, args.plug_interval, address) for address in addresses[number - args.rfpi::args.xbee]]
+        master, path, slave = open_pty()
+        counters = multiprocessing.RawArray('d', len(_COUNTERS))
+        emitters.append((kind, path, slave, counters, _Emitter(kind, master, nodes, settings, counters, speed)))
+        ports[kind].append(path)
+
+    if args.config:
+        write_config(args.config, ports['rfpi'], ports['xbee'], addresses)
+    print(json.dumps({'rfpi': ports['rfpi'], 'xbee': ports['xbee'], 'config': args.config}), flush=True)
+
+    for emitter in emitters:
+        emitter[-1].start()
+
+    start = last = time.time()
+    last_counts = [0] * len(_COUNTERS)
+    try:
+        while not args.duration or time.time() - start < args.duration:
+            time.sleep(args.report)
+            now = time.time()
+            counts = [sum(emitter[3][i] for emitter in emitters) for i in range(len(_COUNTERS))]
+            print(json.dumps({'elapsed_s': round(now - start, 1),
+                              'speed': round(speed.value, 3),
+                              'offered_per_sec': round(counts[0], 1),
+                              'written_per_sec': round((counts[1] - last_counts[1]) / (now - last), 1),
+                              'noise': int(counts[2]),
+                              'commands': int(counts[3]),
+                              'max_lag_s': round(max(emitter[3][4] for emitter in emitters), 3)}), flush=True)
+            last, last_counts = now, counts
+            speed.value += args.ramp
+    except KeyboardInterrupt:
+        pass
+    for emitter in emitters:
+        emitter[-1].terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+compares the ingest modes of clientrun.py: 'multiprocess' (RFPi, ZigBeeReader
+and the Reporter in three processes) and 'single' (reader threads inside the
+process of the Reporter)
+
+the readers are fed by in-memory fake radios, so no hardware is needed.
+run from the directory containing client.config:
+
+    python -m benchmarks.ingest_mode --readings 2000 --rate 200
+"""
+import argparse
+import os
+import queue
+import time
+from datetime import datetime
+
+from benchmarks import fakes, metrics
+from clientrun import create_readers
+from util.supervisor import ReaderStats
+
+
+def first_reader(factories, kind):
+    """
+    :param factories: dictionary name -> factory as returned by create_readers
+    :param kind: (string) 'rfpi' or 'zigbee'
+    :return: a new reader for the first configured port of that kind
+    """
+    name = sorted(name for name in factories if name.startswith(kind + ':'))[0]
+    return factories[name](ReaderStats())
+
+
+def run_mode(mode, readings, rate):
+    """
+    starts the readers in the given mode and consumes all readings from the shared queue
+    :param mode: (string) 'multiprocess' or 'single'
+    :param readings: (int) number of readings per reader
+    :param rate: (float) readings per second per reader, 0 for unpaced
+    :return: (dict) the results
+    """
+    cpu_before = metrics.cpu_seconds()
+    start = time.time()
+
+    shared_queue, factories = create_readers(mode)
+    rfpi = first_reader(factories, 'rfpi')
+    xbeereader = first_reader(factories, 'zigbee')
+    rfpi.serial_port = fakes.FakeSerial(fakes.rfpi_lines(readings), rate)
+    xbeereader.zigbee = fakes.FakeXBee(fakes.xbee_frames(readings), rate)
+    xbeereader.devicemapping = {xbeereader.mac_address_to_str(fakes.PLUG_MAC): 'plugmeter'}
+
+    rfpi.start()
+    xbeereader.start()
+    started = time.time()
+
+    latencies = []
+    duplicates = 0
+    first_reading = None
+    expected = 2 * readings
+    while len(latencies) + duplicates < expected:
+        try:
+            msg = shared_queue.get(timeout=10)
+        except queue.Empty:
+            break
+        if msg is None:
+            duplicates += 1
+            continue
+        latencies.append((datetime.now() - msg.ts).total_seconds())
+        if first_reading is None:
+            first_reading = time.time()
+    end = time.time()
+
+    pids = [os.getpid()]
+    if mode == 'multiprocess':
+        pids += [rfpi.pid, xbeereader.pid]
+    rss = metrics.total_rss_kb(pids)
+
+    cpu = metrics.cpu_seconds() - cpu_before
+    if mode == 'multiprocess':
+        for reader in (rfpi, xbeereader):
+            reader.terminate()
+            reader.join()
+        cpu += metrics.cpu_seconds(children=True)
+
+    return {'mode': mode,
+            'startup_ms': round((started - start) * 1000, 3),
+            'first_reading_ms': round((first_reading - start) * 1000, 3) if first_reading else None,
+            'received': len(latencies),
+            'duplicates': duplicates,
+            'expected': expected,
+            'readings_per_sec': round(len(latencies) / (end - start), 1),
+            'rss_kb': rss,
+            'cpu_s': round(cpu, 3),
+            'latency_ms': metrics.latency_summary(latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readings', type=int, default=2000, help='readings per reader')
+    parser.add_argument('--rate', type=float, default=200, help='readings per second per reader, 0 for unpaced')
+    parser.add_argument('--mode', choices=['multiprocess', 'single'], action='append',
+                        help='mode to benchmark, may be given twice (default: both)')
+    args = parser.parse_args()
+
+    # every mode runs in a fresh process, so the numbers
+    # of one mode do not include the leftovers of the other
+    for mode in args.mode or ['multiprocess', 'single']:
+        if os.fork() == 0:
+            print(run_mode(mode, args.readings, args.rate), flush=True)
+            os._exit(0)
+        os.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+cpu cost of the logging done for every reading, comparing the former setup
+(root logger at DEBUG, synchronous FileHandlers, eagerly formatted messages)
+with util.logger_factory (queue with a background writer, lazy formatting,
+rate limiting, rotated files):
+
+    python -m benchmarks.logging_cost --readings 50000
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks import metrics
+from dto.temphdatatypes import TempHumidityMeasurements
+from util import logger_factory
+
+_logger = logging.getLogger('benchmarks.hotpath')
+
+# thread_time is not available before python 3.7
+_thread_time = getattr(time, 'thread_time', time.process_time)
+
+
+def setup_former_logging(directory):
+    """
+    the logging setup before the queue based logging
+    """
+    logging.basicConfig(level=logging.DEBUG, filename=os.devnull)
+    formatter = logging.Formatter('#ts:%(asctime)s#level:%(levelname)s#name:%(name)s%(message)s')
+    for file_name, level in (('errorlog-client.log', logging.ERROR), ('client.log', logging.DEBUG)):
+        handler = logging.FileHandler(os.path.join(directory, file_name))
+        handler.setLevel(level)
+        handler.setFormatter(formatter)
+        logging.getLogger('').addHandler(handler)
+
+
+def log_readings(readings, eager):
+    """
+    logs what RFPi, Reporter and CommunicationModule log for every reading
+    :param eager: (bool) format with '%' before calling the logger, as the former code did
+    """
+    to_be_acknowledged = {}
+    for i in range(readings):
+        line = '23 %s 0 0 0 7 1 30 0' % (i % 256)
+        msg = TempHumidityMeasurements(datetime.now(), 22.5, 0, 45.1, 3.3)
+        msg.device = i
+        to_be_acknowledged[i % 100] = [msg.__dict__] * 3
+
+        _logger.debug("#nextline:%s", line)
+        if eager:
+            _logger.debug('#debug:sending-buffered-data#data:%s' % msg)
+            _logger.debug("#debug:to_be_acknowledged-list:%s" % to_be_acknowledged)
+            if i % 10 == 0:
+                _logger.warning('#warn:corrupted-data-unable-to-decode:data:%s' % line.split(' '))
+        else:
+            _logger.debug('#debug:sending-buffered-data#data:%s', msg)
+            _logger.debug("#debug:to_be_acknowledged-list:%s", to_be_acknowledged)
+            if i % 10 == 0:
+                _logger.warning('#warn:corrupted-data-unable-to-decode:data:%s', line.split(' '))
+
+
+def run(setup, readings, level):
+    directory = tempfile.mkdtemp()
+    if setup == 'former':
+        setup_former_logging(directory)
+    else:
+        logger_factory.setup_logging(settings={'level': level, 'file': os.path.join(directory, 'client.log'),
+                                               'max_bytes': 5 * 1024 * 1024, 'backup_count': 3,
+                                               'console': False, 'queue_size': 10000,
+                                               'rate_limit': 10, 'rate_interval': 60})
+
+    cpu_before = metrics.cpu_seconds()
+    caller_before = _thread_time()
+    log_readings(readings, eager=(setup == 'former'))
+    caller = _thread_time() - caller_before
+    logger_factory.stop_logging()
+    logging.shutdown()
+    cpu = metrics.cpu_seconds() - cpu_before
+
+    written = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+    return {'setup': setup, 'level': level if setup == 'queued' else 'DEBUG', 'readings': readings,
+            'caller_cpu_us_per_reading': round(caller / readings * 1e6, 2),
+            'process_cpu_us_per_reading': round(cpu / readings * 1e6, 2),
+            'bytes_written': written}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readings', type=int, default=50000)
+    args = parser.parse_args()
+
+    # every setup runs in a fresh process, the logging module keeps global state
+    for setup, level in (('former', None), ('queued', 'DEBUG'), ('queued', 'INFO')):
+        if os.fork() == 0:
+            print(run(setup, args.readings, level), flush=True)
+            os._exit(0)
+        os.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import os
+import resource
+
+
+def rss_kb(pid=None):
+    """
+    resident set size of a process as reported by /proc
+    :param pid: (int) process id, None for the current process
+    :return: (int) rss in kB, None if it could not be read
+    """
+    try:
+        with open('/proc/%s/status' % (pid or 'self')) as fin:
+            for line in fin:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except (IOError, ValueError):
+        return None
+
+
+def total_rss_kb(pids):
+    """
+    :param pids: list of process ids, e.g. this process and the reader processes
+    :return: (int) summed rss in kB of all processes which could be read
+    """
+    return sum(rss for rss in (rss_kb(pid) for pid in pids) if rss)
+
+
+def cpu_seconds(children=False):
+    """
+    :param children: if True the cpu time of the terminated and joined
+    child processes is returned instead of the one of this process
+    :return: (float) user + system time in seconds
+    """
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def percentile(values, p):
+    """
+    nearest rank percentile
+    :param values: list of numbers
+    :param p: (float) percentile between 0 and 100
+    :return: the percentile, None for an empty list
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = int(round(p / 100.0 * (len(ordered) - 1)))
+    return ordered[rank]
+
+
+def latency_summary(values):
+    """
+    :param values: list of latencies in seconds
+    :return: (dict) p50, p90, p99 and max in milliseconds
+    """
+    summary = {}
+    for name, p in (('p50', 50), ('p90', 90), ('p99', 99), ('max', 100)):
+        value = percentile(values, p)
+        summary[name] = None if value is None else round(value * 1000, 3)
+    return summary
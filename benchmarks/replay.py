@@ -0,0 +1,119 @@
+"""
+replays captured or synthetic RFPi lines and XBee frames through
+Decoder.decode and ZigBeeReader.parse_response and reports the decoding
+throughput. run from the directory containing client.config:
+
+    python -m benchmarks.replay --readings 100000
+    python -m benchmarks.replay --rfpi-file captured-lines.txt --xbee-file captured-frames.p
+"""
+import argparse
+import pickle
+import time
+
+from benchmarks import fakes, metrics
+from rfpi.decoder import create_decoder
+from util.supervisor import ReaderStats
+from zigbee.zigbee_client import ZigBeeReaderBase
+
+
+def load_rfpi_lines(file_name):
+    """
+    :param file_name: text file with one line of the RFPi per line, as logged by '#nextline'
+    :return: list of bytes, each terminated by '\r\n'
+    """
+    with open(file_name, 'r') as fin:
+        return [(line.strip() + '\r\n').encode('ascii') for line in fin if line.strip()]
+
+
+def load_xbee_frames(file_name):
+    """
+    :param file_name: file with pickled frames of ZigBee.wait_read_frame, either
+    one pickled list or several pickled frames (e.g. the 'error-<count>.p' dumps)
+    :return: list of dictionaries
+    """
+    frames = []
+    with open(file_name, 'rb') as fin:
+        try:
+            while True:
+                data = pickle.load(fin)
+                frames.extend(data if isinstance(data, list) else [data])
+        except EOFError:
+            pass
+    return frames
+
+
+def replay_rfpi(lines, repeat=1):
+    """
+    :param lines: list of bytes as read from the serial port
+    :param repeat: (int) how often the lines are replayed
+    :return: (dict) the results
+    """
+    decoder = create_decoder()
+    decoded = failed = 0
+    cpu_before = metrics.cpu_seconds()
+    start = time.time()
+    for _ in range(repeat):
+        for line in lines:
+            try:
+                if decoder.decode(line.decode('ascii').strip()):
+                    decoded += 1
+                else:
+                    failed += 1
+            except Exception:
+                failed += 1
+    elapsed = time.time() - start
+    total = decoded + failed
+    return {'source': 'rfpi', 'lines': total, 'decoded': decoded, 'failed': failed,
+            'lines_per_sec': round(total / elapsed, 1) if elapsed else None,
+            'cpu_us_per_line': round((metrics.cpu_seconds() - cpu_before) / total * 1e6, 2) if total else None}
+
+
+def replay_xbee(frames, repeat=1):
+    """
+    :param frames: list of frames as returned by ZigBee.wait_read_frame
+    :param repeat: (int) how often the frames are replayed
+    :return: (dict) the results
+    """
+    reader = ZigBeeReaderBase(None, {}, stats=ReaderStats())
+    for frame in frames:
+        if 'source_addr_long' in frame:
+            reader.devicemapping[reader.mac_address_to_str(frame['source_addr_long'])] = 'plugmeter'
+
+    parsed = failed = 0
+    count = 0
+    cpu_before = metrics.cpu_seconds()
+    start = time.time()
+    for _ in range(repeat):
+        for frame in frames:
+            count += 1
+            if reader.parse_response(frame, count):
+                parsed += 1
+            else:
+                failed += 1
+    elapsed = time.time() - start
+    return {'source': 'xbee', 'frames': count, 'parsed': parsed, 'failed': failed,
+            'frames_per_sec': round(count / elapsed, 1) if elapsed else None,
+            'cpu_us_per_frame': round((metrics.cpu_seconds() - cpu_before) / count * 1e6, 2) if count else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readings', type=int, default=100000, help='synthetic lines/frames per source')
+    parser.add_argument('--rfpi-file', help='captured RFPi lines instead of synthetic ones')
+    parser.add_argument('--xbee-file', help='captured, pickled XBee frames instead of synthetic ones')
+    parser.add_argument('--repeat', type=int, default=1, help='how often captured data is replayed')
+    args = parser.parse_args()
+
+    if args.rfpi_file:
+        print(replay_rfpi(load_rfpi_lines(args.rfpi_file), args.repeat))
+    else:
+        print(replay_rfpi(fakes.rfpi_lines(args.readings)))
+
+    if args.xbee_file:
+        print(replay_xbee(load_xbee_frames(args.xbee_file), args.repeat))
+    else:
+        print(replay_xbee(fakes.xbee_frames(args.readings)))
+
+
+if __name__ == '__main__':
+    main()
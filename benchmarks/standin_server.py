@@ -0,0 +1,244 @@
+"""
+a local stand-in for the i13mon server speaking the protocol of the
+CommunicationModule: pickled MeasurementMessages are answered with pickled
+Acknowledgments, Requests may be sent to the client. the HELLO handshake
+(see communication.protocol) is answered unless --legacy is given.
+
+latency, lost acknowledgments and disconnects can be injected:
+
+    python -m benchmarks.standin_server --port 13456 --latency 0.05 --loss 0.01 --disconnect-every 500
+"""
+import argparse
+import asyncio
+import os
+import random
+import ssl
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks import metrics
+from communication import protocol
+from communication.concentrator import create_server_ssl_context
+from util.devices import legacy_field
+from message_types.ackknowledgment import Acknowledgment
+from message_types.requests import Request
+
+
+def make_self_signed_cert(directory):
+    """
+    creates a self signed certificate with the openssl command line tool
+    :param directory: (string) directory to write the files into
+    :return: (dict) {'certFile': ..., 'keyFile': ...} as in the [ssl] section of client.config
+    """
+    cert_file = os.path.join(directory, 'standin.pem')
+    key_file = os.path.join(directory, 'standin.key')
+    subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                           '-subj', '/CN=localhost', '-keyout', key_file, '-out', cert_file],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return {'certFile': cert_file, 'keyFile': key_file}
+
+
+class StandInServer():
+    """
+    counts what it receives and acknowledges the measurement messages
+    """
+
+    def __init__(self, latency=0, loss=0, disconnect_every=0, request_every=0, ask_lost=True, seed=None,
+                 clock_offset=0, hello=True):
+        """
+        :param latency: (float) seconds to wait before an acknowledgment is sent
+        :param loss: (float) probability that a message is not acknowledged
+        :param disconnect_every: (int) close the connection after every n-th message, 0 for never
+        :param request_every: (int) send a GET_MSG_COUNTER request after every n-th message, 0 for never
+        :param ask_lost: (bool) ask for the not acknowledged messages with the 'wanted' id of later acks
+        :param seed: seed of the random generator, for repeatable runs
+        :param clock_offset: (float) seconds the clock of the server is ahead, for TIME_SYNC requests
+        :param hello: (bool) answer HELLO requests, False to behave like a server without the handshake
+        """
+        self._latency = latency
+        self._loss = loss
+        self._disconnect_every = disconnect_every
+        self._request_every = request_every
+        self._ask_lost = ask_lost
+        self._random = random.Random(seed)
+        self._clock_offset = clock_offset
+        self._hello = hello
+        self._lost = []
+        self._seen = set()
+
+        self.connections = 0
+        self.messages = 0
+        self.readings = 0
+        self.duplicates = 0
+        self.health_batches = 0
+        self.device_tables = 0
+        # readings neither referring to a device of a table nor carrying its id
+        self.unattributed = 0
+        self._devices = set()
+        self.bytes_received = 0
+        self.latencies = []
+        self.first_receipt = None
+        self.last_receipt = None
+
+    @asyncio.coroutine
+    def handle_connection(self, reader, writer):
+        self.connections += 1
+        buffer = b''
+        # the features of the connection
+        connection = dict(protocol.LEGACY)
+        write = lambda message: writer.write(
+            protocol.encode_message(message, connection['framing'], connection['compression']))
+        try:
+            while True:
+                data = yield from reader.read(65536)
+                if not data:
+                    break
+                self.bytes_received += len(data)
+                messages, buffer = protocol.decode_messages(buffer + data, connection['framing'])
+                for message in messages:
+                    if self._hello and message.get_type() == 'request' and message.get_request() == 'HELLO':
+                        chosen = protocol.choose(message.get_response())
+                        message.set_response(chosen)
+                        write(message)
+                        connection.update(chosen)
+                        continue
+                    keep_open = yield from self.handle_message(message, writer, write)
+                    if not keep_open:
+                        return
+        except (ConnectionResetError, ssl.SSLError):
+            pass
+        finally:
+            writer.close()
+
+    @asyncio.coroutine
+    def handle_message(self, message, writer, write):
+        """
+        :param write: writes a message to the writer of the connection
+        :return: (bool) False if the connection has to be closed
+        """
+        if message.get_type() == 'request' and message.get_request() == 'TIME_SYNC':
+            times = message.get_response()
+            times['t2'] = time.time() + self._clock_offset
+            times['t3'] = time.time() + self._clock_offset
+            write(message)
+            yield from writer.drain()
+            return True
+
+        if message.get_type() == 'health':
+            self.health_batches += 1
+            return True
+
+        if message.get_type() == 'devices':
+            self.device_tables += 1
+            self._devices.update(message.get_devices())
+            return True
+
+        if message.get_type() != 'measurement':
+            return True
+
+        self.messages += 1
+        now = datetime.fromtimestamp(time.time() + self._clock_offset)
+        self.first_receipt = self.first_receipt or now
+        self.last_receipt = now
+        for reading in message.get_data() or []:
+            key = reading.get('seq')
+            key = reading.get('id') if key is None else key
+            if key in self._seen:
+                self.duplicates += 1
+                continue
+            self._seen.add(key)
+            self.readings += 1
+            if reading.get('device') not in self._devices and not reading.get(legacy_field(reading.get('type'))):
+                self.unattributed += 1
+            self.latencies.append((now - reading['ts']).total_seconds())
+
+        if self._random.random() < self._loss:
+            self._lost.append(message.get_id())
+        else:
+            wanted = self._lost.pop(0) if self._ask_lost and self._lost else None
+            ack = Acknowledgment(message.get_id(), wanted)
+            if self._latency:
+                # on its way, the next messages are received meanwhile
+                asyncio.get_event_loop().call_later(self._latency, write, ack)
+            else:
+                write(ack)
+
+        if self._request_every and self.messages % self._request_every == 0:
+            write(Request('GET_MSG_COUNTER', None))
+        yield from writer.drain()
+
+        if self._disconnect_every and self.messages % self._disconnect_every == 0:
+            return False
+        return True
+
+    def results(self):
+        """
+        :return: (dict) what the server has received
+        """
+        elapsed = (self.last_receipt - self.first_receipt).total_seconds() if self.first_receipt else 0
+        return {'connections': self.connections,
+                'messages': self.messages,
+                'readings': self.readings,
+                'duplicates': self.duplicates,
+                'health_batches': self.health_batches,
+                'device_tables': self.device_tables,
+                'unattributed': self.unattributed,
+                'readings_per_sec': round(self.readings / elapsed, 1) if elapsed else None,
+                'bytes_per_reading': round(self.bytes_received / self.readings, 1) if self.readings else None,
+                'latency_ms': metrics.latency_summary(self.latencies)}
+
+
+def serve(host, port, ssl_dict, options, results_queue=None, duration=None):
+    """
+    runs the stand-in server, in its own process when used by a benchmark
+    :param ssl_dict: (dict) certFile and keyFile of the server
+    :param options: (dict) keyword arguments of StandInServer
+    :param results_queue: (multiprocessing.Queue) receives StandInServer.results at the end
+    :param duration: (float) seconds to run, None to run until interrupted
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = StandInServer(**options)
+    loop.run_until_complete(asyncio.start_server(server.handle_connection, host, port,
+                                                 ssl=create_server_ssl_context(ssl_dict)))
+    try:
+        if duration:
+            loop.run_until_complete(asyncio.sleep(duration))
+        else:
+            loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    results = server.results()
+    if results_queue is not None:
+        results_queue.put(results)
+    else:
+        print(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=13456)
+    parser.add_argument('--cert', help='certificate file, a self signed one is created if omitted')
+    parser.add_argument('--key', help='key file of the certificate')
+    parser.add_argument('--latency', type=float, default=0, help='seconds before an ack is sent')
+    parser.add_argument('--loss', type=float, default=0, help='probability of a lost ack')
+    parser.add_argument('--disconnect-every', type=int, default=0, help='close the connection after n messages')
+    parser.add_argument('--request-every', type=int, default=0, help='send GET_MSG_COUNTER after n messages')
+    parser.add_argument('--clock-offset', type=float, default=0, help='seconds the server clock is ahead')
+    parser.add_argument('--legacy', action='store_true', help='do not answer the HELLO handshake')
+    args = parser.parse_args()
+
+    options = {'latency': args.latency, 'loss': args.loss, 'clock_offset': args.clock_offset, 'hello': not args.legacy,
+               'disconnect_every': args.disconnect_every, 'request_every': args.request_every}
+    if args.cert:
+        serve(args.host, args.port, {'certFile': args.cert, 'keyFile': args.key}, options)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            serve(args.host, args.port, make_self_signed_cert(directory), options)
+
+
+if __name__ == '__main__':
+    main()
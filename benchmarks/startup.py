@@ -0,0 +1,103 @@
+"""
+time to the first reading after the start of the client and after a crash
+of a reader process, using fake radios whose setup takes --setup-delay seconds
+per command written. compares the former startup (every radio set up one
+after the other by the main process) with the current one (every reader
+sets up its radio itself, in parallel). run from the directory containing client.config:
+
+    python -m benchmarks.startup --setup-delay 0.1
+"""
+import argparse
+import queue
+import subprocess
+import sys
+import time
+
+# the child measures from the moment the parent started it,
+# so the imports of the client are part of the measurement
+_CHILD = '--child'
+
+
+def child(scenario, spawned, setup_delay):
+    from benchmarks import fakes
+    import clientrun
+    from rfpi.interface_reader import RFPiBase
+    from util import cfg
+    from util.supervisor import ReaderStats, Supervisor
+    from zigbee import zigbee_client
+
+    RFPiBase.open_serial_port = staticmethod(
+        lambda port, baud: fakes.FakeSerial(fakes.rfpi_lines(100000), 100, setup_delay))
+    zigbee_client.open_zigbee_serialport = lambda port, baud: fakes.FakeXBee(fakes.xbee_frames(100000), 100, setup_delay)
+
+    shared_queue, factories = clientrun.create_readers(cfg.get_client_mode())
+    for name in factories:
+        if name.startswith('zigbee:'):
+            mac = zigbee_client.ZigBeeReaderBase.mac_address_to_str(fakes.PLUG_MAC)
+            factory = factories[name]
+            factories[name] = lambda stats, factory=factory: _with_plug(factory(stats), mac)
+
+    supervisor = Supervisor(check_interval=0.05, min_backoff=0.1)
+    if scenario == 'sequential':
+        # the former startup: the main process sets up one radio after the other
+        for name, factory in sorted(factories.items()):
+            reader = factory(ReaderStats())
+            reader.set_up()
+            reader.start()
+    else:
+        for name, factory in sorted(factories.items()):
+            supervisor.add(name, factory)
+        supervisor.start()
+
+    first = _first_reading(shared_queue)
+    results = {'scenario': scenario, 'readers': len(factories),
+               'first_reading_after_start_ms': round((first - spawned) * 1000, 1)}
+
+    if scenario == 'parallel':
+        # crash a reader process and wait for the first reading after its restart
+        name = sorted(factories)[0]
+        reader = supervisor.get_reader(name)
+        reader.terminate()
+        reader.join()
+        crashed = time.time()
+        before = supervisor.get_diagnostics()[name]['readings']
+        while supervisor.get_diagnostics()[name]['readings'] == before:
+            supervisor.check()
+            while not shared_queue.empty():
+                shared_queue.get()
+            time.sleep(0.01)
+        results['first_reading_after_crash_ms'] = round((time.time() - crashed) * 1000, 1)
+
+    print(results, flush=True)
+
+
+def _with_plug(reader, mac):
+    reader.devicemapping = {mac: 'plugmeter'}
+    return reader
+
+
+def _first_reading(shared_queue):
+    while True:
+        try:
+            if shared_queue.get(timeout=30):
+                return time.time()
+        except queue.Empty:
+            raise RuntimeError('no reading within 30s')
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == _CHILD:
+        child(sys.argv[2], float(sys.argv[3]), float(sys.argv[4]))
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--setup-delay', type=float, default=0.1, help='seconds per setup command of a fake radio')
+    args = parser.parse_args()
+
+    for scenario in ('sequential', 'parallel'):
+        subprocess.check_call([sys.executable, '-m', 'benchmarks.startup', _CHILD, scenario,
+                               repr(time.time()), repr(args.setup_delay)])
+
+
+if __name__ == '__main__':
+    main()
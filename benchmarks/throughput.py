@@ -0,0 +1,112 @@
+"""
+end-to-end throughput of the Reporter and the CommunicationModule against
+the local stand-in server, which runs in its own process. readings are
+decoded from synthetic RFPi lines and fed into the shared queue at a fixed rate.
+run from the directory containing client.config:
+
+    python -m benchmarks.throughput --rate 500 --duration 30 --latency 0.02 --loss 0.01
+    python -m benchmarks.throughput --rate 500 --batch-format columnar
+    python -m benchmarks.throughput --rate 500 --latency 0.02 --legacy
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+import time
+
+from benchmarks import fakes, metrics
+from benchmarks.standin_server import make_self_signed_cert, serve
+from communication.communication import create_ssl_context, CommunicationModule
+from communication.reporter import Reporter
+from rfpi.decoder import create_decoder
+from util.devices import get_device_table
+
+
+def produce(shared_queue, decoder, rate, stop):
+    """
+    decodes synthetic lines and puts them into the shared queue with a fixed rate
+    :param rate: (float) readings per second
+    :param stop: (threading.Event) ends the production
+    """
+    lines = [line.decode('ascii').strip() for line in fakes.rfpi_lines(65536)]
+    interval = 1.0 / rate
+    next_time = time.time()
+    count = 0
+    while not stop.is_set():
+        shared_queue.put(decoder.decode(lines[count % len(lines)]))
+        count += 1
+        next_time += interval
+        delay = next_time - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def run(rate, duration, port, server_options, batch_format='pickle'):
+    """
+    :param batch_format: (string) 'pickle' or 'columnar', see CommunicationModule
+    :return: (dict) the results of the client and the server
+    """
+    decoder = create_decoder()
+    # created before leaving the directory of client.config
+    devices = get_device_table()
+    directory = tempfile.mkdtemp()
+    ssl_dict = make_self_signed_cert(directory)
+
+    results_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=('localhost', port, ssl_dict, server_options,
+                                                          results_queue, duration + 5))
+    server.start()
+    time.sleep(1)
+
+    # the Reporter writes its buffered file into the working directory
+    os.chdir(directory)
+
+    shared_queue = queue.Queue()
+    cm = CommunicationModule('localhost', port, create_ssl_context(ssl_dict), batch_format=batch_format,
+                             devices=devices)
+    reporter = Reporter(shared_queue, cm)
+
+    stop = threading.Event()
+    producer = threading.Thread(target=produce, args=(shared_queue, decoder, rate, stop), daemon=True)
+
+    cpu_before = metrics.cpu_seconds()
+    loop = asyncio.get_event_loop()
+    reporter._loop = loop
+    loop.create_task(reporter.report())
+    producer.start()
+    loop.run_until_complete(asyncio.sleep(duration))
+    stop.set()
+    cpu = metrics.cpu_seconds() - cpu_before
+
+    client = {'rate': rate, 'duration': duration, 'batch_format': batch_format, 'rss_kb': metrics.rss_kb(),
+              'cpu_s': round(cpu, 3), 'left_in_queue': shared_queue.qsize(),
+              'to_be_acknowledged': len(cm._to_be_acknowledged)}
+
+    results = results_queue.get()
+    server.join()
+    return {'client': client, 'server': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rate', type=float, default=200, help='readings per second')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run')
+    parser.add_argument('--port', type=int, default=13457)
+    parser.add_argument('--latency', type=float, default=0, help='seconds before the server sends an ack')
+    parser.add_argument('--loss', type=float, default=0, help='probability of a lost ack')
+    parser.add_argument('--disconnect-every', type=int, default=0, help='server closes after n messages')
+    parser.add_argument('--request-every', type=int, default=0, help='server sends GET_MSG_COUNTER after n messages')
+    parser.add_argument('--batch-format', choices=('pickle', 'columnar'), default='pickle')
+    parser.add_argument('--legacy', action='store_true', help='the server does not answer the HELLO handshake')
+    args = parser.parse_args()
+
+    options = {'latency': args.latency, 'loss': args.loss, 'seed': 1, 'hello': not args.legacy,
+               'disconnect_every': args.disconnect_every, 'request_every': args.request_every}
+    print(run(args.rate, args.duration, args.port, options, args.batch_format))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+cost of the tls handshake and of a batch on an open connection against the
+local stand-in server, for TLS 1.2 with AES-GCM or ChaCha20 and for TLS 1.3,
+each with full and resumed handshakes. the server runs in its own process,
+the cpu time is the one of the client. run from the directory containing client.config:
+
+    python -m benchmarks.tls_handshake --handshakes 50 --batches 500
+"""
+import argparse
+import asyncio
+import multiprocessing
+import ssl
+import tempfile
+import time
+
+from benchmarks import fakes, metrics
+from benchmarks.standin_server import make_self_signed_cert, serve
+from communication.communication import create_ssl_context, CommunicationModule, _DEFAULT_TLS
+from message_types.requests import Request
+from rfpi.decoder import create_decoder
+
+# name -> (settings overriding the defaults, highest tls version)
+_VARIANTS = [('tls1.2-aesgcm', {'ciphers': 'ECDHE+AESGCM:!aNULL'}, 'TLSv1_2'),
+             ('tls1.2-chacha20', {'ciphers': 'ECDHE+CHACHA20:!aNULL'}, 'TLSv1_2'),
+             ('tls1.3', {'min_version': 'TLSv1_3'}, None)]
+
+
+def _create_context(ssl_dict, overrides, max_version, resume):
+    settings = dict(_DEFAULT_TLS, resume_sessions=resume, **overrides)
+    ssl_context = create_ssl_context(ssl_dict, settings)
+    if max_version:
+        ssl_context.maximum_version = getattr(ssl.TLSVersion, max_version)
+    return ssl_context
+
+
+@asyncio.coroutine
+def handshakes(port, ssl_context, count):
+    """
+    connects 'count' times, one request on each connection brings the session ticket
+    :return: (dict) handshake times, cpu per handshake and resumed sessions
+    """
+    times = []
+    reused = 0
+    cpu_before = metrics.cpu_seconds()
+    for _ in range(count):
+        start = time.time()
+        cm = CommunicationModule('localhost', port, ssl_context)
+        yield from cm.connect()
+        times.append(time.time() - start)
+        ssl_object = cm._writer.get_extra_info('ssl_object')
+        reused += bool(getattr(ssl_object, 'session_reused', False))
+
+        yield from cm.send_message(Request('TIME_SYNC', {'t1': 0}))
+        yield from cm.receive_message('TIME_SYNC')
+        cm._writer.close()
+    cpu = metrics.cpu_seconds() - cpu_before
+    return {'handshake_ms': metrics.latency_summary(times),
+            'cpu_ms_per_handshake': round(cpu / count * 1000, 3),
+            'resumed': reused}
+
+
+@asyncio.coroutine
+def batches(port, ssl_context, count):
+    """
+    sends 'count' measurement messages on one connection, each waiting for its ack
+    :return: (dict) round trip of a batch and cpu per batch
+    """
+    decoder = create_decoder()
+    readings = [decoder.decode(line.decode('ascii').strip()) for line in fakes.rfpi_lines(count * 3)]
+
+    cm = CommunicationModule('localhost', port, ssl_context)
+    yield from cm.connect()
+    times = []
+    cpu_before = metrics.cpu_seconds()
+    for reading in readings:
+        start = time.time()
+        yield from cm.send(reading)
+        if len(cm._to_be_sent) == 0:
+            times.append(time.time() - start)
+    cpu = metrics.cpu_seconds() - cpu_before
+    cm._writer.close()
+    return {'batch_ms': metrics.latency_summary(times),
+            'cpu_ms_per_batch': round(cpu / len(times) * 1000, 3) if times else None}
+
+
+def run(handshake_count, batch_count, port):
+    """
+    :return: (dict) variant -> results
+    """
+    directory = tempfile.mkdtemp()
+    ssl_dict = make_self_signed_cert(directory)
+    server = multiprocessing.Process(target=serve, args=('localhost', port, ssl_dict, {}, None, None))
+    server.daemon = True
+    server.start()
+    time.sleep(1)
+
+    loop = asyncio.get_event_loop()
+    results = {}
+    try:
+        for name, overrides, max_version in _VARIANTS:
+            full = loop.run_until_complete(
+                handshakes(port, _create_context(ssl_dict, overrides, max_version, False), handshake_count))
+            resumed = loop.run_until_complete(
+                handshakes(port, _create_context(ssl_dict, overrides, max_version, True), handshake_count))
+            batch = loop.run_until_complete(
+                batches(port, _create_context(ssl_dict, overrides, max_version, True), batch_count))
+            results[name] = {'full': full, 'resumed': resumed, 'batches': batch}
+    finally:
+        server.terminate()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--handshakes', type=int, default=50, help='connections per variant')
+    parser.add_argument('--batches', type=int, default=500, help='messages per variant')
+    parser.add_argument('--port', type=int, default=13458)
+    args = parser.parse_args()
+
+    for name, result in sorted(run(args.handshakes, args.batches, args.port).items()):
+        print(name, result)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,20 @@
+import asyncio
 import multiprocessing
+import queue
 
-from communication.communication import create_ssl_context, CommunicationModule
-from rfpi.decoder import create_decoder
-from rfpi.interface_reader import RFPi
-from util import cfg
+from util import cfg, profiling
 from util.cfg import get_rfpi_settings, get_ssl_settings
+from util.clock import ClockSync
+from util.dedup import Deduplicator
+from util.health import HealthMonitor
+from util.devices import get_device_table
 from util.logger_factory import setup_logging
-from zigbee.zigbee_client import ZigBeeReader
-from communication.reporter import Reporter
+from util.overload import OverloadQueue
+from util.sequence import SequenceCounter
+from util.shm_ring import RecordRing
+from util.source_queue import MergedQueue
+from util.supervisor import Supervisor, UplinkBacklog
+from communication.reporter import Reporter, BUFFER_FILE
 
 
 def get_zigbee_config():
@@ -25,23 +32,246 @@ def get_zigbee_config():
     return cd
 
 
+def _create_rfpi_factory(mode):
+    """
+    imports the RFPi reader, only done if it is enabled
+    :return: a callable taking the queue and the port of a reader and returning its factory
+    """
+    from rfpi.decoder import create_decoder
+    from rfpi.interface_reader import RFPi, RFPiThread
+
+    reader_class = RFPiThread if mode == 'single' else RFPi
+    decoder = create_decoder()
+    baud = get_rfpi_settings()['baud']
+    return lambda source_queue, port: lambda stats: reader_class(source_queue, decoder, port, baud, stats)
+
+
+def _create_zigbee_factory(mode, backlog=None):
+    """
+    imports the ZigBee reader, only done if it is enabled
+    :param backlog: (util.supervisor.UplinkBacklog) the reporting intervals of the plugs follow it
+    :return: a callable taking the queue and the port of a reader and returning its factory
+    """
+    from zigbee.zigbee_client import ZigBeeReader, ZigBeeReaderThread
+
+    reader_class = ZigBeeReaderThread if mode == 'single' else ZigBeeReader
+    devicemapping = get_zigbee_config()
+    baud = cfg.get_zigbee_baud()
+    control_settings = cfg.get_plug_control_settings()
+    if not control_settings.pop('enabled'):
+        control_settings = None
+    return lambda source_queue, port: lambda stats: reader_class(source_queue, devicemapping, port, baud, stats,
+                                                                 control_settings, backlog)
+
+
+def _create_batch_log(settings):
+    """
+    imports the batch log, only done if it is enabled
+    :param settings: (dict) as returned by cfg.get_batch_log_settings
+    :return: (communication.batch_log.BatchLog)
+    """
+    from communication.batch_log import BatchLog
+
+    return BatchLog(settings['directory'], settings['segment_bytes'], settings['max_segments'])
+
+
+def _create_executor(settings):
+    """
+    imports concurrent.futures, only done if the messages are encoded by workers
+    :param settings: (dict) as returned by cfg.get_encoder_settings
+    :return: (concurrent.futures.Executor) the pool of the workers
+    """
+    import concurrent.futures
+
+    if settings['kind'] == 'process':
+        return concurrent.futures.ProcessPoolExecutor(settings['workers'])
+    return concurrent.futures.ThreadPoolExecutor(settings['workers'])
+
+
+def _create_concentrator(settings, devices, create_module):
+    """
+    imports the concentrator, only done if it is enabled
+    :param settings: (dict) as returned by cfg.get_concentrator_settings
+    :param create_module: a callable returning a new CommunicationModule
+    :return: (tuple) the Concentrator, the coroutine serving the downstream
+    clients and the UpstreamPool used as the communication module
+    """
+    from communication.concentrator import Concentrator, UpstreamPool, create_server_ssl_context
+
+    concentrator = Concentrator(devices, BUFFER_FILE, settings['fsync'])
+    serve = concentrator.serve(settings['host'], settings['port'], create_server_ssl_context(get_ssl_settings()))
+    return concentrator, serve, UpstreamPool([create_module() for _ in range(settings['upstream_connections'])])
+
+
+def _create_sinks(sink_settings):
+    """
+    imports the sinks, only done if any is configured
+    :param sink_settings: list of the settings of the sinks, as returned by cfg.get_sink_settings
+    :return: list of the sinks, not yet started
+    """
+    if not sink_settings:
+        return []
+    from communication.sinks import create_sink
+
+    return [create_sink(settings) for settings in sink_settings]
+
+
+def _create_history(settings, devices):
+    """
+    imports the history store, only done if it is enabled
+    :param settings: (dict) as returned by cfg.get_history_settings
+    :return: (tuple) the HistoryStore and the coroutine serving its socket
+    """
+    from communication.history import HistoryStore
+
+    history = HistoryStore(devices, settings['capacity'], settings['max_buffer'])
+    return history, history.serve(settings['socket'])
+
+
+def create_readers(mode, transport='queue', health=None, backlog=None):
+    """
+    creates the queue read by the Reporter and the factories of the serial
+    readers feeding it, one reader per configured RFPi and XBee port.
+    the modules of a disabled kind of reader are not imported at all.
+
+    every reader gets its own bounded queue, the Reporter reads them round
+    robin through a MergedQueue, dropping frames received by several radios.
+    what happens when a queue is full is set by the overload policy.
+
+    :param mode: (string) 'multiprocess' runs every reader in its own process
+    and hands the measurements over a multiprocessing.Queue, 'single' runs
+    every reader as a thread of this process and hands them over in memory
+    :param transport: (string) 'ring' hands the measurements of the reader
+    processes over fixed size records in shared memory (see util.shm_ring)
+    instead of pickling them through a multiprocessing.Queue
+    :param health: (util.health.HealthMonitor) accounts for the frames of every device, None for none
+    :param backlog: (util.supervisor.UplinkBacklog) measurements waiting for the uplink, read by the ZigBee readers
+    :return: (tuple) the MergedQueue and a dictionary name -> factory, each
+    factory takes a ReaderStats and returns a new, not yet started reader
+    """
+    queue_size = cfg.get_source_queue_size()
+    if mode == 'single':
+        create_queue = lambda: queue.Queue(maxsize=queue_size)
+    elif mode == 'multiprocess' and transport == 'ring':
+        queue_size = cfg.get_ring_capacity()
+        create_queue = lambda: RecordRing(queue_size)
+    elif mode == 'multiprocess':
+        create_queue = lambda: multiprocessing.Queue(maxsize=queue_size)
+    else:
+        raise ValueError("unknown client mode: %s" % mode)
+
+    dedup_window = cfg.get_dedup_window()
+    merged_queue = MergedQueue(Deduplicator(dedup_window) if dedup_window > 0 else None, health)
+    overload_settings = cfg.get_overload_settings()
+
+    kinds = []
+    if cfg.is_rfpi_enabled():
+        kinds.append(('rfpi', cfg.get_rfpi_ports(), _create_rfpi_factory(mode)))
+    if cfg.is_zigbee_enabled():
+        kinds.append(('zigbee', cfg.get_zigbee_ports(), _create_zigbee_factory(mode, backlog)))
+
+    factories = {}
+    for name, ports, factory in kinds:
+        for port in ports:
+            # the queue outlives the restarts of its reader
+            source_queue = OverloadQueue(create_queue(), queue_size, buffer_file=BUFFER_FILE, **overload_settings)
+            merged_queue.add(source_queue)
+            factories['%s:%s' % (name, port)] = factory(source_queue, port)
+
+    return merged_queue, factories
+
+
 if __name__ == '__main__':
     setup_logging()
 
-    queue = multiprocessing.Queue(maxsize=0)
+    # the handles of the devices, inherited by the reader processes
+    devices = get_device_table()
+
+    # the supervisor starts the readers and restarts
+    # them whenever they die or (optionally) stall
+    supervisor = Supervisor(**cfg.get_supervisor_settings())
+
+    # the reception of every device, sent to the server as health batches
+    health_settings = cfg.get_health_settings()
+    health = HealthMonitor(supervisor.get_decode_failures, health_settings['interval'],
+                           health_settings['gap_factor']) if health_settings['enabled'] else None
+
+    # written next to the Reporter, read by the ZigBee readers adapting the reporting intervals
+    backlog = UplinkBacklog()
+
+    shared_queue, factories = create_readers(cfg.get_client_mode(), cfg.get_transport(), health, backlog)
+
+    from communication.communication import create_ssl_context, CommunicationModule
+
+    sslctx = create_ssl_context(get_ssl_settings(), cfg.get_tls_settings())
 
-    rfpi = RFPi(queue, create_decoder(), get_rfpi_settings()['port'], get_rfpi_settings()['baud'])
-    xbeereader = ZigBeeReader(queue, get_zigbee_config())
+    # the sequence numbers of the records and the ids of the
+    # messages continue where the previous run stopped
+    # live readings and the backlog are sent by the priority of their type
+    priorities = cfg.get_priority_settings()
+    # the readers stamp the measurements by the clock of the server
+    clock_settings = cfg.get_clock_settings()
+    # the features of the connection offered to the server
+    protocol_settings = cfg.get_protocol_settings()
+    # the server may ask for any message of the last segments of the batch log
+    batch_log_settings = cfg.get_batch_log_settings()
+    batch_log = _create_batch_log(batch_log_settings) if batch_log_settings['enabled'] else None
+    # the messages are encoded by a pool of workers, if any
+    encoder_settings = cfg.get_encoder_settings()
+    executor = _create_executor(encoder_settings) if encoder_settings['workers'] > 0 else None
+    msg_counter = SequenceCounter(cfg.get_msg_counter_file())
+    clock_sync = ClockSync(clock_settings['filter_size']) if clock_settings['sync'] else None
+    create_module = lambda: CommunicationModule(cfg.get_server_host(), cfg.get_server_port(), sslctx,
+                                                msg_counter, priorities, devices, cfg.get_batch_format(),
+                                                clock_sync, clock_settings['interval'],
+                                                cfg.get_socket_settings(), batch_log, protocol_settings,
+                                                executor)
 
-    sslctx = create_ssl_context(get_ssl_settings())
+    # a concentrator forwards the measurements of the downstream clients
+    # of its site with its own ones, over a few connections at once
+    concentrator_settings = cfg.get_concentrator_settings()
+    coroutines = []
+    if concentrator_settings['enabled']:
+        concentrator, serve, cm = _create_concentrator(concentrator_settings, devices, create_module)
+        coroutines.append(serve)
+    else:
+        concentrator = None
+        cm = create_module()
+    # the archive and local consumers, each writing at its own pace
+    sinks = _create_sinks(cfg.get_sink_settings())
+    for sink in sinks:
+        sink.start()
+    # the recent measurements of every device for local dashboards, queried on a unix socket
+    history_settings = cfg.get_history_settings()
+    if history_settings['enabled']:
+        history, serve = _create_history(history_settings, devices)
+        coroutines.append(serve)
+        sinks.append(history)
+    reporter = Reporter(shared_queue, cm, SequenceCounter(cfg.get_sequence_file()),
+                        priorities['backfill_batch'], sinks)
 
-    cm = CommunicationModule(cfg.get_server_host(), cfg.get_server_port(), sslctx)
-    reporter = Reporter(queue, cm)
+    if health is not None:
+        coroutines.append(health.report(cm))
+    coroutines.append(backlog.watch(reporter.get_backlog))
 
-    rfpi.set_up()
-    rfpi.start()
+    # one reader per configured radio
+    for name, factory in sorted(factories.items()):
+        supervisor.add(name, factory)
+    # the readers open and set up their radios in parallel
+    # while the reporter is already connecting to the server
+    supervisor.start()
 
-    xbeereader.set_up()
-    xbeereader.start()
+    # profiling is switched on and off with SIGUSR1, see [profiling]
+    profiler = profiling.install('main', asyncio.get_event_loop())
+    profiler.set_children(supervisor.get_pids)
+    profiler.add_probe('queues', shared_queue.sizes)
+    profiler.add_probe('ring_overruns', shared_queue.get_overruns)
+    profiler.add_probe('overload', shared_queue.get_overload_counters)
+    profiler.add_probe('reporter', reporter.get_diagnostics)
+    profiler.add_probe('readers', supervisor.get_diagnostics)
+    if concentrator is not None:
+        profiler.add_probe('concentrator', concentrator.get_diagnostics)
+    if health is not None:
+        profiler.add_probe('health', health.get_diagnostics)
 
-    reporter.run()
+    reporter.run(supervisor.watch(), *coroutines)
@@ -0,0 +1,177 @@
+import logging
+import mmap
+import os
+import pickle
+import re
+import struct
+
+_logger = logging.getLogger(__name__)
+
+# entry of the index: message id, offset and length of the batch in the data file
+_ENTRY = struct.Struct('<QQQ')
+
+_SEGMENT_NAME = re.compile(r'^batches-(\d+)\.log$')
+
+
+class _Segment():
+    """
+    the batches appended one after the other: the pickled batches back to back
+    in batches-<number>.log, the index in batches-<number>.index holds an entry
+    per batch in the order they were appended and is kept in memory as well
+    """
+
+    def __init__(self, directory, number):
+        self.number = number
+        self.data_file = os.path.join(directory, 'batches-%d.log' % number)
+        self.index_file = os.path.join(directory, 'batches-%d.index' % number)
+        self._data = None
+        self._index = None
+        self._map = None
+
+        # message id -> (offset, length), a later batch of the same id wins
+        self._entries = {}
+        self.size = os.path.getsize(self.data_file) if os.path.exists(self.data_file) else 0
+        try:
+            with open(self.index_file, 'rb') as fin:
+                index = fin.read()
+        except IOError:
+            index = b''
+        # an entry cut off by a crash is ignored
+        for msg_id, offset, length in _ENTRY.iter_unpack(index[:len(index) - len(index) % _ENTRY.size]):
+            if offset + length <= self.size:
+                self._entries[msg_id] = (offset, length)
+
+    def append(self, msg_id, payload):
+        if self._data is None:
+            self._data = open(self.data_file, 'ab')
+            self._index = open(self.index_file, 'ab')
+        offset = self.size
+        self._data.write(payload)
+        self._data.flush()
+        self._index.write(_ENTRY.pack(msg_id, offset, len(payload)))
+        self._index.flush()
+        self._entries[msg_id] = (offset, len(payload))
+        self.size += len(payload)
+
+    def read(self, msg_id):
+        """
+        :return: (memoryview) the pickled batch straight from the mapped data file, None if unknown
+        """
+        entry = self._entries.get(msg_id)
+        if entry is None:
+            return None
+        offset, length = entry
+
+        # the data file of the current segment grows, map it again if needed
+        if self._map is None or len(self._map) < offset + length:
+            self.close_map()
+            with open(self.data_file, 'rb') as fin:
+                self._map = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._map)[offset:offset + length]
+
+    def close_map(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # a view of a batch is still in use, the garbage collector unmaps it
+                pass
+            self._map = None
+
+    def close(self):
+        self.close_map()
+        if self._data is not None:
+            self._data.close()
+            self._index.close()
+            self._data = self._index = None
+
+    def remove(self):
+        self.close()
+        for file_name in (self.data_file, self.index_file):
+            try:
+                os.remove(file_name)
+            except OSError:
+                pass
+
+
+class BatchLog():
+    """
+    keeps every sent batch on disk, so that the server may ask for any of
+    the last messages again (the 'wanted' id of an acknowledgment) no matter
+    how long ago they were sent and even after a restart of the client
+
+    the log consists of segments of about 'segment_bytes', of which the last
+    'max_segments' are kept. the ids need not increase, e.g. the connections
+    of an UpstreamPool share the log and the counter of the message ids, the
+    newest batch of an id is found. the indexes of the segments are kept in
+    memory, the batches are read from the memory mapped data files without
+    copying them. so the memory grows with the number of batches only.
+    """
+
+    def __init__(self, directory='batches', segment_bytes=4 * 1024 * 1024, max_segments=16):
+        """
+        :param directory: (string) directory of the segment files, created if missing
+        :param segment_bytes: (int) size at which a new segment is started
+        :param max_segments: (int) number of segments kept, the oldest is deleted
+        """
+        self._directory = directory
+        self._segment_bytes = segment_bytes
+        self._max_segments = max_segments
+        os.makedirs(directory, exist_ok=True)
+
+        # the oldest first
+        self._segments = [_Segment(directory, int(match.group(1)))
+                          for match in (_SEGMENT_NAME.match(name) for name in os.listdir(directory)) if match]
+        self._segments.sort(key=lambda segment: segment.number)
+
+    def append(self, msg_id, batch):
+        """
+        :param msg_id: (int) id of the message
+        :param batch: list of the measurements (dictionaries) of the message
+        """
+        current = self._segments[-1] if self._segments else None
+        if current is None or current.size >= self._segment_bytes:
+            current = self._start_segment()
+        try:
+            current.append(msg_id, pickle.dumps(batch))
+        except IOError as e:
+            _logger.error("#error:could-not-log-the-batch#id:%s#error:%s", msg_id, e)
+
+    def _start_segment(self):
+        number = self._segments[-1].number + 1 if self._segments else 1
+        if self._segments:
+            self._segments[-1].close()
+        segment = _Segment(self._directory, number)
+        self._segments.append(segment)
+
+        while len(self._segments) > self._max_segments:
+            oldest = self._segments.pop(0)
+            _logger.debug("#debug:removing-batch-log-segment#number:%s", oldest.number)
+            oldest.remove()
+        return segment
+
+    def get(self, msg_id):
+        """
+        :param msg_id: (int) id of the message
+        :return: list of the measurements of the message, None if it is not kept (anymore)
+        """
+        for segment in reversed(self._segments):
+            view = segment.read(msg_id)
+            if view is None:
+                continue
+            try:
+                return pickle.loads(view)
+            finally:
+                view.release()
+        return None
+
+    def get_diagnostics(self):
+        """
+        :return: (dict) number of segments and their bytes on disk
+        """
+        return {'segments': len(self._segments),
+                'bytes': sum(segment.size for segment in self._segments)}
+
+    def close(self):
+        for segment in self._segments:
+            segment.close()
@@ -0,0 +1,127 @@
+import collections
+import uuid
+from array import array
+from datetime import datetime
+
+from util import records
+
+# columns every measurement type has, name -> typecode of the array
+# 'id' holds the 16 bytes of the uuid of each record
+_COMMON_COLUMNS = (('id', 'B'), ('seq', 'q'), ('device', 'I'), ('ts', 'd'))
+_ID_SIZE = 16
+
+# sequence number and device of the records without one
+_NO_SEQ = -1
+_NO_DEVICE = 0
+
+
+class _Table():
+    """
+    the columns of the measurements of one type
+    """
+
+    def __init__(self, measurement_type):
+        self.type = measurement_type
+        self.fields = records.FIELDS[measurement_type]
+        self.count = 0
+        self.columns = collections.OrderedDict((name, array(typecode)) for name, typecode in _COMMON_COLUMNS)
+        for name, kind in self.fields:
+            self.columns[name] = array('d')
+
+    def append(self, reading):
+        columns = self.columns
+        record_id = reading.get('id')
+        columns['id'].frombytes(record_id.bytes if record_id else bytes(_ID_SIZE))
+        seq = reading.get('seq')
+        columns['seq'].append(_NO_SEQ if seq is None else seq)
+        columns['device'].append(reading.get('device') or _NO_DEVICE)
+        columns['ts'].append(reading['ts'].timestamp())
+        for name, kind in self.fields:
+            columns[name].append(records.encode_value(reading.get(name), kind))
+        self.count += 1
+
+    def readings(self):
+        columns = self.columns
+        for row in range(self.count):
+            seq = columns['seq'][row]
+            reading = {'id': uuid.UUID(bytes=columns['id'][row * _ID_SIZE:(row + 1) * _ID_SIZE].tobytes()),
+                       'type': self.type,
+                       'seq': None if seq == _NO_SEQ else seq,
+                       'device': columns['device'][row] or None,
+                       'ts': datetime.fromtimestamp(columns['ts'][row])}
+            for name, kind in self.fields:
+                reading[name] = records.decode_value(columns[name][row], kind)
+            yield reading
+
+
+class ColumnarBatch():
+    """
+    the measurements of one message in columns: per measurement type an
+    array of the record ids, the sequence numbers, the device handles
+    (see util.devices), the timestamps and one array per value (nan for None)
+
+    appending a measurement appends to the arrays. on the wire the header
+    (types, columns and their sizes) is followed by the raw bytes of the
+    arrays, which are handed to the socket as they are, see buffers()
+    """
+
+    def __init__(self):
+        # type of the measurements -> _Table
+        self._tables = collections.OrderedDict()
+
+    def __len__(self):
+        return sum(table.count for table in self._tables.values())
+
+    def append(self, reading):
+        """
+        :param reading: (dict) a measurement as sent to the server (its __dict__)
+        :raises KeyError: for an unknown type of measurement
+        """
+        table = self._tables.get(reading['type'])
+        if table is None:
+            table = self._tables[reading['type']] = _Table(reading['type'])
+        table.append(reading)
+
+    def header(self):
+        """
+        :return: (list) [(type, count, [(column, typecode, bytes)])] in the order of buffers()
+        """
+        return [(table.type, table.count,
+                 [(name, column.typecode, len(column) * column.itemsize) for name, column in table.columns.items()])
+                for table in self._tables.values()]
+
+    def buffers(self):
+        """
+        :return: list of memoryviews on the arrays, in the order of the header
+        """
+        return [memoryview(column).cast('B') for table in self._tables.values() for column in table.columns.values()]
+
+    def nbytes(self):
+        return sum(view.nbytes for view in self.buffers())
+
+    @staticmethod
+    def from_buffers(header, payload):
+        """
+        restores a batch on the receiving side
+        :param header: as returned by header()
+        :param payload: (bytes) the buffers, as sent after the header
+        :return: (ColumnarBatch)
+        """
+        batch = ColumnarBatch()
+        position = 0
+        for measurement_type, count, columns in header:
+            table = _Table(measurement_type)
+            for name, typecode, size in columns:
+                column = array(typecode)
+                column.frombytes(payload[position:position + size])
+                table.columns[name] = column
+                position += size
+            table.count = count
+            batch._tables[measurement_type] = table
+        return batch
+
+    def readings(self):
+        """
+        :return: list of the measurements as dictionaries, as sent by the pickle format
+        """
+        return [reading for table in self._tables.values() for reading in table.readings()]
@@ -1,29 +1,131 @@
+import collections
 import logging
 import asyncio
 import pickle
+import socket
 import ssl
 
-from message_types import measurement_msg
+from communication import protocol
+from communication.columnar import ColumnarBatch
+from communication.priority import PriorityLanes
+from message_types import measurement_msg, registry
+from message_types.ackknowledgment import Acknowledgment
+from message_types.columnar_msg import ColumnarMeasurementMessage
+from message_types.devices import DeviceTableMessage
+from message_types.health import HealthMessage
+from message_types.requests import Request
+from util import clock, profiling
+from util.sequence import to_ranges
 
 _logger = logging.getLogger(__name__)
 
+# settings of the tls connection, see cfg.get_tls_settings
+_DEFAULT_TLS = {'min_version': 'TLSv1_2',
+                'ciphers': 'ECDHE+CHACHA20:ECDHE+AESGCM:!aNULL:!MD5',
+                'verify': False, 'ca_file': None, 'check_hostname': False,
+                'resume_sessions': True}
 
-def create_ssl_context(ssl_dict):
+# settings of the socket, see cfg.get_socket_settings
+_DEFAULT_SOCKET = {'nodelay': True, 'keepalive_idle': 60, 'keepalive_interval': 10, 'keepalive_count': 5}
+
+# what is offered to the server, see cfg.get_protocol_settings
+_DEFAULT_PROTOCOL = {'hello': True, 'features': protocol.FEATURES, 'window': 3, 'max_in_flight': 8}
+
+
+def create_measurement_message(msg_id, msg, encoding, offset):
+    """
+    :param msg: list of measurements (dictionaries)
+    :param encoding: (string) 'pickle' or 'columnar'
+    :param offset: (dict) how far the timestamps may be off, see clock.get_offset
+    :return: (tuple) the message of the measurements and the buffers following it
+    """
+    buffers = None
+    if msg and encoding == 'columnar':
+        batch = ColumnarBatch()
+        for measurement in msg:
+            batch.append(measurement)
+        buffers = batch.buffers()
+        message = ColumnarMeasurementMessage(msg_id, batch.header(), sum(view.nbytes for view in buffers))
+    else:
+        message = measurement_msg.MeasurementMessage(id=msg_id, data=msg)
+
+    # the sequence numbers of the records as ranges, so that the
+    # server can drop records it already has without looking at them
+    if msg:
+        message.set_seq_ranges(to_ranges(m['seq'] for m in msg if m.get('seq') is not None))
+
+    message.set_clock(offset)
+    return message, buffers
+
+
+def encode_measurement_message(msg_id, msg, encoding, offset, framing, compression):
+    """
+    creates the message of the measurements and encodes it, run by the workers of an executor
+    :return: list of bytes-like objects to write, see protocol.encode_chunks
+    """
+    message, buffers = create_measurement_message(msg_id, msg, encoding, offset)
+    return protocol.encode_chunks(message, buffers, framing, compression)
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    """
+    a SSLContext resuming the tls session of the previous connection, so that
+    a reconnect skips the expensive part of the handshake (key exchange and
+    certificate checks), asyncio has no other way to pass the session on
+    """
+    session = None
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        if session is None and not server_side:
+            session = self.session
+        if session is None:
+            return super().wrap_bio(incoming, outgoing, server_side, server_hostname)
+        return super().wrap_bio(incoming, outgoing, server_side, server_hostname, session)
+
+
+def create_ssl_context(ssl_dict, settings=None):
     """
         loads the ssl certificate for secure communication
         :param ssl_dict: dictionary consisting of certification file, key
         keys: certFile, keyFile
+        :param settings: (dict) as returned by cfg.get_tls_settings, defaults if None:
+        TLS 1.2 or newer, ChaCha20 preferred over AES (the ARM of the Pi has no AES
+        instructions), no verification of the server and resumed sessions
         :returns ssl.SSLContext
         """
     _logger.debug("#debug:loading-ssl-certificates")
+    settings = settings or _DEFAULT_TLS
     try:
-        # choosing the version of the SSL Protocol
-        ssl_context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        # choosing the version of the SSL Protocol,
+        # the sessions can be resumed from python 3.6 on
+        if settings['resume_sessions'] and hasattr(ssl, 'SSLSession'):
+            ssl_context = ResumingSSLContext(ssl.PROTOCOL_SSLv23)
+        else:
+            ssl_context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
         ssl_context.options |= ssl.OP_NO_SSLv2
         ssl_context.options |= ssl.OP_NO_SSLv3
+        if hasattr(ssl, 'TLSVersion'):
+            ssl_context.minimum_version = getattr(ssl.TLSVersion, settings['min_version'])
+        else:
+            ssl_context.options |= ssl.OP_NO_TLSv1 | ssl.OP_NO_TLSv1_1
+
+        # the cipher suites of TLS 1.3 can not be chosen, OpenSSL
+        # prefers ChaCha20 itself on a CPU without AES instructions
+        if settings['ciphers']:
+            ssl_context.set_ciphers(settings['ciphers'])
         ssl_context.load_cert_chain(certfile=ssl_dict["certFile"], keyfile=ssl_dict["keyFile"])
-        ssl_context.verify_mode = ssl.CERT_NONE
-        ssl_context.check_hostname = False
+
+        # the trust material is loaded once and kept by the context for every reconnect
+        if settings['verify']:
+            ssl_context.verify_mode = ssl.CERT_REQUIRED
+            if settings['ca_file']:
+                ssl_context.load_verify_locations(cafile=settings['ca_file'])
+            else:
+                ssl_context.load_default_certs(ssl.Purpose.SERVER_AUTH)
+            ssl_context.check_hostname = settings['check_hostname']
+        else:
+            ssl_context.check_hostname = False
+            ssl_context.verify_mode = ssl.CERT_NONE
         _logger.info("#info:ssl-certificates-loaded!")
         return ssl_context
 
@@ -39,44 +141,142 @@ class CommunicationModule():
 
     _to_be_acknowledged: is a dictionary, where keys are message_id and values
     are the message itself, which is a list of dictionaries, each dictionary represents
-    a measurement
-
-    _to_be_sent: which is a list of dictionaries, each dictionary represents
-    a measurement
+    a measurement. with a BatchLog the messages are only kept on disk (value None)
+
+    _to_be_sent: the measurements (dictionaries) waiting to be sent, in
+    weighted lanes per measurement type and live vs. backfill (see PriorityLanes).
+    the Reporter adds the measurements (add) and has the next message sent by
+    their priority (flush), the lanes hold more than one message meanwhile
+
+    right after connecting, the client offers the features of the connection in
+    a HELLO request (see communication.protocol) and the server answers with the
+    ones it chose: framing, encoding of the measurements, compression, window
+    and ack style. a server which does not know the request is spoken to as before.
+
+    with an executor the messages of measurements are pickled and compressed by
+    its workers, the loop only does the socket io meanwhile. with pipelined acks
+    up to 'max_in_flight' messages are encoded at once, they are written in the
+    order of their ids as soon as they are encoded (_encoding).
     """
 
-    def __init__(self, server_host, server_port, ssl_context):
+    def __init__(self, server_host, server_port, ssl_context, msg_counter=None, priorities=None, devices=None,
+                 batch_format='pickle', clock_sync=None, sync_interval=600, socket_settings=None, batch_log=None,
+                 protocol_settings=None, executor=None):
+        """
+        :param msg_counter: (util.sequence.SequenceCounter) persistent counter
+        for the message ids, without it the ids restart at 1 with every run
+        :param priorities: (dict) 'weights' and 'live_factor' as returned by
+        cfg.get_priority_settings, all lanes weigh the same if None
+        :param devices: (util.devices.DeviceTable) the table of the device handles
+        in the measurements, sent to the server on every new connection and when it grew
+        :param batch_format: (string) 'pickle' sends the measurements as a list of
+        dictionaries, 'columnar' as typed columns following the message (see ColumnarBatch)
+        :param clock_sync: (util.clock.ClockSync) measures the offset of the clock to the
+        server on every new connection and every 'sync_interval' seconds, None not to
+        :param socket_settings: (dict) as returned by cfg.get_socket_settings, defaults if None
+        :param batch_log: (communication.batch_log.BatchLog) keeps every sent message on disk,
+        so the server can ask for it again long after, None to keep the not acknowledged in memory
+        :param protocol_settings: (dict) as returned by cfg.get_protocol_settings, defaults if None
+        :param executor: (concurrent.futures.Executor) thread or process pool encoding the
+        messages of measurements, None to encode them in the loop
+        """
         self._server_host = server_host
         self._server_port = server_port
         self._ssl_context = ssl_context
+        self._socket_settings = socket_settings or _DEFAULT_SOCKET
+        self._batch_log = batch_log
+        self._protocol_settings = protocol_settings or _DEFAULT_PROTOCOL
+        self._executor = executor
+        self._session_remembered = False
+        self._devices = devices
+        self._devices_sent = 0
+        self._batch_format = batch_format
+        self._clock_sync = clock_sync
+        self._sync_interval = sync_interval
+        self._next_sync = 0
+        # the server answers TIME_SYNC requests, once it did not it is not asked again (as for HELLO)
+        self._sync_supported = True
         self._reader = None
         self._writer = None
 
+        # the features of the connection as chosen by the server, the server knows
+        # the HELLO request (as far as known), with length framing the frames
+        # received (or the exception ending the connection) and the task reading them
+        self._protocol = dict(protocol.LEGACY)
+        self._hello_supported = True
+        self._frames = None
+        self._frame_reader = None
+
+        # with pipelined acks: id -> local time of the messages sent and not acknowledged yet
+        self._in_flight = collections.OrderedDict()
+
+        # with an executor and pipelined acks: (id, measurements, what was taken from
+        # _to_be_sent, future of the encoded message) in the order of the ids, and
+        # the exception writing them failed with, raised by the next send()
+        self._encoding = collections.deque()
+        self._encoding_error = None
+
+        # type of the messages of the server -> their handler, and the same for its requests
+        self._handlers = {Acknowledgment: self.handle_ack, Request: self.handle_request}
+        self._request_handlers = {'GET_MSG_COUNTER': self.handle_get_msg_counter,
+                                  'TIME_SYNC': self.handle_late_response,
+                                  'HELLO': self.handle_late_response}
+
         # dictionary of Messages which
         # have not been acknowledged
         self._to_be_acknowledged = {}
 
-        # the length of each message, number of
-        #  measurements to be send together
-        self._WINDOW_SIZE = 3
-
-        # the message that will be sent to the server
-        # a list of measurements, size : _WINDOW_SIZE
-        # each time this list is reach to its limit, a
-        # message will be sent and list will be emptied
-        self._to_be_sent = []
+        # message id -> what was taken from _to_be_sent for its measurements read back
+        # from the buffered file, until the server acknowledged the message, and the
+        # number of those acknowledged, see settled_backfill. the ones of a message
+        # whose ack is given up (or lost with the connection) are sent again
+        self._backfill = {}
+        self._settled = 0
 
-        # giving ids to the messages
-        self._MSG_COUNTER = 0
+        # the length of each message, number of
+        #  measurements to be send together, the
+        #  server may make it smaller
+        self._WINDOW_SIZE = self._protocol_settings['window']
+
+        # the measurements that will be sent to the server,
+        # with every flush() the next _WINDOW_SIZE chosen
+        # by their priority are sent
+        priorities = priorities or {}
+        self._to_be_sent = PriorityLanes(priorities.get('weights'), priorities.get('live_factor', 1))
+
+        # giving ids to the messages, the persistent counter continues
+        # with the ids of the previous run after a restart, so the
+        # server does not have to ask for it (GET_MSG_COUNTER)
+        self._msg_counter = msg_counter
+        self._MSG_COUNTER = msg_counter.current() if msg_counter else 0
 
     @asyncio.coroutine
     def connect(self):
+        # keep a connection which is still open, e.g. after an unpredicted exception
+        if self.is_connected():
+            _logger.debug("#debug:reusing-the-connection")
+            return
+
         # get a connection
         try:
             self._reader, self._writer = yield from \
                 asyncio.open_connection(
                     self._server_host, self._server_port,
                     ssl=self._ssl_context)
+            self._set_socket_options()
+            self._session_remembered = False
+            yield from self.negotiate()
+
+            ssl_object = self._writer.get_extra_info('ssl_object')
+            if ssl_object is not None:
+                _logger.info("#info:connected#version:%s#cipher:%s#session-reused:%s",
+                             ssl_object.version(), ssl_object.cipher()[0], getattr(ssl_object, 'session_reused', None))
+
+            # the measurements only refer to their devices by handle
+            if self._devices is not None and self._protocol['devices'] == 'table':
+                yield from self.send_device_table()
+
+            yield from self.sync_clock()
         except Exception as e:
             _logger.exception(e)
 
@@ -86,50 +286,399 @@ class CommunicationModule():
             raise e
 
     @asyncio.coroutine
-    def send(self, msg):
+    def negotiate(self):
+        """
+        agrees with the server on the features of the connection, the HELLO request
+        offers the configured ones (the configured batch format first) and the
+        answer holds the ones the server chose. a server which does not answer
+        it, or answers with something else, is spoken to as before from then on,
+        one choosing features which were not offered on this connection
+        """
+        self._stop_frame_reader()
+        self._restore_encoding()
+        self._encoding_error = None
+        self._protocol = dict(protocol.LEGACY)
+        self._WINDOW_SIZE = self._protocol_settings['window']
+        for msg_id in list(self._backfill):
+            self._give_up(msg_id)
+        self._in_flight.clear()
+        if not self._protocol_settings['hello'] or not self._hello_supported:
+            return
+
+        features = dict(self._protocol_settings['features'])
+        if self._devices is None:
+            # without a table the handles of the measurements would mean nothing to the server
+            features['devices'] = [devices for devices in features['devices'] if devices != 'table'] or ['ids']
+        features['encoding'] = sorted(features['encoding'], key=lambda encoding: encoding != self._batch_format)
+        yield from self.send_message(Request('HELLO', protocol.offer(features, self._WINDOW_SIZE)))
+        data = yield from self.receive_message('HELLO')
+
+        try:
+            response = pickle.loads(data) if data else None
+        except pickle.PickleError:
+            response = None
+        if response is None or response.get_type() != 'request' or response.get_request() != 'HELLO':
+            _logger.info("#info:server-does-not-know-the-handshake#using-the-legacy-protocol")
+            self._hello_supported = False
+            if response is not None:
+                yield from self.handle_response(data)
+            return
+
+        accepted = protocol.accept(response.get_response(), features)
+        if accepted is None:
+            _logger.warn("#warn:server-chose-features-not-offered#using-the-legacy-protocol#chosen:%s",
+                         response.get_response())
+            return
+        self._protocol = accepted
+        if self._protocol['window']:
+            self._WINDOW_SIZE = min(self._WINDOW_SIZE, self._protocol['window'])
+        _logger.info("#info:protocol-negotiated#version:%s#framing:%s#encoding:%s#compression:%s#ack:%s#window:%s",
+                     self._protocol['version'], self._protocol['framing'], self._protocol['encoding'],
+                     self._protocol['compression'], self._protocol['ack'], self._WINDOW_SIZE)
+
+        if self._protocol['framing'] == 'length':
+            self._frames = asyncio.Queue()
+            self._frame_reader = asyncio.get_event_loop().create_task(self._read_frames(self._reader, self._frames))
+
+    @asyncio.coroutine
+    def _read_frames(self, reader, frames):
+        """
+        reads the frames of the server into the queue, ended by the exception closing the connection
+        """
+        try:
+            while True:
+                frame = yield from protocol.read_frame(reader)
+                frames.put_nowait(frame)
+        except asyncio.IncompleteReadError:
+            frames.put_nowait(ConnectionResetError("the server closed the connection"))
+        except (OSError, ssl.SSLError) as e:
+            frames.put_nowait(e)
+
+    def _stop_frame_reader(self):
+        if self._frame_reader is not None:
+            self._frame_reader.cancel()
+        self._frames = self._frame_reader = None
+
+    def is_connected(self):
+        """
+        :return: (bool) True if the connection to the server is (as far as known) still open
+        """
+        if self._writer is None:
+            return False
+        transport = self._writer.transport
+        closing = transport.is_closing() if hasattr(transport, 'is_closing') else False
+        return not closing and not self._reader.at_eof() and self._reader.exception() is None
+
+    def _set_socket_options(self):
+        """
+        sends the small messages without waiting for more data (no nagle) and
+        detects a dead connection by tcp keepalive instead of the next send
+        """
+        sock = self._writer.get_extra_info('socket')
+        if sock is None:
+            return
+        settings = self._socket_settings
+        try:
+            if settings['nodelay']:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if settings['keepalive_idle'] > 0:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                # linux only
+                for option, value in (('TCP_KEEPIDLE', settings['keepalive_idle']),
+                                      ('TCP_KEEPINTVL', settings['keepalive_interval']),
+                                      ('TCP_KEEPCNT', settings['keepalive_count'])):
+                    if hasattr(socket, option):
+                        sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+        except OSError as e:
+            _logger.warn("#warn:could-not-set-socket-options#error:%s", e)
+
+    def _remember_session(self):
+        """
+        keeps the tls session for resuming it on the next connection, with
+        TLS 1.3 the session ticket arrives after the handshake with the first data
+        """
+        if self._session_remembered or not isinstance(self._ssl_context, ResumingSSLContext):
+            return
+        ssl_object = self._writer.get_extra_info('ssl_object')
+        session = ssl_object.session if ssl_object is not None else None
+        if session is not None and session.has_ticket:
+            self._ssl_context.session = session
+            self._session_remembered = True
+
+    @asyncio.coroutine
+    def send_device_table(self):
+        """
+        sends the table of the device handles, handles are only ever added to it
+        """
+        self._devices_sent = len(self._devices)
+        yield from self.send_message(DeviceTableMessage(self._devices.to_dict()))
+
+    @asyncio.coroutine
+    def send_health(self, period, fields, devices):
+        """
+        sends a health batch (see util.health), not acknowledged, only if the server chose the feature
+        :param period: (float) seconds summarized
+        :param fields: names of the counters
+        :param devices: (dict) handle -> list of the counters
+        :return: (bool) False if the server does not take health batches
+        """
+        if self._protocol['health'] != 'summary':
+            _logger.debug("#debug:the-server-does-not-take-health-batches")
+            return False
+        if self._protocol['devices'] != 'table' and self._devices is not None:
+            # a server without the device table gets the ids of the devices
+            devices = dict((self._devices.device(handle), counters) for handle, counters in devices.items())
+        yield from self.send_message(HealthMessage(period, fields, devices))
+        return True
+
+    def pending(self, live=None):
+        """
+        :param live: (bool) True for the live, False for the backfill measurements only, None for all
+        :return: (int) number of measurements waiting for the next message
+        """
+        return len(self._to_be_sent) if live is None else self._to_be_sent.count(live)
+
+    def ready(self):
+        """
+        :return: (bool) True if enough measurements are waiting for a message,
+        so flush() sends it and waits for the acknowledgment of the server
+        """
+        return len(self._to_be_sent) >= self._WINDOW_SIZE
+
+    def get_lanes(self):
+        """
+        :return: (PriorityLanes) the measurements waiting to be sent
+        """
+        return self._to_be_sent
+
+    def set_lanes(self, lanes):
+        """
+        takes the measurements to be sent from the given lanes, e.g. the
+        ones of the other connections of an UpstreamPool
+        :param lanes: (PriorityLanes) as returned by get_lanes of another module
+        """
+        self._to_be_sent = lanes
+
+    def add(self, msg, live=True):
         """
         called by Reporter
-        sends the measurement alongside the previously buffered messages if the limit (_WINDOW_SIZE)
-        has been reached(by calling send_message), otherwise appends it to the buffered list (to_be_sent)
+        appends the measurement to its lane, it is sent by a later flush()
         :param msg: an instance of an object representing a measurement
+        :param live: (bool) False for a measurement read back from the buffered file
         """
-        try:
+        self._to_be_sent.add(msg.__dict__, live)
 
-            msg = msg.__dict__
-            self._to_be_sent.append(msg)
+    @asyncio.coroutine
+    def send(self, msg, live=True):
+        """
+        adds the measurement and sends the next message if enough are waiting, see add and flush
+        """
+        # writing an encoded message failed meanwhile, raised before the measurement
+        # is taken, so the caller still has the one not sent
+        self._raise_encoding_error()
+        self.add(msg, live)
+        yield from self.flush()
+
+    def _raise_encoding_error(self):
+        if self._encoding_error is not None:
+            error, self._encoding_error = self._encoding_error, None
+            raise error
+
+    @asyncio.coroutine
+    def flush(self):
+        """
+        called by Reporter
+        sends the next message (by calling send_message) if the limit (_WINDOW_SIZE) has been reached,
+        its measurements are taken from the lanes (to_be_sent) by their priority
+        """
+        try:
+            # writing an encoded message failed meanwhile,
+            # its measurements are back in their lanes
+            self._raise_encoding_error()
 
             # check if the _message can be send
-            if len(self._to_be_sent) >= self._WINDOW_SIZE:
+            if self.ready():
+
+                if self._clock_sync is not None and clock.local_time() >= self._next_sync:
+                    yield from self.sync_clock()
+
+                # e.g. a concentrator learned the devices of a new downstream client
+                if self._devices is not None and self._protocol['devices'] == 'table' and \
+                        len(self._devices) != self._devices_sent:
+                    yield from self.send_device_table()
 
-                # getting the first _WinDOW_SIZE items
-                message = self._to_be_sent[0:self._WINDOW_SIZE]
+                # getting the next _WINDOW_SIZE items by their priority
+                message = self._to_be_sent.take(self._WINDOW_SIZE)
+                taken = self._to_be_sent.last_take()
 
                 # creating the message, giving a new id
                 # to the message, and send it to the server
-                self._MSG_COUNTER += 1
-                yield from self.send_measurement(self._MSG_COUNTER, message)
-                response = yield from self.receive_message(self._MSG_COUNTER)
+                self._MSG_COUNTER = self._msg_counter.next() if self._msg_counter else self._MSG_COUNTER + 1
+
+                # encoded by a worker meanwhile, written once it and the ones before are encoded
+                if self._executor is not None and self._protocol['ack'] == 'pipelined':
+                    self._encode_later(self._MSG_COUNTER, message, taken)
+                    if len(self._encoding) >= self._protocol_settings['max_in_flight']:
+                        with profiling.stage('communication.wait_for_encoding'):
+                            yield from asyncio.wait([self._encoding[0][3]])
+                            yield from self.write_encoded()
+                    with profiling.stage('communication.collect_acks'):
+                        yield from self.collect_acks()
+                    return
+
+                try:
+                    with profiling.stage('communication.send'):
+                        yield from self.send_measurement(self._MSG_COUNTER, message)
+                    if self._batch_log is not None:
+                        with profiling.stage('communication.batch_log'):
+                            self._batch_log.append(self._MSG_COUNTER, message)
+                    if self._protocol['ack'] == 'pipelined':
+                        response = None
+                    else:
+                        with profiling.stage('communication.wait_for_ack'):
+                            response = yield from self.receive_message(self._MSG_COUNTER)
+                except Exception:
+                    # they are sent again with the next message
+                    self._to_be_sent.restore(taken)
+                    raise
 
                 # adding the message to the to_be_acknowledged dictionary
-                self._to_be_acknowledged[self._MSG_COUNTER] = message
+                self._keep(self._MSG_COUNTER, message, taken)
 
-                # removing message from _to_be_sent list
-                self._to_be_sent = self._to_be_sent[self._WINDOW_SIZE:]
-
-                if response:
+                if self._protocol['ack'] == 'pipelined':
+                    with profiling.stage('communication.collect_acks'):
+                        yield from self.collect_acks()
+                elif response:
                     yield from self.handle_response(response)
                 else:
-                    _logger.warn("#warn:no-ack-received-from-server-for-msg-%s" % self._MSG_COUNTER)
+                    _logger.warn("#warn:no-ack-received-from-server-for-msg-%s", self._MSG_COUNTER)
+                    self._give_up(self._MSG_COUNTER)
             else:
-                _logger.debug("#debug:msg-will-be-send-later-len(to_be_sent):%s" % len(self._to_be_sent))
+                _logger.debug("#debug:msg-will-be-send-later-len(to_be_sent):%s", len(self._to_be_sent))
 
         except Exception as e:
-            _logger.error("#error:error-occurred-while-sending-the-message:%s" % msg)
+            _logger.error("#error:error-occurred-while-sending-the-message:%s", self._MSG_COUNTER)
             _logger.exception(e)
 
             # to be handled by the upper class Reporter
             raise e
 
+    def _keep(self, msg_id, message, taken):
+        """
+        keeps a message which has been written until it is acknowledged
+        :param taken: what was taken from _to_be_sent for it, see PriorityLanes.last_take
+        """
+        self._to_be_acknowledged[msg_id] = message if self._batch_log is None else None
+        if self._protocol['ack'] == 'pipelined':
+            self._in_flight[msg_id] = clock.local_time()
+
+        backfill = [(lane, reading) for lane, reading in taken if not lane[1]]
+        if backfill:
+            self._backfill[msg_id] = backfill
+
+    def _forget(self, msg_id):
+        """
+        undoes _keep for a message which could not be written
+        """
+        self._to_be_acknowledged.pop(msg_id, None)
+        self._in_flight.pop(msg_id, None)
+        self._backfill.pop(msg_id, None)
+
+    def _settle(self, msg_id):
+        self._settled += len(self._backfill.pop(msg_id, ()))
+
+    def _give_up(self, msg_id):
+        """
+        puts the measurements read back from the buffered file of a message whose
+        ack did not arrive back to their lanes, they are sent again with the next
+        messages (the server drops them by their sequence numbers if it has them)
+        """
+        backfill = self._backfill.pop(msg_id, None)
+        if backfill:
+            self._to_be_sent.restore(backfill)
+
+    def settled_backfill(self):
+        """
+        :return: (int) the measurements read back from the buffered file whose message
+        has been acknowledged by the server since the start, the Reporter keeps them
+        in the file until then
+        """
+        return self._settled
+
+    def _encode(self, msg_id, msg):
+        """
+        the message is created by the worker as well, a process gets the
+        measurements as they are and pickles them only once
+        :return: (asyncio.Future) the chunks of the message as encoded by a worker of the executor
+        """
+        msg, encoding = self._prepare_measurements(msg)
+        return asyncio.get_event_loop().run_in_executor(self._executor, encode_measurement_message, msg_id, msg,
+                                                        encoding, clock.get_offset(), self._protocol['framing'],
+                                                        self._protocol['compression'])
+
+    def _encode_later(self, msg_id, msg, taken):
+        """
+        hands the message to the executor, it is written by write_encoded once it is its turn
+        :param taken: what was taken from _to_be_sent for it, see PriorityLanes.last_take
+        """
+        future = self._encode(msg_id, msg)
+        self._encoding.append((msg_id, msg, taken, future))
+        future.add_done_callback(lambda _: asyncio.get_event_loop().create_task(self.write_encoded()))
+
+    @asyncio.coroutine
+    def write_encoded(self):
+        """
+        writes the encoded messages at the front of _encoding, in the order of their ids
+        """
+        while self._encoding and self._encoding[0][3].done():
+            msg_id, msg, taken, future = self._encoding.popleft()
+            # kept before it is written, its ack may arrive while draining
+            if self._batch_log is not None:
+                self._batch_log.append(msg_id, msg)
+            self._keep(msg_id, msg, taken)
+            try:
+                for chunk in future.result():
+                    self._writer.write(chunk)
+                _logger.debug('#debug:sending-message-with-id-:%s-and-size:%s', msg_id, len(msg))
+                yield from self._writer.drain()
+            except Exception as e:
+                # this one and the ones after it are sent again with the next messages
+                self._forget(msg_id)
+                self._encoding.appendleft((msg_id, msg, taken, future))
+                self._restore_encoding()
+                self._encoding_error = e
+                return
+
+    def _restore_encoding(self):
+        """
+        puts the measurements of the messages not written yet back to _to_be_sent
+        """
+        while self._encoding:
+            msg_id, msg, taken, future = self._encoding.pop()
+            self._to_be_sent.restore(taken)
+
+    @asyncio.coroutine
+    def collect_acks(self):
+        """
+        with pipelined acks: handles the responses which arrived meanwhile and waits
+        for the oldest ack while 'max_in_flight' messages are not acknowledged. an ack
+        which does not arrive in time is given up, the server asks for what it missed
+        """
+        while not self._frames.empty():
+            data = self._frames.get_nowait()
+            if isinstance(data, Exception):
+                raise data
+            yield from self.handle_response(data)
+
+        if len(self._in_flight) >= self._protocol_settings['max_in_flight']:
+            oldest = next(iter(self._in_flight))
+            response = yield from self.receive_message(oldest)
+            if response:
+                yield from self.handle_response(response)
+            else:
+                self._in_flight.pop(oldest, None)
+                self._give_up(oldest)
+
     @asyncio.coroutine
     def send_measurement(self, msg_id, msg):
         """
@@ -138,13 +687,64 @@ class CommunicationModule():
         :param msg: list of dictionaries
         :return:
         """
-        message = measurement_msg.MeasurementMessage(id=msg_id, data=msg)
-
         if msg:
             # when we are sending a measurement and msg is not None
-            _logger.debug('#debug:sending-message-with-id-:%s-and-size:%s' % (msg_id, len(msg)))
+            _logger.debug('#debug:sending-message-with-id-:%s-and-size:%s', msg_id, len(msg))
+
+        if msg and self._executor is not None:
+            chunks = yield from self._encode(msg_id, msg)
+            for chunk in chunks:
+                self._writer.write(chunk)
+            yield from self._writer.drain()
+        else:
+            msg, encoding = self._prepare_measurements(msg)
+            message, buffers = create_measurement_message(msg_id, msg, encoding, clock.get_offset())
+            yield from self.send_message(message, buffers)
+
+    def _prepare_measurements(self, msg):
+        """
+        :return: (tuple) the measurements as the server understands them and their encoding
+        """
+        encoding = self._protocol['encoding'] if self._protocol['version'] else self._batch_format
+        if msg and self._protocol['devices'] != 'table':
+            # a server without the device table gets the ids of the devices as before
+            if self._devices is not None:
+                msg = [self._devices.to_legacy(measurement) for measurement in msg]
+            encoding = 'pickle'
+        return msg, encoding
 
-        yield from self.send_message(message)
+    @asyncio.coroutine
+    def sync_clock(self):
+        """
+        measures the offset of the local clock to the clock of the server with
+        a TIME_SYNC request: {'t1': sent} is answered with {'t1', 't2': received, 't3': answered}
+        """
+        if self._clock_sync is None or not self._sync_supported:
+            return
+        self._next_sync = clock.local_time() + self._sync_interval
+
+        t1 = clock.local_time()
+        yield from self.send_message(Request('TIME_SYNC', {'t1': t1}))
+        data = yield from self.receive_message('TIME_SYNC')
+        t4 = clock.local_time()
+
+        if not data:
+            # the server does not know the request, do not wait for it again on any connection
+            _logger.warn("#warn:clock-not-synchronized#server-did-not-answer")
+            self._sync_supported = False
+            return
+
+        try:
+            response = pickle.loads(data)
+        except pickle.PickleError:
+            _logger.error("#error:Pickling-error-while-analyzing-message:%s", data)
+            return
+        if response.get_type() == 'request' and response.get_request() == 'TIME_SYNC':
+            times = response.get_response()
+            offset, delay = self._clock_sync.sample(times['t1'], times['t2'], times['t3'], t4)
+            _logger.info("#info:clock-synchronized#offset:%.6f#delay:%.6f", offset, delay)
+        else:
+            yield from self.handle_response(data)
 
     @asyncio.coroutine
     def receive_message(self, msg_id):
@@ -154,25 +754,34 @@ class CommunicationModule():
         :return: (bytes) response sent by server
         """
         try:
-            data = yield from asyncio.wait_for(self._reader.read(1000), timeout=3)
+            if self._frames is not None:
+                data = yield from asyncio.wait_for(self._frames.get(), timeout=3)
+                if isinstance(data, Exception):
+                    raise data
+            else:
+                data = yield from asyncio.wait_for(self._reader.read(1000), timeout=3)
+            self._remember_session()
             return data
 
         except asyncio.TimeoutError:
-            _logger.warn("#warn:timeout-reached-while-waiting-for-ack-msg:%s" % msg_id)
+            _logger.warn("#warn:timeout-reached-while-waiting-for-ack-msg:%s", msg_id)
 
     @asyncio.coroutine
-    def send_message(self, message):
+    def send_message(self, message, buffers=None):
         """
         Sends a message to the server
         :param msg_id: (int) id of the message
         :param message: an inherited instance of GeneralMessage
         (@see general_message.GeneralMessage)
+        :param buffers: list of buffers (memoryviews) following the message,
+        written as they are without packing them into bytes first
         """
         # packing the message into bytes
-        byte_message = pickle.dumps(message)
+        chunks = protocol.encode_chunks(message, buffers, self._protocol['framing'], self._protocol['compression'])
 
         # sending the message to the server
-        self._writer.write(byte_message)
+        for chunk in chunks:
+            self._writer.write(chunk)
         yield from self._writer.drain()
 
     @asyncio.coroutine
@@ -186,20 +795,19 @@ class CommunicationModule():
             message = pickle.loads(message)
 
             # message must be a subclass of GeneralMessage
-            _logger.debug("received-msg-of-type-%s: " % message.get_type())
+            _logger.debug("received-msg-of-type-%s: ", message.get_type())
 
-            if message.get_type() == 'ack':
-                yield from self.handle_ack(message)
-            elif message.get_type() == 'request':
-                yield from self.handle_request(message)
+            handler = self._handlers.get(registry.get_class(message.get_type()))
+            if handler is not None:
+                yield from handler(message)
             else:
-                _logger.warn("#warn:unknown-message-type-received:%s" % message.get_type())
+                _logger.warn("#warn:unknown-message-type-received:%s", message.get_type())
         except pickle.PickleError:
-            _logger.error("#error:Pickling-error-while-analyzing-message:%s" % message)
+            _logger.error("#error:Pickling-error-while-analyzing-message:%s", message)
         except KeyError:
-            _logger.warn("#debug:-corrupted-message-received-%s" % message)
+            _logger.warn("#debug:-corrupted-message-received-%s", message)
         except AttributeError:
-            _logger.error("#error:message-is-corrupted-%s" % message)
+            _logger.error("#error:message-is-corrupted-%s", message)
 
     @asyncio.coroutine
     def handle_ack(self, ack):
@@ -209,57 +817,96 @@ class CommunicationModule():
         :return:
         """
         try:
-            _logger.debug("#debug:ack:%s" % ack)
+            _logger.debug("#debug:ack:%s", ack)
 
             # checking and removing the delivered message from
             #  our waiting list
+            self._in_flight.pop(ack.get_success(), None)
+            self._settle(ack.get_success())
             if ack.get_success() in self._to_be_acknowledged:
                 self._to_be_acknowledged.pop(ack.get_success())
             else:
-                _logger.warn("#debug:acknowledgment-received-for-non-existing-message-id:%s" % ack.get_success())
-                _logger.debug("#debug:to_be_acknowledged-list:%s" % self._to_be_acknowledged)
+                _logger.warn("#debug:acknowledgment-received-for-non-existing-message-id:%s", ack.get_success())
+                _logger.debug("#debug:to_be_acknowledged-list:%s", self._to_be_acknowledged)
 
             # if the server asked for a specific
             # msg id send the wanted message
             if ack.get_wanted():
 
-                # send the msg if we have it in buffer
-                if ack.get_wanted() in self._to_be_acknowledged:
+                # the message is either in the buffer or in the batch log
+                wanted = self._to_be_acknowledged.get(ack.get_wanted())
+                if wanted is None and self._batch_log is not None:
+                    wanted = self._batch_log.get(ack.get_wanted())
+
+                # send the msg if we have it
+                if wanted is not None:
 
                     # sending the message to the server
-                    _logger.debug("#debug:sending-wanted-message-id: %s" % ack.get_wanted())
-                    yield from self.send_measurement(ack.get_wanted(), self._to_be_acknowledged[ack.get_wanted()])
-                    response = yield from self.receive_message(ack.get_wanted)
+                    _logger.debug("#debug:sending-wanted-message-id: %s", ack.get_wanted())
+                    yield from self.send_measurement(ack.get_wanted(), wanted)
+                    response = yield from self.receive_message(ack.get_wanted())
                     yield from self.handle_response(response)
 
                 # the msg asked by server does not exists
                 # in buffer
                 else:
-                    _logger.warn("#debug:acknowledgment-received-for-non-existing-message-id:%s" % ack.get_wanted())
-                    _logger.debug("#debug:to_be_acknowledged-list:%s" % self._to_be_acknowledged)
+                    _logger.warn("#debug:acknowledgment-received-for-non-existing-message-id:%s", ack.get_wanted())
+                    _logger.debug("#debug:to_be_acknowledged-list:%s", self._to_be_acknowledged)
 
                     # sending None for this message_id
                     # server will stop requesting for this id
                     yield from self.send_measurement(ack.get_wanted(), None)
 
         except pickle.PickleError:
-            _logger.error("#error:Pickleing-error-while-analyzing-ack:%s" % ack)
+            _logger.error("#error:Pickleing-error-while-analyzing-ack:%s", ack)
         except KeyError:
-            _logger.warn("#debug:-corrupted-ack-received-%s" % ack)
+            _logger.warn("#debug:-corrupted-ack-received-%s", ack)
 
     @asyncio.coroutine
     def handle_request(self, msg):
+        """
+        handles a request sent by the server by its handler
+        :param msg: an instance of type requests.Request message type
+        :return:
+        """
+        handler = self._request_handlers.get(msg.get_request())
+        if handler is not None:
+            yield from handler(msg)
+        else:
+            _logger.warn("#warn:unknown-request-received:%s", msg.get_request())
+
+    @asyncio.coroutine
+    def handle_get_msg_counter(self, msg):
         """
         handles a request for getting message counter of the client by
         the server, sends the server the news value for the _MSG_COUNTER
         :param msg: an instance of type requests.Request message type
-        :return:
         """
+        msg.set_response(self._MSG_COUNTER)
+        yield from self.send_message(msg)
+
+    @asyncio.coroutine
+    def handle_late_response(self, msg):
+        """
+        the answer to a request of the client which arrived after it stopped waiting for it
+        """
+        _logger.debug("#debug:late-response-ignored:%s", msg.get_request())
 
-        if msg.get_request() == 'GET_MSG_COUNTER':
-            msg.set_response(self._MSG_COUNTER)
-            yield from self.send_message(msg)
+    def get_diagnostics(self):
+        """
+        :return: (dict) sizes of the buffers, used by the profiler
+        """
+        return {'to_be_sent': len(self._to_be_sent),
+                'lanes': self._to_be_sent.sizes(),
+                'batch_log': self._batch_log.get_diagnostics() if self._batch_log is not None else None,
+                'to_be_acknowledged': len(self._to_be_acknowledged),
+                'in_flight': len(self._in_flight),
+                'encoding': len(self._encoding),
+                'protocol': '%(framing)s/%(encoding)s/%(compression)s/%(ack)s' % self._protocol,
+                'msg_counter': self._MSG_COUNTER}
 
     def disconnect(self):
         _logger.info("#info:disconnecting-the-communication-module...")
+        self._stop_frame_reader()
+        self._restore_encoding()
         self._writer.close()
@@ -0,0 +1,404 @@
+import asyncio
+import collections
+import logging
+import os
+import pickle
+import ssl
+
+from communication import protocol
+from communication.reporter import BUFFER_FILE
+from dto.forwardeddatatypes import ForwardedMeasurement
+from message_types import registry
+from message_types.ackknowledgment import Acknowledgment
+from message_types.devices import DeviceTableMessage
+from message_types.measurement_msg import MeasurementMessage
+from message_types.requests import Request
+from util import clock, profiling
+from util.overload import appending
+
+_logger = logging.getLogger(__name__)
+
+# number of measurement ids remembered, for dropping
+# the measurements a downstream client sends again
+_SEEN_IDS = 65536
+
+_READ_SIZE = 65536
+
+# the features the downstream clients may choose, their health
+# batches would not reach the server (see communication.protocol)
+_FEATURES = dict((name, values) for name, values in protocol.FEATURES.items() if name != 'health')
+
+
+def create_server_ssl_context(ssl_dict):
+    """
+    :param ssl_dict: (dict) certFile and keyFile, as in the [ssl] section of client.config
+    :return: (ssl.SSLContext) for accepting connections
+    """
+    ssl_context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+    ssl_context.options |= ssl.OP_NO_SSLv2
+    ssl_context.options |= ssl.OP_NO_SSLv3
+    ssl_context.load_cert_chain(certfile=ssl_dict['certFile'], keyfile=ssl_dict['keyFile'])
+    return ssl_context
+
+
+class _Downstream():
+    """
+    the connection of a downstream client
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        # handle of the downstream client -> own handle
+        self.handles = {}
+        # the features of the connection, see communication.protocol
+        self.protocol = dict(protocol.LEGACY)
+
+    def write(self, message):
+        self.writer.write(protocol.encode_message(message, self.protocol['framing'], self.protocol['compression']))
+
+
+class Concentrator():
+    """
+    concentrator mode: the clients of a site connect to this client instead
+    of the server, speaking the same protocol (see CommunicationModule), and
+    their measurements are forwarded together with the own ones
+
+    a message of a downstream client is acknowledged as soon as its
+    measurements are appended to the buffered file of the Reporter (and
+    synced to the disk), from where they are sent upstream. the Reporter
+    keeps them in the file until the server acknowledged them, so nothing
+    acknowledged gets lost, not even by a crash of the concentrator. the
+    measurements of all connections waiting meanwhile are appended (and
+    synced) together by a worker thread, not in the event loop.
+
+    the device handles of a downstream client are translated into the ones
+    of the own DeviceTable, which is sent to the server again when it grew,
+    and the measurements get new sequence numbers from the own counter.
+    measurements a client sends again (its ack got lost) are dropped by their id.
+    TIME_SYNC requests are answered by the clock synchronized to the server,
+    HELLO requests by the features of communication.protocol the client offered.
+    """
+
+    def __init__(self, devices, buffer_file=BUFFER_FILE, fsync=True):
+        """
+        :param devices: (util.devices.DeviceTable) the own table of the device handles
+        :param buffer_file: (string) buffered file of the Reporter
+        :param fsync: (bool) sync the buffered file to the disk before acknowledging
+        """
+        self._devices = devices
+        self._buffer_file = buffer_file
+        self._fsync = fsync
+        self._server = None
+
+        # ids of the last forwarded measurements, oldest first
+        self._seen = collections.OrderedDict()
+
+        # (measurements, future) waiting to be appended to the buffered file,
+        # and the task appending them
+        self._to_buffer = []
+        self._buffering = None
+
+        # type of the messages of the downstream clients -> their handler, and the same for their requests
+        self._handlers = {DeviceTableMessage: self.handle_devices, MeasurementMessage: self.handle_measurement,
+                          Request: self.handle_request}
+        self._request_handlers = {'TIME_SYNC': self.handle_time_sync, 'HELLO': self.handle_hello}
+
+        self._connections = 0
+        self._messages = 0
+        self._forwarded = 0
+        self._duplicates = 0
+
+    @asyncio.coroutine
+    def serve(self, host, port, ssl_context=None):
+        """
+        starts accepting the downstream clients
+        :param ssl_context: (ssl.SSLContext) see create_server_ssl_context, None for plain tcp
+        """
+        self._server = yield from asyncio.start_server(self.handle_connection, host, port, ssl=ssl_context)
+        _logger.info("#info:concentrator-listening#host:%s#port:%s", host, port)
+
+    @asyncio.coroutine
+    def handle_connection(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        _logger.info("#info:downstream-client-connected#peer:%s", peer)
+        self._connections += 1
+
+        downstream = _Downstream(writer)
+        buffer = b''
+        try:
+            while True:
+                data = yield from reader.read(_READ_SIZE)
+                if not data:
+                    break
+                messages, buffer = protocol.decode_messages(buffer + data, downstream.protocol['framing'])
+                for message in messages:
+                    yield from self.handle_message(message, downstream)
+        except (ConnectionResetError, ssl.SSLError) as e:
+            _logger.warn("#warn:downstream-connection-lost#peer:%s#error:%s", peer, e)
+        except IOError as e:
+            # not acknowledged, the client sends the message again
+            _logger.error("#error:could-not-buffer-the-downstream-measurements#peer:%s#error:%s", peer, e)
+        finally:
+            self._connections -= 1
+            writer.close()
+
+    @asyncio.coroutine
+    def handle_message(self, message, downstream):
+        """
+        :param message: an inherited instance of GeneralMessage sent by a downstream client
+        :param downstream: (_Downstream) the connection of the client
+        """
+        received = clock.timestamp()
+        handler = self._handlers.get(registry.get_class(message.get_type()))
+        if handler is not None:
+            yield from handler(message, downstream, received)
+        else:
+            _logger.debug("#debug:downstream-message-ignored#type:%s", message.get_type())
+
+    @asyncio.coroutine
+    def handle_devices(self, message, downstream, received):
+        """
+        translates the device handles of the client from now on
+        """
+        devices = message.get_devices()
+        self._devices.add(devices.values())
+        downstream.handles.clear()
+        downstream.handles.update((handle, self._devices.handle(device)) for handle, device in devices.items())
+
+    @asyncio.coroutine
+    def handle_measurement(self, message, downstream, received):
+        """
+        forwards the measurements and acknowledges the message once they are buffered
+        """
+        self._messages += 1
+        with profiling.stage('concentrator.buffer'):
+            yield from self.forward(message.get_data() or (), downstream.handles)
+        downstream.write(Acknowledgment(message.get_id(), None))
+        yield from downstream.writer.drain()
+
+    @asyncio.coroutine
+    def handle_request(self, message, downstream, received):
+        """
+        handles a request of the client by its handler
+        """
+        handler = self._request_handlers.get(message.get_request())
+        if handler is not None:
+            yield from handler(message, downstream, received)
+        else:
+            _logger.debug("#debug:downstream-request-ignored#request:%s", message.get_request())
+
+    @asyncio.coroutine
+    def handle_time_sync(self, message, downstream, received):
+        """
+        answers with the clock synchronized to the server
+        :param received: (float) timestamp the request was received at
+        """
+        times = message.get_response()
+        times['t2'] = received
+        times['t3'] = clock.timestamp()
+        downstream.write(message)
+        yield from downstream.writer.drain()
+
+    @asyncio.coroutine
+    def handle_hello(self, message, downstream, received):
+        """
+        answers with the features chosen from the ones the client offered
+        """
+        # answered as offered, the chosen features hold from the next message on
+        chosen = protocol.choose(message.get_response(), _FEATURES)
+        message.set_response(chosen)
+        downstream.write(message)
+        downstream.protocol = chosen
+        yield from downstream.writer.drain()
+
+    @asyncio.coroutine
+    def forward(self, readings, handles):
+        """
+        appends the measurements of a downstream message to the buffered file
+        :param readings: list of the measurements (dictionaries) of the message
+        :param handles: (dict) handle of the downstream client -> own handle
+        :raises IOError: if they could not be written, the message must not be acknowledged
+        """
+        forwarded = []
+        for reading in readings:
+            if reading.get('id') in self._seen:
+                self._duplicates += 1
+                continue
+            # the sequence number is given by the Reporter
+            if 'device' in reading:
+                reading = dict(reading, device=handles.get(reading['device']))
+            else:
+                # a client without the device table sends the ids of the devices
+                reading = self._devices.from_legacy(reading)
+            forwarded.append(ForwardedMeasurement(dict(reading, seq=None)))
+        if not forwarded:
+            return
+
+        future = asyncio.Future()
+        self._to_buffer.append((forwarded, future))
+        if self._buffering is None or self._buffering.done():
+            self._buffering = asyncio.get_event_loop().create_task(self._buffer())
+        yield from future
+
+        for measurement in forwarded:
+            self._seen[measurement.id] = None
+        while len(self._seen) > _SEEN_IDS:
+            self._seen.popitem(last=False)
+        self._forwarded += len(forwarded)
+
+    @asyncio.coroutine
+    def _buffer(self):
+        """
+        appends what the connections handed over meanwhile, in a worker thread
+        """
+        loop = asyncio.get_event_loop()
+        while self._to_buffer:
+            waiting, self._to_buffer = self._to_buffer, []
+            try:
+                yield from loop.run_in_executor(None, self._append, [measurement for forwarded, future in waiting
+                                                                     for measurement in forwarded])
+            except Exception as e:
+                for forwarded, future in waiting:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for forwarded, future in waiting:
+                    if not future.done():
+                        future.set_result(None)
+
+    def _append(self, measurements):
+        with appending(self._buffer_file) as fout:
+            for measurement in measurements:
+                pickle.dump(measurement, fout)
+            fout.flush()
+            if self._fsync:
+                os.fsync(fout.fileno())
+
+    def get_diagnostics(self):
+        """
+        :return: (dict) downstream connections and counts of the forwarded measurements, used by the profiler
+        """
+        return {'connections': self._connections,
+                'messages': self._messages,
+                'forwarded': self._forwarded,
+                'duplicates': self._duplicates}
+
+
+class UpstreamPool():
+    """
+    a few connections to the server, used by the Reporter as one
+    CommunicationModule. a message is sent on an idle connection while the
+    others still wait for the acknowledgments of theirs, so up to one
+    message per connection is on its way at once. the connections take the
+    measurements of their messages from the same lanes, so their priorities
+    hold across all of them.
+
+    the modules have to share the message counter (and the batch log), so
+    the server may ask for a message on any of the connections.
+    """
+
+    def __init__(self, modules):
+        """
+        :param modules: list of CommunicationModules, one per connection
+        """
+        self._modules = modules
+        for module in modules[1:]:
+            module.set_lanes(modules[0].get_lanes())
+
+        # module -> task sending its message and waiting for the ack
+        self._sending = {}
+
+    @asyncio.coroutine
+    def connect(self):
+        for module in self._modules:
+            yield from module.connect()
+
+    def add(self, msg, live=True):
+        """
+        appends the measurement to the lanes shared by the modules
+        """
+        self._modules[0].add(msg, live)
+
+    def ready(self):
+        return self._modules[0].ready()
+
+    @asyncio.coroutine
+    def send(self, msg, live=True):
+        self.add(msg, live)
+        yield from self.flush()
+
+    @asyncio.coroutine
+    def flush(self):
+        """
+        if enough measurements are waiting, an idle module sends the next message in the background
+        :raises: the exception of a module which failed meanwhile, for the Reporter
+        """
+        module = yield from self._next_idle()
+        if module.ready():
+            self._sending[module] = asyncio.get_event_loop().create_task(module.flush())
+
+    @asyncio.coroutine
+    def _next_idle(self):
+        """
+        :return: the first idle module, waits for one if all are sending
+        """
+        while True:
+            self._collect()
+            idle = [module for module in self._modules if module not in self._sending]
+            if idle:
+                return idle[0]
+            yield from asyncio.wait(list(self._sending.values()), return_when=asyncio.FIRST_COMPLETED)
+
+    def _collect(self):
+        """
+        removes the finished sends, raises the exception of the first failed one
+        """
+        failed = None
+        for module, task in list(self._sending.items()):
+            if task.done():
+                del self._sending[module]
+                if failed is None and not task.cancelled():
+                    failed = task.exception()
+        if failed is not None:
+            # its measurements are sent again with its next message
+            raise failed
+
+    def pending(self, live=None):
+        """
+        :return: (int) the measurements waiting for their messages, see CommunicationModule.pending
+        """
+        return self._modules[0].pending(live)
+
+    def settled_backfill(self):
+        """
+        :return: (int) see CommunicationModule.settled_backfill, of all modules
+        """
+        return sum(module.settled_backfill() for module in self._modules)
+
+    def is_connected(self):
+        return any(module.is_connected() for module in self._modules)
+
+    @asyncio.coroutine
+    def send_health(self, period, fields, devices):
+        """
+        sends the health batch on the first open connection
+        :return: (bool) True if it was sent
+        """
+        for module in self._modules:
+            if module.is_connected():
+                return (yield from module.send_health(period, fields, devices))
+        return False
+
+    def get_diagnostics(self):
+        """
+        :return: (dict) the diagnostics of the modules, used by the profiler
+        """
+        diagnostics = {'sending': len(self._sending),
+                       'upstream': [module.get_diagnostics() for module in self._modules],
+                       'to_be_sent': self.pending()}
+        diagnostics['to_be_acknowledged'] = sum(upstream['to_be_acknowledged'] for upstream in diagnostics['upstream'])
+        return diagnostics
+
+    def disconnect(self):
+        for module in self._modules:
+            module.disconnect()
@@ -0,0 +1,247 @@
+import asyncio
+import bisect
+import json
+import logging
+import os
+from array import array
+
+from util import clock, records
+
+_logger = logging.getLogger(__name__)
+
+# bytes a subscriber may fall behind before it is disconnected
+_MAX_SUBSCRIBER_BUFFER = 1024 * 1024
+
+
+class _TimeView():
+    """
+    the timestamps of a _DeviceRing by position, for bisect
+    """
+
+    def __init__(self, ring):
+        self._ring = ring
+
+    def __len__(self):
+        return self._ring.count
+
+    def __getitem__(self, position):
+        return self._ring[position]
+
+
+class _DeviceRing():
+    """
+    the last 'capacity' measurements of one device, one array of the
+    timestamps and one per value (nan for None), overwritten round robin.
+    a measurement is addressed by its position, the number of measurements
+    stored before it, the ones before first() are overwritten already.
+    the measurements are kept in the order of their timestamps, a late one
+    (read back from the buffered file, forwarded by a concentrator) is
+    inserted, moving the newer ones up by one
+    """
+
+    def __init__(self, measurement_type, capacity):
+        self.type = measurement_type
+        self.fields = records.FIELDS[measurement_type]
+        self.capacity = capacity
+        self.count = 0
+        self.ts = array('d', bytes(8 * capacity))
+        self.values = [array('d', bytes(8 * capacity)) for _ in self.fields]
+
+    def append(self, reading):
+        ts = reading['ts'].timestamp()
+        position = self.count
+        if self.count and self[self.count - 1] > ts:
+            position = bisect.bisect_right(_TimeView(self), ts, self.first(), self.count)
+            if position == self.first() and self.count >= self.capacity:
+                # older than all measurements kept
+                return
+            for moved in range(self.count, position, -1):
+                self._copy(moved - 1, moved)
+
+        index = position % self.capacity
+        self.ts[index] = ts
+        for column, (name, kind) in zip(self.values, self.fields):
+            column[index] = records.encode_value(reading.get(name), kind)
+        self.count += 1
+
+    def __getitem__(self, position):
+        return self.ts[position % self.capacity]
+
+    def _copy(self, source, target):
+        source, target = source % self.capacity, target % self.capacity
+        self.ts[target] = self.ts[source]
+        for column in self.values:
+            column[target] = column[source]
+
+    def first(self):
+        return max(0, self.count - self.capacity)
+
+    def since(self, ts):
+        """
+        :return: (int) position of the first measurement at or after ts, the time index
+        """
+        return bisect.bisect_left(_TimeView(self), ts, self.first(), self.count)
+
+    def rows(self, start, end):
+        """
+        :return: (dict) the measurements from position start to end as columns, 'ts' and the values
+        """
+        indexes = [position % self.capacity for position in range(max(start, self.first()), end)]
+        rows = {'type': self.type, 'ts': [self.ts[index] for index in indexes]}
+        for column, (name, kind) in zip(self.values, self.fields):
+            rows[name] = [records.decode_value(column[index], kind) for index in indexes]
+        return rows
+
+
+class HistoryStore():
+    """
+    the recent measurements of every device in memory, for local dashboards
+    and control scripts, served on a unix socket. the store gets every
+    measurement from the Reporter like a sink (see communication.sinks),
+    so no second reader of the serial ports is needed.
+
+    every device has a ring of its last 'capacity' measurements, kept in
+    the order of their timestamps, which serve as its time index. a connection sends one command per line, each answered by one
+    line of json:
+
+        DEVICES                     the devices and the number of measurements kept
+        RANGE <device> <seconds>    the measurements of the last seconds, as columns
+        LAST <device> <count>       the last measurements, as columns
+        SUBSCRIBE [<device> ...]    from then on every new measurement (of the devices)
+
+    a device is given by its id (uuid or mac address) or its handle. a new
+    measurement is encoded once and the same bytes are written to every
+    subscriber, a subscriber falling behind by more than 'max_buffer' bytes is dropped.
+    """
+
+    def __init__(self, devices, capacity=3600, max_buffer=_MAX_SUBSCRIBER_BUFFER):
+        """
+        :param devices: (util.devices.DeviceTable) the table of the device handles
+        :param capacity: (int) measurements kept per device
+        :param max_buffer: (int) bytes a subscriber may fall behind
+        """
+        self.sink_name = 'history'
+        self._devices = devices
+        self._capacity = capacity
+        self._max_buffer = max_buffer
+        self._server = None
+
+        # handle -> _DeviceRing
+        self._rings = {}
+
+        # writer -> set of the handles it subscribed to, None for all
+        self._subscribers = {}
+        self._dropped_subscribers = 0
+
+    @asyncio.coroutine
+    def serve(self, path):
+        """
+        starts serving the queries on a unix socket
+        :param path: (string) path of the socket, an old one is replaced
+        """
+        if os.path.exists(path):
+            os.remove(path)
+        self._server = yield from asyncio.start_unix_server(self.handle_connection, path)
+        _logger.info("#info:history-listening#socket:%s", path)
+
+    def put(self, msg):
+        """
+        called by the Reporter for every new measurement
+        :param msg: an instance of an object representing a measurement
+        """
+        reading = msg.__dict__
+        if reading.get('type') not in records.FIELDS:
+            return
+        handle = reading.get('device')
+        ring = self._rings.get(handle)
+        if ring is None or ring.type != reading['type']:
+            ring = self._rings[handle] = _DeviceRing(reading['type'], self._capacity)
+        ring.append(reading)
+
+        if self._subscribers:
+            self._publish(handle, reading)
+
+    def _publish(self, handle, reading):
+        line = None
+        for writer, handles in list(self._subscribers.items()):
+            if handles is not None and handle not in handles:
+                continue
+            if writer.transport.get_write_buffer_size() > self._max_buffer:
+                _logger.warn("#warn:history-subscriber-too-slow-dropped")
+                self._dropped_subscribers += 1
+                del self._subscribers[writer]
+                writer.close()
+                continue
+            if line is None:
+                line = self._encode(dict(((name, reading.get(name)) for name, kind in records.FIELDS[reading['type']]),
+                                         device=self._devices.device(handle), type=reading['type'],
+                                         seq=reading.get('seq'), ts=reading['ts'].timestamp()))
+            writer.write(line)
+
+    @staticmethod
+    def _encode(answer):
+        return (json.dumps(answer) + '\n').encode('utf-8')
+
+    def _handle(self, device):
+        """
+        :return: (int) the handle of the device given by its id or its handle, None if unknown
+        """
+        handle = self._devices.handle(device)
+        if handle is None and device.isdigit() and int(device) in self._rings:
+            handle = int(device)
+        return handle
+
+    def query(self, command):
+        """
+        :param command: (list) the words of a command line, but SUBSCRIBE
+        :return: (dict) the answer
+        """
+        name = command[0].upper() if command else ''
+        if name == 'DEVICES':
+            return {'devices': [{'device': self._devices.device(handle), 'handle': handle,
+                                 'type': ring.type, 'count': ring.count - ring.first()}
+                                for handle, ring in sorted(self._rings.items(), key=lambda item: item[0] or 0)]}
+
+        if name in ('RANGE', 'LAST') and len(command) == 3:
+            handle = self._handle(command[1])
+            ring = self._rings.get(handle)
+            if ring is None:
+                return {'error': 'unknown device: %s' % command[1]}
+            try:
+                amount = float(command[2]) if name == 'RANGE' else int(command[2])
+            except ValueError:
+                return {'error': 'not a number: %s' % command[2]}
+            start = ring.since(clock.timestamp() - amount) if name == 'RANGE' else ring.count - amount
+            return dict(ring.rows(start, ring.count), device=self._devices.device(handle))
+
+        return {'error': 'unknown command: %s' % ' '.join(command)}
+
+    @asyncio.coroutine
+    def handle_connection(self, reader, writer):
+        try:
+            while True:
+                line = yield from reader.readline()
+                if not line:
+                    break
+                command = line.decode('utf-8', 'replace').split()
+                if command and command[0].upper() == 'SUBSCRIBE':
+                    handles = set(self._handle(device) for device in command[1:]) if command[1:] else None
+                    self._subscribers[writer] = handles
+                    writer.write(self._encode({'subscribed': command[1:] or 'all'}))
+                else:
+                    writer.write(self._encode(self.query(command)))
+                yield from writer.drain()
+        except ConnectionResetError:
+            pass
+        finally:
+            self._subscribers.pop(writer, None)
+            writer.close()
+
+    def get_diagnostics(self):
+        """
+        :return: (dict) devices, measurements kept and subscribers, used by the profiler
+        """
+        return {'devices': len(self._rings),
+                'measurements': sum(ring.count - ring.first() for ring in self._rings.values()),
+                'subscribers': len(self._subscribers),
+                'dropped_subscribers': self._dropped_subscribers}
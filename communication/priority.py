@@ -0,0 +1,123 @@
+import collections
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# lanes of types without a configured weight
+_DEFAULT_WEIGHT = 1
+
+
+class PriorityLanes():
+    """
+    the readings waiting to be sent, in one FIFO lane per measurement type
+    ('type' of the reading) and live vs. backfill (read back from the buffered file)
+
+    the readings of the next message are taken by a smooth weighted round
+    robin over the non empty lanes: a lane of weight 8 gets 8 readings
+    for every reading of a lane of weight 1, without any lane starving.
+    the weight of a live lane is the weight of its type times live_factor,
+    so fresh power readings overtake hours of temperature backlog.
+
+    the lanes are meant to hold more than one message, the Reporter keeps
+    them filled from the live and the buffered readings (see count).
+    """
+
+    def __init__(self, weights=None, live_factor=1):
+        """
+        :param weights: (dict) type of a measurement -> weight (int), 1 for missing types
+        :param live_factor: (int) weight of a live lane relative to the backfill lane of the same type
+        """
+        self._weights = weights or {}
+        self._live_factor = live_factor
+
+        # (type, live) -> deque of readings
+        self._lanes = collections.OrderedDict()
+        # (type, live) -> current weight of the round robin
+        self._current = {}
+        self._size = 0
+        # live -> number of its readings
+        self._counts = {True: 0, False: 0}
+
+        # what the last take() returned, see restore()
+        self._last_taken = []
+
+    def __len__(self):
+        return self._size
+
+    def count(self, live):
+        """
+        :param live: (bool) False for the readings read back from the buffered file
+        :return: (int) number of the live (or the backfill) readings waiting
+        """
+        return self._counts[live]
+
+    def _weight(self, lane):
+        weight = self._weights.get(lane[0], _DEFAULT_WEIGHT)
+        return weight * self._live_factor if lane[1] else weight
+
+    def add(self, reading, live=True):
+        """
+        :param reading: (dict) the measurement, as sent to the server
+        :param live: (bool) False for readings read back from the buffered file
+        """
+        lane = (reading.get('type'), live)
+        if lane not in self._lanes:
+            self._lanes[lane] = collections.deque()
+            self._current[lane] = 0
+        self._lanes[lane].append(reading)
+        self._size += 1
+        self._counts[live] += 1
+
+    def _next_lane(self):
+        total = 0
+        best = None
+        for lane, readings in self._lanes.items():
+            if not readings:
+                continue
+            weight = self._weight(lane)
+            self._current[lane] += weight
+            total += weight
+            if best is None or self._current[lane] > self._current[best]:
+                best = lane
+        self._current[best] -= total
+        return best
+
+    def take(self, count):
+        """
+        :param count: (int) maximum number of readings
+        :return: list of the next readings, in the order of the round robin
+        """
+        taken = []
+        while self._size and len(taken) < count:
+            lane = self._next_lane()
+            taken.append((lane, self._lanes[lane].popleft()))
+            self._size -= 1
+            self._counts[lane[1]] -= 1
+        self._last_taken = taken
+        return [reading for lane, reading in taken]
+
+    def last_take(self):
+        """
+        :return: what the last take() took, to restore it later on
+        """
+        return self._last_taken
+
+    def restore(self, taken=None):
+        """
+        puts the readings of the last take() back to the front of their
+        lanes, used when they could not be sent
+        :param taken: as returned by last_take() of an earlier take(), to restore that one instead
+        """
+        for lane, reading in reversed(self._last_taken if taken is None else taken):
+            self._lanes[lane].appendleft(reading)
+            self._size += 1
+            self._counts[lane[1]] += 1
+        if taken is None:
+            self._last_taken = []
+
+    def sizes(self):
+        """
+        :return: (dict) 'type/live' or 'type/backfill' -> number of readings waiting
+        """
+        return dict(('%s/%s' % (lane[0], 'live' if lane[1] else 'backfill'), len(readings))
+                    for lane, readings in self._lanes.items())
@@ -0,0 +1,206 @@
+import asyncio
+import io
+import pickle
+import struct
+import zlib
+
+from communication.columnar import ColumnarBatch
+
+# version of the HELLO handshake, a server without it is spoken to as before (LEGACY)
+PROTOCOL_VERSION = 1
+
+# feature -> values known by this client and the stand-in servers, the preferred first
+#   framing: 'pickle' the pickled messages back to back, 'length' each message in a frame (see encode_frame)
+#   encoding: of the measurements, 'pickle' or 'columnar' (see communication.columnar)
+#   compression: of a frame, 'zlib' or 'none'
+#   ack: 'each' waits for the ack of each message, 'pipelined' sends on and handles them as they come
+#   health: 'summary' the server takes the health batches of the client (see util.health), 'none' not
+#   devices: 'table' the measurements carry the handles of their devices, the table is sent once per
+#     connection (see util.devices), 'ids' every measurement carries the id of its device (deviceid/mac_address)
+FEATURES = {'framing': ('length', 'pickle'),
+            'encoding': ('columnar', 'pickle'),
+            'compression': ('zlib', 'none'),
+            'ack': ('pipelined', 'each'),
+            'health': ('summary', 'none'),
+            'devices': ('table', 'ids')}
+
+# what is used with a server which does not know the handshake
+LEGACY = {'version': 0, 'framing': 'pickle', 'encoding': 'pickle', 'compression': 'none', 'ack': 'each',
+          'health': 'none', 'devices': 'ids', 'window': None}
+
+# flags and length of the payload in front of each frame
+_FRAME_HEADER = struct.Struct('<BI')
+_ZLIB = 1
+
+# smaller payloads are not worth compressing
+_COMPRESS_MIN = 256
+
+
+def offer(features, window):
+    """
+    the capabilities a client offers in its HELLO request
+    :param features: (dict) feature -> values the client wants to use, the preferred first
+    :param window: (int) number of measurements per message the client would like to send
+    :return: (dict)
+    """
+    capabilities = dict((name, list(values)) for name, values in features.items())
+    capabilities.update(version=PROTOCOL_VERSION, window=window)
+    return capabilities
+
+
+def choose(capabilities, features=FEATURES, max_window=None):
+    """
+    what a server answers to a HELLO request
+    :param capabilities: (dict) as offered by the client (see offer)
+    :param features: (dict) feature -> values the server supports
+    :param max_window: (int) largest window the server accepts, None for any
+    :return: (dict) feature -> the chosen value, 'version' and 'window'
+    """
+    chosen = dict(LEGACY, version=min(PROTOCOL_VERSION, capabilities.get('version', 0)))
+    for name, supported in features.items():
+        for value in capabilities.get(name, ()):
+            if value in supported:
+                chosen[name] = value
+                break
+    window = capabilities.get('window')
+    chosen['window'] = min(window, max_window) if window and max_window else window
+
+    # the acks can only be told apart in frames
+    if chosen['framing'] != 'length':
+        chosen['ack'] = 'each'
+    # the columns only hold the handles of the devices
+    if chosen['devices'] != 'table':
+        chosen['encoding'] = 'pickle'
+    return chosen
+
+
+def accept(chosen, features):
+    """
+    checks the answer of the server to a HELLO request
+    :param chosen: the response of the server (see choose)
+    :param features: (dict) feature -> values the client offered
+    :return: (dict) the features of the connection, None if the server chose
+    something not offered (or not going together), the connection is legacy then
+    """
+    if not isinstance(chosen, dict):
+        return None
+    accepted = dict(LEGACY)
+    for name, offered in features.items():
+        # a feature the server does not know stays as before
+        value = chosen.get(name, LEGACY[name])
+        if value != LEGACY[name] and value not in offered:
+            return None
+        accepted[name] = value
+
+    version, window = chosen.get('version'), chosen.get('window')
+    if not isinstance(version, int) or not 0 < version <= PROTOCOL_VERSION:
+        return None
+    if window is not None and (not isinstance(window, int) or window <= 0):
+        return None
+    if accepted['ack'] == 'pipelined' and accepted['framing'] != 'length':
+        return None
+    if accepted['encoding'] == 'columnar' and accepted['devices'] != 'table':
+        return None
+    accepted.update(version=version, window=window)
+    return accepted
+
+
+def encode_frame(chunks, compression='none'):
+    """
+    :param chunks: list of bytes-like objects, the pickled message and the buffers following it
+    :param compression: (string) 'zlib' or 'none'
+    :return: list of bytes-like objects to write, the header of the frame first
+    """
+    length = sum(len(chunk) for chunk in chunks)
+    if compression == 'zlib' and length >= _COMPRESS_MIN:
+        compressor = zlib.compressobj(1)
+        payload = b''.join([compressor.compress(chunk) for chunk in chunks] + [compressor.flush()])
+        return [_FRAME_HEADER.pack(_ZLIB, len(payload)), payload]
+    return [_FRAME_HEADER.pack(0, length)] + list(chunks)
+
+
+def encode_chunks(message, buffers=None, framing='pickle', compression='none'):
+    """
+    encodes a message as written to the connection, run by the workers of an executor too
+    :param message: an inherited instance of GeneralMessage
+    :param buffers: list of bytes-like objects following the message (the columns)
+    :param framing: (string) 'pickle' or 'length'
+    :param compression: (string) 'zlib' or 'none', with length framing
+    :return: list of bytes-like objects to write
+    """
+    chunks = [pickle.dumps(message)] + list(buffers or ())
+    if framing == 'length':
+        chunks = encode_frame(chunks, compression)
+    return chunks
+
+
+def _payload(flags, payload):
+    return zlib.decompress(payload) if flags & _ZLIB else payload
+
+
+@asyncio.coroutine
+def read_frame(reader):
+    """
+    :param reader: (asyncio.StreamReader)
+    :return: (bytes) the payload of the next frame, decompressed
+    :raises asyncio.IncompleteReadError: if the connection was closed
+    """
+    flags, length = _FRAME_HEADER.unpack((yield from reader.readexactly(_FRAME_HEADER.size)))
+    return _payload(flags, (yield from reader.readexactly(length)))
+
+
+def unpickle_messages(buffer):
+    """
+    splits the received bytes into the pickled messages sent back to back,
+    the columns following a columnar message are restored into its data
+    :param buffer: (bytes) the received, not yet handled bytes
+    :return: (tuple) list of the complete messages and the remaining bytes
+    """
+    messages = []
+    stream = io.BytesIO(buffer)
+    while stream.tell() < len(buffer):
+        position = stream.tell()
+        try:
+            message = pickle.load(stream)
+        except Exception:
+            # the message is not complete yet
+            return messages, buffer[position:]
+
+        if getattr(message, 'get_format', None) and message.get_format() == 'columnar':
+            payload = stream.read(message.get_payload_bytes())
+            if len(payload) < message.get_payload_bytes():
+                return messages, buffer[position:]
+            message.set_data(ColumnarBatch.from_buffers(message.get_columns(), payload).readings())
+        messages.append(message)
+    return messages, b''
+
+
+def decode_messages(buffer, framing):
+    """
+    the receiving side of a server, splits the received bytes into messages
+    :param buffer: (bytes) the received, not yet handled bytes
+    :param framing: (string) 'pickle' or 'length', as negotiated
+    :return: (tuple) list of the complete messages and the remaining bytes
+    """
+    if framing == 'pickle':
+        return unpickle_messages(buffer)
+
+    messages = []
+    position = 0
+    while len(buffer) - position >= _FRAME_HEADER.size:
+        flags, length = _FRAME_HEADER.unpack_from(buffer, position)
+        end = position + _FRAME_HEADER.size + length
+        if end > len(buffer):
+            break
+        messages.extend(unpickle_messages(_payload(flags, buffer[position + _FRAME_HEADER.size:end]))[0])
+        position = end
+    return messages, buffer[position:]
+
+
+def encode_message(message, framing, compression='none'):
+    """
+    the sending side of a server
+    :param message: an inherited instance of GeneralMessage
+    :return: (bytes) the message as written to the connection
+    """
+    return b''.join(encode_chunks(message, None, framing, compression))
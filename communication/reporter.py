@@ -1,16 +1,44 @@
+import collections
 import logging
 import asyncio
+import os
 import pickle
 import queue
 import time
 
+from util import profiling
+from util.overload import appending, locked
+
 _logger = logging.getLogger(__name__)
 
 _RECONNECT_TIMEOUT = 10
 _RIGHT_TO_FILE_TIME = 5
-_BUFFERED_READ_HICCUP = 0.5
 _EMPTY_QUEUE_HICCUP = 1
 
+# seconds between two looks into the empty shared queue while buffering into the file
+_WRITE_TO_FILE_HICCUP = 0.1
+
+# maximum number of measurements taken from the shared queue at once
+_BATCH_SIZE = 64
+
+# measurements taken from the shared queue waiting for room in their lanes,
+# more are appended to the buffered file while the server is slow to ack
+_PENDING_LIMIT = 1024
+
+# maximum number of measurements read back from the buffered file at once
+_BUFFERED_CHUNK = 256
+
+# measurements which could not be sent yet, also the
+# readers spill into it when their queues are full
+BUFFER_FILE = "buffered-data.p"
+
+# the buffered file is renamed to <file><suffix> while it is read back and sent
+SENDING_SUFFIX = ".sending"
+
+
+def _file_size(file_name):
+    return os.path.getsize(file_name) if os.path.exists(file_name) else 0
+
 
 class Reporter():
     """
@@ -19,72 +47,111 @@ class Reporter():
     the connection is stopped
     """
 
-    def __init__(self, shared_queue, communication_module):
+    def __init__(self, shared_queue, communication_module, sequence=None, backfill_batch=8, sinks=None):
         """
         :param shared_queue: a queue which is filled by a sensor (Zigbee/interface) reader
         :param communication_module: an instance of CommunicationModule
+        :param sequence: (util.sequence.SequenceCounter) persistent counter stamping
+        each measurement with a sequence number ('seq') before it is sent or buffered
+        :param backfill_batch: (int) buffered measurements kept in the lanes of
+        the communication module next to the live ones, which it sends by their priority
+        :param sinks: list of further destinations of the measurements (communication.sinks.Sink),
+        each gets every measurement once, when it leaves the shared queue (or the buffered
+        file, if it was put there by a reader or the concentrator)
         :return:
         """
         self._queue = shared_queue
         self._communication_module = communication_module
-
-        # queue to retrieve buffered data from the file
-        self._buffered_queue = None
+        self._sequence = sequence
+        self._backfill_batch = backfill_batch
+        self._sinks = sinks or []
+
+        # measurements read back from the buffered file, not sent yet, the
+        # position in the file up to which they have been read back, the number
+        # of them handed to the communication module and the number of settled
+        # measurements before, see _read_buffered
+        self._buffered = collections.deque()
+        self._buffered_offset = 0
+        self._buffered_added = 0
+        self._settled_before = 0
+        # average size of a pickled measurement in the file, for estimating the backlog
+        self._buffered_record_bytes = 0
+
+        # measurements taken from the shared queue, not yet sent
+        self._pending = collections.deque()
+
+        # task of the communication module sending the next message, meanwhile
+        # the shared queue is drained into the sinks and _pending
+        self._sending = None
 
         # asyncio loop
         self._loop = None
 
     @asyncio.coroutine
     def report(self):
-
-        # message to be reported
-        # which is an object representing a measurement
-        msg = None
         try:
 
             # get a connection
             yield from self._communication_module.connect()
 
-            # check if buffered queue is empty and needs to be filled
-            # replace the empty buffered queue with the buffered data from the file
-            if self._buffered_queue is None or self._buffered_queue.empty():
-                _logger.debug("#debug:filling-the-buffered-queue")
-                self._buffered_queue = Reporter.get_buffered_data()
-
-            # append data from the file to the buffered queue if buffered queue is not empty
-            elif not self._buffered_queue.empty():
-                _logger.debug("#debug:appending-from-the-buffered-file-to-the-buffered-queue...")
-                temp = Reporter.get_buffered_data()
-                while not temp.empty():
-                    self._buffered_queue.put(temp.get())
-
-            _logger.debug("#debug:sending-buffered-data#qsize:%s" % self._buffered_queue.qsize())
+            # the buffered data is read back chunk by chunk, all of it
+            # stays in the file until the server acknowledged it
+            if not self._buffered:
+                self._read_buffered()
+            _logger.debug("#debug:sending-buffered-data#read-back:%s", len(self._buffered))
 
             # try to send the data to the server
             while True:
 
-                # first send the buffered data from the file
-                while not self._buffered_queue.empty():
-                    msg = self._buffered_queue.get()
-                    if msg:
-                        _logger.debug('#debug:sending-buffered-data#data:%s' % msg)
-                        yield from self._communication_module.send(msg)
-                        yield from asyncio.sleep(_BUFFERED_READ_HICCUP)
-
-                # try to read form the shared queue and send
-                # recently measurement data to the server
-                while not self._queue.empty():
-                    msg = self._queue.get()
+                # try to read form the shared queue the recent measurement
+                # data, the sinks get it before anything waits for the server
+                if not self._queue.empty():
+                    self._pending.extend(self._get_batch())
+
+                # into their lanes while they have room
+                while self._pending and self._communication_module.pending(live=True) < _BATCH_SIZE:
+                    self._communication_module.add(self._pending.popleft())
+                if len(self._pending) > _PENDING_LIMIT:
+                    with profiling.stage('reporter.write_to_file'):
+                        self._write_pending()
+
+                # and the buffered data from the file, backfill_batch of them are kept in their lanes
+                while self._buffered and self._communication_module.pending(live=False) < self._backfill_batch:
+                    msg = self._buffered.popleft()
                     if msg:
-                        yield from self._communication_module.send(msg)
-                yield from asyncio.sleep(_EMPTY_QUEUE_HICCUP)
+                        self._stamp(msg)
+                        _logger.debug('#debug:sending-buffered-data#data:%s', msg)
+                        self._communication_module.add(msg, live=False)
+                        self._buffered_added += 1
+
+                # the next message, the communication module chooses its measurements
+                # by the priority of their lanes, sent while the loop goes on
+                if self._sending is not None and self._sending.done():
+                    sending, self._sending = self._sending, None
+                    sending.result()
+                if self._sending is None and self._communication_module.ready():
+                    self._sending = asyncio.get_event_loop().create_task(self._communication_module.flush())
+
+                # the next chunk, or what the readers spilled meanwhile
+                if not self._buffered:
+                    self._read_buffered()
+
+                if self._sending is not None and self._queue.empty():
+                    # until the message is sent or the next look into the shared queue
+                    yield from asyncio.wait([self._sending], timeout=_EMPTY_QUEUE_HICCUP)
+                elif self._queue.empty() and not self._buffered and not self._communication_module.ready():
+                    yield from asyncio.sleep(_EMPTY_QUEUE_HICCUP)
+                else:
+                    # let the other tasks (e.g. the supervisor) run
+                    yield from asyncio.sleep(0)
 
         # connection has been lost
         except ConnectionResetError:
             _logger.warn("#warn:connection-lost!")
 
             # try to buffer data into a file while the connection is lost
-            yield from self.write_to_file(_RECONNECT_TIMEOUT, msg)
+            with profiling.stage('reporter.write_to_file'):
+                yield from self.write_to_file(_RECONNECT_TIMEOUT)
             _logger.debug("#debug:reconnecting-after-connection-reset-error")
 
             # try to reconnect and start reporting again
@@ -95,7 +162,8 @@ class Reporter():
             _logger.warn("#warn:could not connect to the server!")
 
             # try to buffer data into a file while there is no connection
-            yield from self.write_to_file(_RECONNECT_TIMEOUT, msg)
+            with profiling.stage('reporter.write_to_file'):
+                yield from self.write_to_file(_RECONNECT_TIMEOUT)
             _logger.debug("#debug:reconnecting-after-connection-refused-error")
 
             # try to reconnect and start reporting again
@@ -115,80 +183,184 @@ class Reporter():
             _logger.debug("#debug:reconnecting-after-unpredicted-exception")
             yield from self.report()
 
+    def _get_batch(self):
+        """
+        :return: list of the next measurements of the shared queue, read as a
+        batch if the queue supports it (see util.shm_ring.RecordRing), stamped
+        """
+        if hasattr(self._queue, 'get_batch'):
+            return self._stamped(self._queue.get_batch(_BATCH_SIZE))
+        return self._stamped([self._queue.get()])
+
+    def _get_batch_nowait(self):
+        """
+        :return: list of the next measurements of the shared queue, stamped, empty if there are none
+        """
+        if hasattr(self._queue, 'get_batch'):
+            return self._stamped(self._queue.get_batch(_BATCH_SIZE))
+        try:
+            return self._stamped([self._queue.get_nowait()])
+        except queue.Empty:
+            return []
+
+    def _stamped(self, batch):
+        batch = [msg for msg in batch if msg]
+        for msg in batch:
+            self._stamp(msg)
+        return batch
+
+    def _stamp(self, msg):
+        """
+        gives the measurement its sequence number, measurements read back
+        from the buffered file keep the number they got before buffering.
+        the sinks get it at the same time, without waiting for the server.
+        called once the measurement leaves the shared queue, or the buffered
+        file if it was written there by a reader or the concentrator
+        :param msg: an instance of an object representing a measurement
+        """
+        if getattr(msg, 'seq', None) is not None:
+            return
+        if self._sequence:
+            msg.seq = self._sequence.next()
+        for sink in self._sinks:
+            sink.put(msg)
+
     @asyncio.coroutine
-    def write_to_file(self, seconds, failed_msg, file_name="buffered-data.p"):
+    def write_to_file(self, seconds, failed_msg=None, file_name=BUFFER_FILE):
         """
         it will write the data to a file for a period
         of 'seconds' seconds!
         used when the connection is lost to store the data locally
-        and try to send them again when we have the connection back
+        and try to send them again when we have the connection back,
+        the measurements already in the lanes of the communication
+        module stay there and are sent after reconnecting
         :param: seconds, time in seconds for this method to run
         :param: failed_msg, the last message which could not be send
         :return:
         """
 
-        with open(file_name, 'ab+') as fout:
-
-            # first write the failed message to the file
+        # first write the failed message to the file
+        # then the ones taken from the shared queue together with it
+        with appending(file_name) as fout:
             if failed_msg:
                 pickle.dump(failed_msg, fout)
-                fout.flush()
-
-            # calculate the time which this method should be run
-            start_time = time.time()
-            end_time = start_time + seconds
+            while self._pending:
+                pickle.dump(self._pending.popleft(), fout)
+
+        # calculate the time which this method should be run
+        start_time = time.time()
+        end_time = start_time + seconds
+
+        # get data from the shared queue and buffer them into the file,
+        # the other tasks of the loop (e.g. the concentrator) run meanwhile
+        _logger.debug("#debug:writing-data-to-the-file")
+        while time.time() < end_time:
+            batch = self._get_batch_nowait()
+            if not batch:
+                yield from asyncio.sleep(_WRITE_TO_FILE_HICCUP)
+                continue
+            with appending(file_name) as fout:
+                for data in batch:
+                    pickle.dump(data, fout)
+            yield from asyncio.sleep(0)
+
+        _logger.debug("#debug:write_to_file-time-out-reached.-Exiting-the-method...")
+
+    def _write_pending(self, file_name=BUFFER_FILE):
+        """
+        appends the measurements waiting for room in their lanes to the buffered
+        file, they are read back once the server keeps up again
+        """
+        with appending(file_name) as fout:
+            while self._pending:
+                pickle.dump(self._pending.popleft(), fout)
 
-            # get data from the shared queue and buffer them into the file
-            _logger.debug("#debug:writing-data-to-the-file")
-            while time.time() < end_time:
-                if not self._queue.empty():
-                    try:
-                        data = self._queue.get(timeout=0.500)  # ToDo Do we need a timeout?
-                        if data:
-                            pickle.dump(data, fout)
-                            fout.flush()
-                    except queue.Empty as e:
-                        _logger.warn("#warn:time-out-reached!-could-not-get-from-the-shared-queue")
-
-            _logger.debug("#debug:write_to_file-time-out-reached.-Exiting-the-method...")
-            fout.close()
-
-    @staticmethod
-    def get_buffered_data(file_name="buffered-data.p"):
-        """
-        reads lines from buffered file and return a queue containing data
-        :rtype : queue.Queue
+    def _read_buffered(self, file_name=BUFFER_FILE):
+        """
+        reads the next chunk of up to _BUFFERED_CHUNK measurements back from the
+        buffered file into _buffered, so the memory does not grow with the
+        length of an outage, however long the file got meanwhile
+
+        the file is renamed (SENDING_SUFFIX) before it is read back, the writers
+        append to a new one from then on. it is removed once it is read back
+        completely and its measurements are settled (see settled_backfill of
+        the communication module), until then a crash loses none of them
         :param file_name:
-        :return: queue containing data
         """
-        _logger.info("#info:reading-from-buffered-file...")
-        temp_queue = queue.Queue(maxsize=0)
+        sending = file_name + SENDING_SUFFIX
         try:
-            with open(file_name, 'rb+') as fin:
-                try:
-                    while True:
-                        # read until end of file reached
-                        data = pickle.load(fin)
-                        temp_queue.put(data)
-                except EOFError:
-                    _logger.debug("#debug:reading-buffered-data-finished!#qsize:%s" % temp_queue.qsize())
-                    fin.close()
-
-            # emptying the file!
-            # each time the buffered file is read,
-            # it is being emptied in order not to read and
-            # report the previously reported buffered data
-            open(file_name, 'w').close()
-            return temp_queue
-        except FileNotFoundError as e:
-            _logger.warn("#warn:file-%s-does-not-exists-" % file_name)
-            return temp_queue
-
-    def run(self):
+            if os.path.exists(sending):
+                if self._buffered_offset < os.path.getsize(sending):
+                    self._read_chunk(sending)
+                    return
+                if self._buffered or self._communication_module.settled_backfill() - self._settled_before < \
+                        self._buffered_added:
+                    # waiting for the server to acknowledge the last of them
+                    return
+                os.remove(sending)
+
+            if not os.path.exists(file_name) or not os.path.getsize(file_name):
+                return
+            with open(file_name, 'rb') as fin, locked(fin):
+                os.rename(file_name, sending)
+            self._buffered_offset = self._buffered_added = 0
+            self._settled_before = self._communication_module.settled_backfill()
+            self._read_chunk(sending)
+        except FileNotFoundError:
+            _logger.debug("#debug:file-%s-does-not-exists-", file_name)
+
+    def _read_chunk(self, file_name):
+        with open(file_name, 'rb') as fin:
+            start, read = self._buffered_offset, 0
+            fin.seek(start)
+            try:
+                while len(self._buffered) < _BUFFERED_CHUNK:
+                    self._buffered.append(pickle.load(fin))
+                    self._buffered_offset = fin.tell()
+                    read += 1
+            except (EOFError, pickle.UnpicklingError):
+                # nothing is appended to it anymore, only a crash may have cut off the last one
+                size = os.fstat(fin.fileno()).st_size
+                if self._buffered_offset < size:
+                    _logger.warn("#warn:buffered-file-cut-off#bytes-skipped:%s", size - self._buffered_offset)
+                    self._buffered_offset = size
+                _logger.debug("#debug:reading-buffered-data-finished!#read-back:%s", len(self._buffered))
+            if read:
+                self._buffered_record_bytes = (self._buffered_offset - start) // read
+
+    def get_backlog(self, file_name=BUFFER_FILE):
+        """
+        :return: (int) measurements taken or buffered in the file, not sent yet,
+        the ones still in the file estimated by their average size
+        """
+        in_file = 0
+        if self._buffered_record_bytes:
+            in_file = max(_file_size(file_name) + _file_size(file_name + SENDING_SUFFIX) - self._buffered_offset,
+                          0) // self._buffered_record_bytes
+        return (self._queue.qsize() + len(self._pending) + len(self._buffered) + in_file +
+                self._communication_module.pending())
+
+    def get_diagnostics(self, file_name=BUFFER_FILE):
+        """
+        :return: (dict) sizes of the queues and buffers, used by the profiler
+        """
+        diagnostics = {'shared_queue': self._queue.qsize(),
+                       'buffered_queue': len(self._buffered),
+                       'buffered_file_bytes': _file_size(file_name) + _file_size(file_name + SENDING_SUFFIX)}
+        diagnostics.update(self._communication_module.get_diagnostics())
+        for sink in self._sinks:
+            diagnostics['sink:%s' % sink.sink_name] = sink.get_diagnostics()
+        return diagnostics
+
+    def run(self, *coroutines):
         """
         run the reporter thread
+        :param coroutines: further coroutines to run in the loop of the
+        reporter next to it, e.g. Supervisor.watch()
         """
         self._loop = asyncio.get_event_loop()
+        for coroutine in coroutines:
+            self._loop.create_task(coroutine)
         try:
             self._loop.run_until_complete(self.report())
         except KeyboardInterrupt:
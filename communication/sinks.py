@@ -0,0 +1,303 @@
+import csv
+import gzip
+import io
+import logging
+import os
+import pickle
+import queue
+import re
+import socket
+import threading
+import time
+
+from communication.columnar import ColumnarBatch
+from message_types.measurement_msg import MeasurementMessage
+from util import records
+
+_logger = logging.getLogger(__name__)
+
+# seconds a sink waits before it tries to write a failed batch again
+_RETRY_INTERVAL = 5
+
+# common columns of the archived measurements, followed by their values
+_CSV_COLUMNS = ('id', 'seq', 'device', 'ts')
+
+# archive-[<type>-]<time of the rotation>.<format>.gz
+_ARCHIVE_NAME = re.compile(r'^archive-(?:[a-z_]+-)?(\d{8}-\d{6}(?:-\d+)?)\.')
+
+ARCHIVE = 'archive'
+SOCKET = 'socket'
+
+
+class Sink(threading.Thread):
+    """
+    a further destination of the measurements next to the server, e.g.
+    an archive on the SD card or a local consumer
+
+    the Reporter hands every measurement over once (see put), without ever
+    waiting for a sink. every sink has its own bounded queue and a thread
+    writing it in batches of up to 'batch_size' measurements, at least every
+    'flush_interval' seconds. so a slow sink only fills up its own queue and
+    drops from it, neither the server nor the other sinks are slowed down.
+    a batch which could not be written is tried again, the queue fills meanwhile.
+    """
+
+    def __init__(self, name, queue_size=10000, batch_size=1000, flush_interval=60):
+        """
+        :param name: (string) name of the sink in the logs and diagnostics
+        :param queue_size: (int) measurements the sink buffers before dropping
+        :param batch_size: (int) maximum number of measurements written at once
+        :param flush_interval: (float) seconds a measurement waits at most for its batch to fill
+        """
+        super().__init__(name='sink-%s' % name, daemon=True)
+        self.sink_name = name
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._stopped = threading.Event()
+
+        self._written = 0
+        self._dropped = 0
+        self._failed = 0
+
+    def put(self, msg):
+        """
+        called by the Reporter, never blocks
+        :param msg: an instance of an object representing a measurement
+        """
+        try:
+            self._queue.put_nowait(msg.__dict__.copy())
+        except queue.Full:
+            self._dropped += 1
+
+    def run(self):
+        batch = []
+        while not (self._stopped.is_set() and self._queue.empty() and not batch):
+            # collect until the batch is full or the first waited long enough,
+            # a batch which failed before is written again right away
+            deadline = time.time() if batch else None
+            while len(batch) < self._batch_size and not self._stopped.is_set():
+                timeout = 1 if deadline is None else deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=min(1, timeout)))
+                except queue.Empty:
+                    continue
+                if deadline is None:
+                    deadline = time.time() + self._flush_interval
+            while len(batch) < self._batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            if not batch:
+                continue
+
+            try:
+                self.write(batch)
+                self._written += len(batch)
+                batch = []
+            except (IOError, OSError) as e:
+                self._failed += 1
+                _logger.error("#error:sink-could-not-write#sink:%s#error:%s", self.sink_name, e)
+                if self._stopped.wait(_RETRY_INTERVAL):
+                    break
+        self.close()
+
+    def write(self, batch):
+        """
+        writes a batch, implemented by the sinks
+        :param batch: list of the measurements (dictionaries)
+        :raises IOError: if the batch could not be written, it is tried again
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        called by the thread of the sink once it stopped
+        """
+        pass
+
+    def stop(self):
+        """
+        stops the sink after it has written its queue
+        """
+        self._stopped.set()
+
+    def get_diagnostics(self):
+        """
+        :return: (dict) queued, written and dropped measurements and failed writes, used by the profiler
+        """
+        return {'queued': self._queue.qsize(),
+                'written': self._written,
+                'dropped': self._dropped,
+                'failed': self._failed}
+
+
+class ArchiveSink(Sink):
+    """
+    archives the measurements in local files, rotated every 'rotate_interval'
+    seconds or when a file reached 'rotate_bytes', keeping the last 'max_files'
+
+    'csv': one gzip compressed csv file per measurement type and rotation
+    (archive-<type>-<time>.csv.gz), the columns id, seq, device, ts and its values
+    'columnar': one file per rotation (archive-<time>.columnar.gz), each batch
+    is the pickled header of its ColumnarBatch followed by the raw columns
+    """
+
+    def __init__(self, name, directory='archive', archive_format='csv', rotate_bytes=16 * 1024 * 1024,
+                 rotate_interval=3600, max_files=168, **settings):
+        """
+        :param directory: (string) directory of the archive files, created if missing
+        :param archive_format: (string) 'csv' or 'columnar'
+        :param rotate_bytes: (int) size of a file at which the next one is started
+        :param rotate_interval: (float) seconds after which the next file is started
+        :param max_files: (int) number of files kept, the oldest are deleted
+        :param settings: keyword arguments of Sink
+        """
+        super().__init__(name, **settings)
+        if archive_format not in ('csv', 'columnar'):
+            raise ValueError("unknown archive format: %s" % archive_format)
+        self._directory = directory
+        self._format = archive_format
+        self._rotate_bytes = rotate_bytes
+        self._rotate_interval = rotate_interval
+        self._max_files = max_files
+        self._rotated_at = 0
+        self._stamp = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _file_name(self, measurement_type=None):
+        if self._format == 'csv':
+            return os.path.join(self._directory, 'archive-%s-%s.csv.gz' % (measurement_type, self._stamp))
+        return os.path.join(self._directory, 'archive-%s.columnar.gz' % self._stamp)
+
+    def _rotate(self):
+        """
+        starts the next files if the time is up or a file is too large
+        """
+        # time of the rotation -> its files (of the csv format one per type)
+        rotations = {}
+        for name in os.listdir(self._directory):
+            match = _ARCHIVE_NAME.match(name)
+            if match:
+                rotations.setdefault(match.group(1), []).append(os.path.join(self._directory, name))
+
+        too_large = any(os.path.getsize(name) >= self._rotate_bytes for name in rotations.get(self._stamp, ()))
+        if self._stamp is not None and not too_large and time.time() - self._rotated_at < self._rotate_interval:
+            return
+
+        self._rotated_at = time.time()
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(self._rotated_at))
+        # rotated within the same second
+        self._stamp = stamp if stamp != self._stamp else stamp + '-%03d' % (self._rotated_at % 1 * 1000)
+
+        for old in sorted(rotations)[:max(0, len(rotations) + 1 - self._max_files)]:
+            for name in rotations[old]:
+                _logger.debug("#debug:removing-archive-file:%s", name)
+                os.remove(name)
+
+    def write(self, batch):
+        self._rotate()
+        if self._format == 'csv':
+            self._write_csv(batch)
+        else:
+            self._write_columnar(batch)
+
+    def _write_csv(self, batch):
+        by_type = {}
+        for reading in batch:
+            by_type.setdefault(reading['type'], []).append(reading)
+
+        for measurement_type, readings in by_type.items():
+            fields = [name for name, kind in records.FIELDS.get(measurement_type, ())]
+            file_name = self._file_name(measurement_type)
+            new = not os.path.exists(file_name)
+
+            text = io.StringIO()
+            writer = csv.writer(text)
+            if new:
+                writer.writerow(_CSV_COLUMNS + tuple(fields))
+            for reading in readings:
+                writer.writerow([reading.get('id'), reading.get('seq'), reading.get('device'),
+                                 reading['ts'].isoformat()] + [reading.get(name) for name in fields])
+
+            # every batch is a gzip member of its own, the file stays readable as a whole
+            with gzip.open(file_name, 'ab') as fout:
+                fout.write(text.getvalue().encode('utf-8'))
+
+    def _write_columnar(self, batch):
+        columnar = ColumnarBatch()
+        for reading in batch:
+            columnar.append(reading)
+        with gzip.open(self._file_name(), 'ab') as fout:
+            pickle.dump(columnar.header(), fout)
+            for buffer in columnar.buffers():
+                fout.write(buffer)
+
+
+class SocketSink(Sink):
+    """
+    streams the measurements to a local consumer, as the messages sent to
+    the server (pickled MeasurementMessages, without waiting for acks)
+
+    the address is 'tcp:<host>:<port>' or 'unix:<path>'. while the consumer
+    is not there, the measurements wait in the queue of the sink.
+    """
+
+    def __init__(self, name, address, **settings):
+        """
+        :param address: (string) address of the consumer
+        :param settings: keyword arguments of Sink
+        """
+        super().__init__(name, **settings)
+        kind, _, location = address.partition(':')
+        if kind == 'unix':
+            self._family, self._address = socket.AF_UNIX, location
+        elif kind == 'tcp':
+            host, _, port = location.rpartition(':')
+            self._family, self._address = socket.AF_INET, (host, int(port))
+        else:
+            raise ValueError("unknown sink address: %s" % address)
+        self._socket = None
+        self._msg_counter = 0
+
+    def write(self, batch):
+        if self._socket is None:
+            self._socket = socket.socket(self._family, socket.SOCK_STREAM)
+            try:
+                self._socket.connect(self._address)
+            except OSError:
+                self.close()
+                raise
+
+        self._msg_counter += 1
+        try:
+            self._socket.sendall(pickle.dumps(MeasurementMessage(self._msg_counter, batch)))
+            # what the consumer answers is not needed
+            while True:
+                if not self._socket.recv(65536, socket.MSG_DONTWAIT):
+                    raise ConnectionResetError("the consumer closed the connection")
+        except BlockingIOError:
+            pass
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+def create_sink(settings):
+    """
+    :param settings: (dict) 'name', 'type' (ARCHIVE or SOCKET) and the keyword
+    arguments of the sink, as returned by cfg.get_sink_settings
+    :return: (Sink) a new, not yet started sink
+    """
+    settings = dict(settings)
+    sink_type = settings.pop('type')
+    if sink_type == ARCHIVE:
+        return ArchiveSink(**settings)
+    if sink_type == SOCKET:
+        return SocketSink(**settings)
+    raise ValueError("unknown sink type: %s" % sink_type)
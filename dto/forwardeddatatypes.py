@@ -0,0 +1,15 @@
+class ForwardedMeasurement:
+    """
+    A measurement received from a downstream client in concentrator mode
+    (see communication.concentrator), it has the attributes of the measurement
+    it was sent as, so it is handled like the ones of the own readers
+    """
+    def __init__(self, reading):
+        """
+        :param reading: (dict) the measurement as received (the __dict__ of its dto)
+        """
+        self.__dict__.update(reading)
+
+    def __str__(self):
+        return "#type:%s#ts:%s#device:%s#forwarded" % (getattr(self, 'type', None), getattr(self, 'ts', None),
+                                                       getattr(self, 'device', None))
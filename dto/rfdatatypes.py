@@ -20,8 +20,9 @@ class PowerMeasurement:
         # the id of the record which will be stored in the database
         self.id = uuid.uuid4()
 
-        # the UUID which represents the device itself
-        self.deviceid = None
+        # the handle of the device itself, its UUID is sent once per
+        # connection, or as 'deviceid' to a server without the table (see util.devices)
+        self.device = None
         self.type = 'power_measurement'
 
         # TODO standardize the measurements?
@@ -57,7 +58,7 @@ class PowerMeasurement:
             raise AttributeError(name)
 
     def __str__(self):
-        return """#type:power_measurement#ts:%s#device_id:%s#power1:%s#power2:
-        %s#power3:%s#power4:%s#vrms:%s#temp:%s""" % (self.ts, self.deviceid, self.power1,
+        return """#type:power_measurement#ts:%s#device:%s#power1:%s#power2:
+        %s#power3:%s#power4:%s#vrms:%s#temp:%s""" % (self.ts, self.device, self.power1,
                                                      self.power2, self.power3, self.power4,
                                                      self.vrms, self.temp)
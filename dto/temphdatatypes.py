@@ -21,8 +21,9 @@ class TempHumidityMeasurements:
 		# the id of the record which will be stored in the database
 		self.id = uuid.uuid4()
 
-		# the UUID which represents the device itself
-		self.deviceid = None  # todo macaddress or device id?
+		# the handle of the device itself, its UUID is sent once per
+		# connection, or as 'deviceid' to a server without the table (see util.devices)
+		self.device = None
 		self.type = 'temp_hum_measurement'
 
 		self.ts = ts
@@ -56,7 +57,7 @@ class TempHumidityMeasurements:
 			raise AttributeError(name)
 
 	def __str__(self):
-		return """#type:temp_hum_measurement#ts:%s#deviceid:%s#temprature:%s
-		#external_temp:%s#humidity:%s#battery:%s""" % (self.ts, self.deviceid,
+		return """#type:temp_hum_measurement#ts:%s#device:%s#temprature:%s
+		#external_temp:%s#humidity:%s#battery:%s""" % (self.ts, self.device,
 		                                               self.temp, self.temp_external,
 		                                               self.humidity, self.battery)
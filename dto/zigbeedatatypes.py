@@ -4,13 +4,14 @@ class Plugmeasurement:
     """
     For Piccerton plug meters
     """
-    def __init__(self, ts, mac_address):
+    def __init__(self, ts, device):
         # The id of the record which will be stored in the database
         self.id = uuid.uuid4()
         self.type = 'plug_measurement'
 
-        # The Mac Address which represents the device itself
-        self.mac_address = mac_address
+        # The handle of the device itself, its Mac Address is sent once per
+        # connection, or as 'mac_address' to a server without the table (see util.devices)
+        self.device = device
         self.ts = ts
         self.load = None
         self.irms = None
@@ -20,4 +21,4 @@ class Plugmeasurement:
         self.work = None
 
     def __str__(self):
-        return "#type:plug_measurement#ts:%s#mac_address:%s#load:%s#irms:%s#vrms:%s#freq:%s#pow:%s#work:%s" % (self.ts, self.mac_address, self.load, self.irms, self.vrms, self.freq, self.pow, self.work)
\ No newline at end of file
+        return "#type:plug_measurement#ts:%s#device:%s#load:%s#irms:%s#vrms:%s#freq:%s#pow:%s#work:%s" % (self.ts, self.device, self.load, self.irms, self.vrms, self.freq, self.pow, self.work)
\ No newline at end of file
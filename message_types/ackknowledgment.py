@@ -1,5 +1,7 @@
 from message_types import general_message
+from message_types.registry import register
 
+@register('ack')
 class Acknowledgment(general_message.GeneralMessage):
 	"""
 	A class for Acknowledgment messages
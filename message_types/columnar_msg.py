@@ -0,0 +1,30 @@
+from message_types import measurement_msg
+
+class ColumnarMeasurementMessage(measurement_msg.MeasurementMessage):
+	"""
+	A measurement message whose measurements follow it on the wire as the raw
+	bytes of their columns (see communication.columnar.ColumnarBatch)
+	{'type'='measurement', 'format'='columnar', 'id': (int) msg_id, 'data': None until
+	the receiver restored the measurements, 'columns': header of the ColumnarBatch,
+	'payload_bytes': (int) number of bytes following the message, 'seq_ranges'}
+	"""
+	def __init__(self, id, columns, payload_bytes, seq_ranges=None):
+		super().__init__(id, None, seq_ranges)
+		self._content['format'] = 'columnar'
+		self.set_columns(columns)
+		self.set_payload_bytes(payload_bytes)
+
+	def get_format(self):
+		return self._content['format']
+
+	def get_columns(self):
+		return self._content['columns']
+
+	def set_columns(self, columns):
+		self._content['columns'] = columns
+
+	def get_payload_bytes(self):
+		return self._content['payload_bytes']
+
+	def set_payload_bytes(self, payload_bytes):
+		self._content['payload_bytes'] = payload_bytes
\ No newline at end of file
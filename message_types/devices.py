@@ -0,0 +1,20 @@
+from message_types import general_message
+from message_types.registry import register
+
+@register('devices')
+class DeviceTableMessage(general_message.GeneralMessage):
+	"""
+	A class for the table of the devices sent once per connection, the
+	measurements refer to their device by its handle
+	{'type'='devices', 'devices': dictionary handle (int) -> uuid or mac address (string)}
+	"""
+	def __init__(self, devices):
+		super().__init__()
+		self._content['type'] = 'devices'
+		self.set_devices(devices)
+
+	def get_devices(self):
+		return self._content['devices']
+
+	def set_devices(self, devices):
+		self._content['devices'] = devices
\ No newline at end of file
@@ -0,0 +1,35 @@
+from message_types import general_message
+from message_types.registry import register
+
+@register('health')
+class HealthMessage(general_message.GeneralMessage):
+	"""
+	A class for the periodic summary of the reception of every device, sent
+	only if the server chose the 'health' feature (see communication.protocol)
+	{'type'='health', 'period': (float) seconds summarized, 'fields': names of the counters,
+	'devices': dictionary handle (int, None for frames of unknown devices) -> list of the counters}
+	"""
+	def __init__(self, period, fields, devices):
+		super().__init__()
+		self._content['type'] = 'health'
+		self.set_period(period)
+		self.set_fields(fields)
+		self.set_devices(devices)
+
+	def get_period(self):
+		return self._content['period']
+
+	def set_period(self, period):
+		self._content['period'] = period
+
+	def get_fields(self):
+		return self._content['fields']
+
+	def set_fields(self, fields):
+		self._content['fields'] = fields
+
+	def get_devices(self):
+		return self._content['devices']
+
+	def set_devices(self, devices):
+		self._content['devices'] = devices
\ No newline at end of file
@@ -1,15 +1,21 @@
 from message_types import general_message
+from message_types.registry import register
 
+@register('measurement')
 class MeasurementMessage(general_message.GeneralMessage):
 	"""
 	A class for measurement messages which its content is a dictionary
-	{'type'='measurement', 'id': (int) msg_id, 'data': list_of_dictionaries (measurements)}
+	{'type'='measurement', 'id': (int) msg_id, 'data': list_of_dictionaries (measurements),
+	'seq_ranges': list of (first, last) sequence numbers of the measurements,
+	'clock': {'offset': seconds the timestamps are off the local clock, 'uncertainty': seconds or None}}
 	"""
-	def __init__(self, id, data):
+	def __init__(self, id, data, seq_ranges=None):
 		super().__init__()
 		self._content['type'] = 'measurement'
 		self.set_data(data)
 		self.set_id(id)
+		self.set_seq_ranges(seq_ranges)
+		self.set_clock(None)
 
 	def get_id(self):
 		return self._content['id']
@@ -21,4 +27,16 @@ class MeasurementMessage(general_message.GeneralMessage):
 		self._content['id'] = id
 
 	def set_data(self, data):
-		self._content['data'] = data
\ No newline at end of file
+		self._content['data'] = data
+
+	def get_seq_ranges(self):
+		return self._content['seq_ranges']
+
+	def set_seq_ranges(self, seq_ranges):
+		self._content['seq_ranges'] = seq_ranges
+
+	def get_clock(self):
+		return self._content['clock']
+
+	def set_clock(self, clock):
+		self._content['clock'] = clock
\ No newline at end of file
@@ -0,0 +1,31 @@
+"""
+the classes of the messages by their type, received messages are
+dispatched by this table instead of comparing the type strings one by one
+"""
+
+# type of a message -> its class
+_CLASSES = {}
+
+
+def register(message_type):
+	"""
+	class decorator, registers the class of the messages of the type
+	"""
+	def decorator(message_class):
+		_CLASSES[message_type] = message_class
+		return message_class
+	return decorator
+
+
+def get_class(message_type):
+	"""
+	:return: the class of the messages of the type, None for an unknown type
+	"""
+	return _CLASSES.get(message_type)
+
+
+def get_types():
+	"""
+	:return: (list) the known types of messages
+	"""
+	return sorted(_CLASSES)
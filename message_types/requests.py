@@ -1,5 +1,7 @@
 from message_types import general_message
+from message_types.registry import register
 
+@register('request')
 class Request(general_message.GeneralMessage):
 	"""
 	a class for requests messages between server and client in
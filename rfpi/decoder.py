@@ -1,29 +1,35 @@
-from datetime import datetime
 import logging
-import uuid
+import re
 from dto import rfdatatypes
-from util import cfg
+from util import cfg, clock
+from util.devices import get_device_table
 import struct
 from dto import temphdatatypes
 
 _logger = logging.getLogger(__name__)
 
+# a line of a measurement: the node id and its values, each a byte
+_MEASUREMENT_LINE = re.compile(rb'(\d{1,3})(?: (?:25[0-5]|2[0-4]\d|1\d\d|\d\d?))*')
+
 def create_decoder():
     """
     creates a decoder for decoding data frames
     :return: (Decoder) an instance of the Decoder
     """
 
+    validation = cfg.get_validation_settings()
+    ranges = validation['ranges']
+
     # create a NodeDecoder for 'node10'
     decodes = get_decoding_info('node10')
-    node_10_decoder = Node10Decoder(decodes, 10)
+    node_10_decoder = Node10Decoder(decodes, 10, ranges.get(Node10Decoder.TYPE))
 
     # create a NodeDecoder for 'temp-hum'
     decodes = get_decoding_info('temp-hum')
-    temp_hum_decoder = TempHumDecoder(decodes, None)
+    temp_hum_decoder = TempHumDecoder(decodes, None, ranges.get(TempHumDecoder.TYPE))
 
     # create the Decoder
-    node_decoder = Decoder(node_10_decoder, temp_hum_decoder)
+    node_decoder = Decoder(node_10_decoder, temp_hum_decoder, validation['prefilter'])
     return node_decoder
 
 
@@ -67,14 +73,62 @@ class Decoder:
     it has instances of NodeDecoders for decoding
     the data frames
     """
-    def __init__(self, node10_decoder, temp_hum_decoder):
+    def __init__(self, node10_decoder, temp_hum_decoder, prefilter=True):
+        """
+        :param prefilter: (bool) check the raw lines before decoding them, see prefilter
+        """
         self._node10_decoder = node10_decoder
         self._temp_hum_decoder = temp_hum_decoder
+        self._prefilter = prefilter
 
-    def decode(self, data):
+        # node id (bytes, as in the line) -> number of tokens of its lines
+        self._tokens = {}
+        for node_decoder in (node10_decoder, temp_hum_decoder):
+            for node_id in node_decoder.get_node_ids():
+                self._tokens[str(node_id).encode('ascii')] = node_decoder.get_value_count() + 1
+
+    def prefilter(self, line):
+        """
+        checks a raw line before anything is decoded: status lines of the RFM
+        board, noise and truncated frames are rejected without splitting it
+        :param line: (bytes) the line read from the serial port, stripped
+        :return: (string) why the line was rejected ('shape', 'node' or 'tokens'), None if it may be decoded
+        """
+        if not self._prefilter:
+            return None
+        match = _MEASUREMENT_LINE.fullmatch(line)
+        if match is None:
+            return 'shape'
+        tokens = self._tokens.get(match.group(1))
+        if tokens is None:
+            return 'node'
+        if line.count(b' ') + 1 != tokens:
+            return 'tokens'
+        return None
+
+    def device_of(self, data):
+        """
+        :param data: (string) the data frame passed by RFPi, e.g. one which could not be decoded
+        :return: (int) handle of the device of the node which sent it, None if unknown
+        """
+        node_id = data.split(' ', 1)[0]
+        if not node_id.isdigit():
+            return None
+        node_id = int(node_id)
+        try:
+            if node_id == 10:
+                return self._node10_decoder.get_device(node_id)
+            if node_id in (19, 22, 23, 24):
+                return self._temp_hum_decoder.get_device(node_id)
+        except KeyError:
+            pass
+        return None
+
+    def decode(self, data, rejected=None):
         """
         decodes data based on the node_id included in the data
         :param data: (string) the data frame passed by RFPi
+        :param rejected: callable taking why a frame was rejected, e.g. ReaderStats.record_rejection
         :return: the object of the specified node_id by the data information
         """
 
@@ -90,10 +144,12 @@ class Decoder:
                     data[i] = int(data[i])
                 else:
                     # unable to decode! non integer found!
-                    _logger.warn('#warn:corrupted-data-unable-to-decode:data:%s' % data)
+                    _logger.warn('#warn:corrupted-data-unable-to-decode:data:%s', data)
+                    if rejected:
+                        rejected('shape')
                     return None
         except Exception as e:
-            _logger.error("#error:in-converting-data[%s]-to-int-data:-%s" % (i, data))
+            _logger.error("#error:in-converting-data[%s]-to-int-data:-%s", i, data)
             _logger.exception(e)
             return None
 
@@ -105,43 +161,107 @@ class Decoder:
         # decode the data
         try:
             if node_id == 10:
-                return self._node10_decoder.decode(data)
+                return self._node10_decoder.decode(data, rejected)
 
             elif node_id == 19 or node_id == 22 or node_id == 23 or node_id == 24:
 
                 # first set the node_id for temp_hum decoder then decode
                 self._temp_hum_decoder.set_id(node_id)
-                return self._temp_hum_decoder.decode(data)
+                return self._temp_hum_decoder.decode(data, rejected)
 
             else:
-                _logger.info("#missing-decoder:%s" % node_id)
+                _logger.info("#missing-decoder:%s", node_id)
+                if rejected:
+                    rejected('node')
 
         except struct.error as e:
-            _logger.error("#error:in-decoding-!-%s" % data)
+            _logger.error("#error:in-decoding-!-%s", data)
             _logger.exception(e)
+            if rejected:
+                rejected('tokens')
             return None
 
 
 class NodeDecoder():
-    def __init__(self, info_dict, node_id):
+    # type of the measurements, as in [validation]
+    TYPE = None
+
+    # field -> rate the raw value is standardized with
+    _RATES = {}
+
+    def __init__(self, info_dict, node_id, ranges=None):
         """
         :param info_dict : @see get_decoding_info function!
+        :param ranges: (dict) field -> (low, high) plausible values, standardized
         """
 
         self._node_decodes = info_dict
         self._node_id = node_id
 
-    def decode(self, data):
+        # node id -> handle of its device, looked up once per node
+        self._devices = {}
+
+        # (position, field, low, high) of the checked values, raw as unpacked
+        self._limits = []
+        fields = info_dict[1]
+        for field, (low, high) in sorted((ranges or {}).items()):
+            if field not in fields:
+                _logger.warn("#warn:range-of-an-unknown-field#type:%s#field:%s", self.TYPE, field)
+                continue
+            rate = self._RATES.get(field, 1)
+            self._limits.append((fields.index(field), field, low / rate, high / rate))
+
+    def get_node_ids(self):
+        """
+        :return: list of the ids (int) of the nodes having a device in the config
+        """
+        return [int(key) for key in self._node_decodes[0] if key.isdigit()]
+
+    def get_value_count(self):
+        """
+        :return: (int) number of values (bytes) in a data frame of the node
+        """
+        return struct.calcsize(self._node_decodes[0]['rec_data_format'])
+
+    def in_range(self, values, rejected=None):
+        """
+        :param values: (tuple) the values of a frame, as unpacked
+        :return: (bool) False if one of them is out of its range, before any measurement is built
+        """
+        for position, field, low, high in self._limits:
+            if not low <= values[position] <= high:
+                _logger.debug("#debug:value-out-of-range#type:%s#field:%s#value:%s", self.TYPE, field, values[position])
+                if rejected:
+                    rejected('range')
+                return False
+        return True
+
+    def get_device(self, node_id):
+        """
+        :param node_id: (int) id of the node
+        :return: (int) handle of the device of the node, see util.devices
+        """
+        device = self._devices.get(node_id)
+        if device is None:
+            device = get_device_table().handle(self._node_decodes[0][str(node_id)])
+            self._devices[node_id] = device
+        return device
+
+    def decode(self, data, rejected=None):
         """
         to be implemented in inherited class
         :param data:
+        :param rejected: callable taking why a frame was rejected
         :return:
         """
         pass
 
 
 class Node10Decoder(NodeDecoder):
-    def decode(self, data):
+    TYPE = 'power_measurement'
+    _RATES = {'vrms': 0.01}
+
+    def decode(self, data, rejected=None):
         """
         decodes data for node10
         :param data: (array of string) the data frame passed by RFPi
@@ -152,15 +272,16 @@ class Node10Decoder(NodeDecoder):
             # interpret each two bytes as a singe integer
             result = struct.pack(self._node_decodes[0]['rec_data_format'], *data)
             result = struct.unpack(self._node_decodes[0]['real_data_format'], result)
+            if not self.in_range(result, rejected):
+                return None
 
-            node = rfdatatypes.PowerMeasurement(datetime.now(), *result)
+            node = rfdatatypes.PowerMeasurement(clock.now(), *result)
 
             # in order to making the measurements standard
             node.standardize('vrms', 0.01)
 
-            # get the deviceid from the node_decodes dictionary
-            # convert it to uuid format!
-            node.deviceid = uuid.UUID(self._node_decodes[0][str(self._node_id)])
+            # the handle of the device of the node
+            node.device = self.get_device(self._node_id)
             return node
         except AttributeError as e:
             _logger.warn("#warn:%s:is-not-an-attribute-of-rfdatatypes")
@@ -168,11 +289,13 @@ class Node10Decoder(NodeDecoder):
 
 
 class TempHumDecoder(NodeDecoder):
+    TYPE = 'temp_hum_measurement'
+    _RATES = {'temp': 0.1, 'temp_external': 0.1, 'humidity': 0.1, 'battery': 0.1}
 
     def set_id(self, id):
         self._node_id = id
 
-    def decode(self, data):
+    def decode(self, data, rejected=None):
         """
         decodes data for temperature humidity sensors
         :param data: (array of string) the data frame passed by RFPi
@@ -183,15 +306,16 @@ class TempHumDecoder(NodeDecoder):
             # interpret each two bytes as a singe integer
             result = struct.pack(self._node_decodes[0]['rec_data_format'], *data)
             result = struct.unpack(self._node_decodes[0]['real_data_format'], result)
+            if not self.in_range(result, rejected):
+                return None
 
-            node = temphdatatypes.TempHumidityMeasurements(datetime.now(), *result)
+            node = temphdatatypes.TempHumidityMeasurements(clock.now(), *result)
 
             # in order to making the measurements standard
             node.standardize('all', 0.1)
 
-            # get the deviceid from the node_decodes dictionary
-            # convert it to uuid format!
-            node.deviceid = uuid.UUID(self._node_decodes[0][str(self._node_id)])
+            # the handle of the device of the node
+            node.device = self.get_device(self._node_id)
             return node
         except AttributeError as e:
             _logger.warn("#warn:%s:is-not-an-attribute-of-temp-hum")
@@ -1,23 +1,37 @@
 import logging
+import os
+import queue
 import serial
 import multiprocessing
+import threading
+from util import profiling
+from util.logger_factory import setup_logging
 
 _logger = logging.getLogger(__name__)
 
-class RFPi(multiprocessing.Process):
+# number of lines in a row which may fail before
+# the reader gives up and leaves it to the Supervisor
+_MAX_SUCCESSIVE_ERRORS = 100
+
+class RFPiBase():
     """
     This Class is responsible for reading data from the
     serial Port on Raspberry Pi
+
+    it holds the reading logic only, use RFPi to run it in its own
+    process or RFPiThread to run it inside the process of the Reporter
     """
-    def __init__(self, queue, decoder, com_port, com_baud):
+    def __init__(self, queue, decoder, com_port, com_baud, stats=None):
         """
-        :param queue: (multiprocessing.Queue) a shared queue shared with Reporter
+        :param queue: the bounded queue of this reader, read by the Reporter
+        (multiprocessing.Queue for RFPi, queue.Queue for RFPiThread)
         :param decoder: an instance of a Decoder
         :param com_port: (string): path to COM port
         :param com_baud: (int)
+        :param stats: (util.supervisor.ReaderStats) counters read by the Supervisor
         :return:
         """
-        multiprocessing.Process.__init__(self, daemon=True)
+        self._stats = stats
         self._com_port = com_port
         self._com_baud = com_baud
         self._queue = queue
@@ -55,13 +69,13 @@ class RFPi(multiprocessing.Process):
             if command:
 
                 # write the setting into the device
-                _logger.info("#info:start-writing-setting#command:%s" % command)
+                _logger.info("#info:start-writing-setting#command:%s", command)
                 self.serial_port.write(command)
             else:
                 _logger.info("#info:empty-command")
         except serial.SerialException as e:
             _logger.exception(e)
-            _logger.error("could not set the " + command + " for", self.serial_port, str(e.args))
+            _logger.error("#error:could-not-set-the-command#command:%s#port:%s#error:%s", command, self.serial_port, e.args)
 
     def set_up(self, settings=None):
         """
@@ -94,45 +108,131 @@ class RFPi(multiprocessing.Process):
     def run(self):
         """
         runs the Process for reading from serial port
-        :return:
-        """
 
-        _logger.info("#info:reading from the serial port %s" % str(self.serial_port))
-        if self.serial_port:
+        the port is opened and the device set up here, not by the starting
+        process, so that all radios are set up in parallel while the
+        Reporter is already connecting to the server.
 
-            # line is the input we get form serial port
-            line = ""
+        returns when the serial port fails or when _MAX_SUCCESSIVE_ERRORS
+        lines in a row could not be handled, the Supervisor then starts
+        a new reader with a freshly opened serial port
+        :return:
+        """
+        if self.serial_port is None:
             try:
-                while True:
-                    while "\r\n" not in line:
-
-                        # keep reading/appending till we reach to a '\r\n'
-                        line += self.serial_port.readline().decode("ascii")
-
-                    # To get rid of the '\r\n', which has a size 2 !
-                    # When there is no more data to read from serial port
-                    # we may have a line containing just a '\r\n'!
-                    line = line.strip()
-                    if len(line) > 0:
-
-                        _logger.debug("#nextline:%s", line)
+                self.set_up()
+            except serial.SerialException as e:
+                _logger.error("#error:could-not-set-up-the-serial-port-%s", self._com_port)
+                _logger.exception(e)
+                return
 
-                        # decode the line
-                        data = self.decoder.decode(line)
+        _logger.info("#info:reading from the serial port %s", self.serial_port)
 
-                        # if decode was successful put into shared queue
-                        if data:
-                            self._queue.put_nowait(data)
+        rejected = self._stats.record_rejection if self._stats else None
 
-                        # empty the line after each successful read
-                        line = ""
+        # line is the input we get form serial port, the raw bytes
+        line = b""
+        errors = 0
+        while True:
+            try:
+                while b"\r\n" not in line:
+
+                    # keep reading/appending till we reach to a '\r\n'
+                    line += self.serial_port.readline()
+
+                # To get rid of the '\r\n', which has a size 2 !
+                # When there is no more data to read from serial port
+                # we may have a line containing just a '\r\n'!
+                line = line.strip()
+                if len(line) > 0:
+
+                    _logger.debug("#nextline:%s", line)
+
+                    # reject what is not a measurement before decoding it
+                    reason = self.decoder.prefilter(line)
+                    if reason:
+                        data = None
+                        if rejected:
+                            rejected(reason)
+                    else:
+                        with profiling.stage('rfpi.decode'):
+                            data = self.decoder.decode(line.decode("ascii"), rejected)
+
+                    # if decode was successful put into shared queue
+                    if data:
+                        self._put(data)
+                    elif self._stats and reason not in ('shape', 'node'):
+                        # only a frame of a known node which then failed is a failure
+                        # of its device, status lines and noise are just rejections
+                        device = self.decoder.device_of(line.decode("ascii", "replace"))
+                        if device is not None:
+                            self._stats.record_decode_failure(device)
+
+                errors = 0
 
             except serial.SerialException as e:
                 _logger.error("#error:An-error-occurred-while-reading-from-the-serial-port")
                 _logger.exception(e)
+                return
             except Exception as e:
                 _logger.error("#error:UNpredicted-exception-while-reading-from-serial-port")
                 _logger.exception(e)
-                self.run()
-        else:
-            _logger.error("#error:Serial-port-is-None!-Call-set_up-function?")
+                if self._stats:
+                    self._stats.record_error()
+                errors += 1
+                if errors >= _MAX_SUCCESSIVE_ERRORS:
+                    _logger.error("#error:giving-up-after-successive-errors#errors:%s", errors)
+                    return
+
+            # empty the line after each read, successful or not
+            line = b""
+
+    def _put(self, data):
+        """
+        puts a measurement into the queue of this reader, the measurement
+        is dropped if the queue is full (the Reporter does not keep up)
+        """
+        try:
+            self._queue.put_nowait(data)
+        except queue.Full:
+            if self._stats:
+                self._stats.record_drop()
+            return
+        if self._stats:
+            self._stats.record()
+
+    def tear_down(self):
+        """
+        closes the serial port, called by the Supervisor before
+        a new reader is opening the port again
+        """
+        if self.serial_port:
+            self.serial_port.close()
+
+
+class RFPi(RFPiBase, multiprocessing.Process):
+    """
+    RFPi reader running in its own process, the decoded measurements
+    are pickled into a multiprocessing.Queue
+    """
+    def __init__(self, queue, decoder, com_port, com_baud, stats=None):
+        multiprocessing.Process.__init__(self, daemon=True)
+        RFPiBase.__init__(self, queue, decoder, com_port, com_baud, stats)
+
+    def run(self):
+        # the log writer thread and the profiler of the
+        # parent do not exist in this process
+        name = 'rfpi-%s' % os.path.basename(self._com_port)
+        setup_logging(name)
+        profiling.install(name).add_probe('queue', self._queue.qsize)
+        RFPiBase.run(self)
+
+
+class RFPiThread(RFPiBase, threading.Thread):
+    """
+    RFPi reader running as a thread in the process of the Reporter,
+    the decoded measurements are handed over in memory (queue.Queue)
+    """
+    def __init__(self, queue, decoder, com_port, com_baud, stats=None):
+        threading.Thread.__init__(self, daemon=True)
+        RFPiBase.__init__(self, queue, decoder, com_port, com_baud, stats)
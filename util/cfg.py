@@ -39,3 +39,348 @@ def get_server_host():
 
 def get_server_port():
     return _get_server_info()['serverPort']
+
+
+def get_client_mode():
+    """
+    :return: (string) 'multiprocess' or 'single', see [client] in client.config
+    """
+    return _get_config().get('client', 'mode', fallback='multiprocess')
+
+
+def get_supervisor_settings():
+    """
+    :return: (dict) settings of the reader Supervisor, see [supervisor] in client.config
+    """
+    config = _get_config()
+    return {'check_interval': config.getfloat('supervisor', 'check_interval', fallback=2),
+            'stall_timeout': config.getfloat('supervisor', 'stall_timeout', fallback=120),
+            'restart_stalled': config.getboolean('supervisor', 'restart_stalled', fallback=False),
+            'min_backoff': config.getfloat('supervisor', 'min_backoff', fallback=1),
+            'max_backoff': config.getfloat('supervisor', 'max_backoff', fallback=60),
+            'report_interval': config.getfloat('supervisor', 'report_interval', fallback=300)}
+
+
+def _split_list(value):
+    return [item.strip() for item in value.split(';') if item.strip()]
+
+
+def get_rfpi_ports():
+    """
+    :return: list of the serial ports of the RFPi receivers, [rfpi] port
+    may list several ports separated by ';'
+    """
+    return _split_list(get_rfpi_settings()['port'])
+
+
+def get_zigbee_ports():
+    """
+    :return: list of the serial ports of the XBee radios, [zigbee] port
+    may list several ports separated by ';'
+    """
+    return _split_list(_get_config().get('zigbee', 'port', fallback='/dev/ttyUSB0'))
+
+
+def get_zigbee_baud():
+    return _get_config().getint('zigbee', 'baud', fallback=9600)
+
+
+def get_plug_control_settings():
+    """
+    :return: (dict) whether the plug meters are set up one by one ('enabled', otherwise by
+    one broadcast) and the keyword arguments of zigbee.plug_control.PlugControl, see [zigbee]
+    """
+    config = _get_config()
+    return {'enabled': config.get('zigbee', 'setup', fallback='device') == 'device',
+            'txt': config.getint('zigbee', 'txt', fallback=4),
+            'rgb': config.get('zigbee', 'rgb', fallback='off,off,on'),
+            'retries': config.getint('zigbee', 'setup_retries', fallback=3),
+            'timeout': config.getfloat('zigbee', 'setup_timeout', fallback=5),
+            'adaptive': config.getboolean('zigbee', 'adaptive_txt', fallback=True),
+            'min_txt': config.getint('zigbee', 'min_txt', fallback=2),
+            'max_txt': config.getint('zigbee', 'max_txt', fallback=60),
+            'busy_change': config.getfloat('zigbee', 'busy_change', fallback=5.0),
+            'idle_change': config.getfloat('zigbee', 'idle_change', fallback=0.5),
+            'backlog_high': config.getint('zigbee', 'backlog_high', fallback=10000),
+            'hold': config.getfloat('zigbee', 'txt_hold', fallback=60)}
+
+
+def get_source_queue_size():
+    """
+    :return: (int) number of readings each reader may buffer before dropping
+    """
+    return _get_config().getint('client', 'source_queue_size', fallback=10000)
+
+
+def get_dedup_window():
+    """
+    :return: (float) seconds in which the same frame received by
+    another radio is dropped as a duplicate, 0 to disable
+    """
+    return _get_config().getfloat('client', 'dedup_window', fallback=0.5)
+
+
+def get_transport():
+    """
+    :return: (string) 'queue' or 'ring', how the reader processes hand over their readings
+    """
+    return _get_config().get('client', 'transport', fallback='queue')
+
+
+def get_ring_capacity():
+    """
+    :return: (int) number of records in the shared memory ring of a reader, a power of two
+    """
+    return _get_config().getint('client', 'ring_capacity', fallback=4096)
+
+
+def get_overload_settings():
+    """
+    :return: (dict) what a reader does when its queue is full, keyword arguments of util.overload.OverloadQueue
+    """
+    config = _get_config()
+    return {'policy': config.get('client', 'overload_policy', fallback='drop_new'),
+            'downsample_interval': config.getfloat('client', 'downsample_interval', fallback=10),
+            'block_timeout': config.getfloat('client', 'block_timeout', fallback=5)}
+
+
+def get_priority_settings():
+    """
+    :return: (dict) weights of the measurement types ('weights'), factor of the
+    live readings ('live_factor') and 'backfill_batch', see [priority] in client.config
+    """
+    config = _get_config()
+    weights = {}
+    if config.has_section('priority'):
+        weights = dict((name, config.getint('priority', name)) for name in config.options('priority')
+                       if name not in ('live', 'backfill_batch'))
+    return {'weights': weights,
+            'live_factor': config.getint('priority', 'live', fallback=1),
+            'backfill_batch': config.getint('priority', 'backfill_batch', fallback=8)}
+
+
+def get_device_ids():
+    """
+    :return: list of the ids of all configured devices, the uuids of the
+    RFPi nodes ([node10], [temp-hum]) and the mac addresses of the XBees
+    """
+    config = _get_config()
+    ids = []
+    for section in ('node10', 'temp-hum'):
+        if config.has_section(section):
+            ids.extend(config.get(section, option) for option in config.options(section) if option.isdigit())
+    if config.has_section('zigbee'):
+        ids.extend(_split_list(config.get('zigbee', 'plugmeters', fallback='')))
+        ids.extend(_split_list(config.get('zigbee', 'multisensors', fallback='')))
+    return ids
+
+
+def get_device_table_file():
+    return _get_config().get('client', 'device_table_file', fallback='devices.state')
+
+
+def get_batch_format():
+    """
+    :return: (string) 'pickle' or 'columnar', how the measurements of a message are sent
+    """
+    return _get_config().get('client', 'batch_format', fallback='pickle')
+
+
+def get_clock_settings():
+    """
+    :return: (dict) 'sync' (bool), 'interval' (seconds) and 'filter_size' of the clock synchronization
+    """
+    config = _get_config()
+    return {'sync': config.getboolean('clock', 'sync', fallback=True),
+            'interval': config.getfloat('clock', 'interval', fallback=600),
+            'filter_size': config.getint('clock', 'filter_size', fallback=8)}
+
+
+def get_tls_settings():
+    """
+    :return: (dict) settings of the tls connection, see [ssl] in client.config
+    """
+    config = _get_config()
+    return {'min_version': config.get('ssl', 'min_version', fallback='TLSv1_2'),
+            'ciphers': config.get('ssl', 'ciphers', fallback='ECDHE+CHACHA20:ECDHE+AESGCM:!aNULL:!MD5'),
+            'verify': config.getboolean('ssl', 'verify', fallback=False),
+            'ca_file': config.get('ssl', 'caFile', fallback='') or None,
+            'check_hostname': config.getboolean('ssl', 'check_hostname', fallback=False),
+            'resume_sessions': config.getboolean('ssl', 'resume_sessions', fallback=True)}
+
+
+def get_socket_settings():
+    """
+    :return: (dict) options of the socket to the server, see [socket] in client.config
+    """
+    config = _get_config()
+    return {'nodelay': config.getboolean('socket', 'nodelay', fallback=True),
+            'keepalive_idle': config.getint('socket', 'keepalive_idle', fallback=60),
+            'keepalive_interval': config.getint('socket', 'keepalive_interval', fallback=10),
+            'keepalive_count': config.getint('socket', 'keepalive_count', fallback=5)}
+
+
+def get_batch_log_settings():
+    """
+    :return: (dict) 'enabled' and the keyword arguments of communication.batch_log.BatchLog
+    """
+    config = _get_config()
+    return {'enabled': config.getboolean('batch_log', 'enabled', fallback=True),
+            'directory': config.get('batch_log', 'directory', fallback='batches'),
+            'segment_bytes': config.getint('batch_log', 'segment_bytes', fallback=4 * 1024 * 1024),
+            'max_segments': config.getint('batch_log', 'max_segments', fallback=16)}
+
+
+def get_concentrator_settings():
+    """
+    :return: (dict) 'enabled', 'host' and 'port' the downstream clients connect to,
+    number of 'upstream_connections' to the server and whether to 'fsync' the buffered file
+    """
+    config = _get_config()
+    return {'enabled': config.getboolean('concentrator', 'enabled', fallback=False),
+            'host': config.get('concentrator', 'host', fallback='0.0.0.0'),
+            'port': config.getint('concentrator', 'port', fallback=13456),
+            'upstream_connections': config.getint('concentrator', 'upstream_connections', fallback=2),
+            'fsync': config.getboolean('concentrator', 'fsync', fallback=True)}
+
+
+def get_sink_settings():
+    """
+    :return: list of dictionaries, 'name', 'type' and the keyword arguments of each sink
+    listed in [sinks] names, see communication.sinks.create_sink and [sink:<name>] in client.config
+    """
+    config = _get_config()
+    sinks = []
+    for name in _split_list(config.get('sinks', 'names', fallback='')):
+        section = 'sink:%s' % name
+        settings = {'name': name,
+                    'type': config.get(section, 'type', fallback='archive'),
+                    'queue_size': config.getint(section, 'queue_size', fallback=10000),
+                    'batch_size': config.getint(section, 'batch_size', fallback=1000),
+                    'flush_interval': config.getfloat(section, 'flush_interval', fallback=60)}
+        if settings['type'] == 'archive':
+            settings.update({'directory': config.get(section, 'directory', fallback='archive'),
+                             'archive_format': config.get(section, 'format', fallback='csv'),
+                             'rotate_bytes': config.getint(section, 'rotate_bytes', fallback=16 * 1024 * 1024),
+                             'rotate_interval': config.getfloat(section, 'rotate_interval', fallback=3600),
+                             'max_files': config.getint(section, 'max_files', fallback=168)})
+        else:
+            settings['address'] = config.get(section, 'address')
+        sinks.append(settings)
+    return sinks
+
+
+def get_history_settings():
+    """
+    :return: (dict) 'enabled', unix 'socket' of the queries, 'capacity' (measurements
+    kept per device) and 'max_buffer' (bytes a subscriber may fall behind), see [history]
+    """
+    config = _get_config()
+    return {'enabled': config.getboolean('history', 'enabled', fallback=False),
+            'socket': config.get('history', 'socket', fallback='/tmp/i13mon-history.sock'),
+            'capacity': config.getint('history', 'capacity', fallback=3600),
+            'max_buffer': config.getint('history', 'max_buffer', fallback=1024 * 1024)}
+
+
+def get_protocol_settings():
+    """
+    :return: (dict) whether to offer the 'hello' handshake, the 'features' offered (feature ->
+    values, the preferred first), the 'window' and 'max_in_flight' messages with pipelined acks
+    """
+    config = _get_config()
+    return {'hello': config.getboolean('protocol', 'hello', fallback=True),
+            'features': dict((name, _split_list(config.get('protocol', name, fallback=';'.join(values))))
+                             for name, values in (('framing', ('length', 'pickle')),
+                                                  ('encoding', ('columnar', 'pickle')),
+                                                  ('compression', ('zlib', 'none')),
+                                                  ('ack', ('pipelined', 'each')),
+                                                  ('health', ('summary', 'none')),
+                                                  ('devices', ('table', 'ids')))),
+            'window': config.getint('protocol', 'window', fallback=3),
+            'max_in_flight': config.getint('protocol', 'max_in_flight', fallback=8)}
+
+
+def get_health_settings():
+    """
+    :return: (dict) 'enabled', seconds between two health batches ('interval') and
+    the 'gap_factor' of the expected interval from which frames count as missed, see [health]
+    """
+    config = _get_config()
+    return {'enabled': config.getboolean('health', 'enabled', fallback=True),
+            'interval': config.getfloat('health', 'interval', fallback=300),
+            'gap_factor': config.getfloat('health', 'gap_factor', fallback=1.5)}
+
+
+def get_validation_settings():
+    """
+    :return: (dict) whether the lines of the RFPi are checked before decoding ('prefilter') and
+    the plausible 'ranges' of the measurements, type -> field -> (low, high), see [validation]
+    """
+    config = _get_config()
+    ranges = {}
+    if config.has_section('validation'):
+        for option, value in config.items('validation'):
+            if '.' not in option:
+                continue
+            measurement_type, field = option.split('.', 1)
+            low, high = value.split(':')
+            ranges.setdefault(measurement_type, {})[field] = (float(low), float(high))
+    return {'prefilter': config.getboolean('validation', 'prefilter', fallback=True),
+            'ranges': ranges}
+
+
+def get_encoder_settings():
+    """
+    :return: (dict) 'workers' encoding the messages (0 for none) and their 'kind', 'thread' or 'process'
+    """
+    config = _get_config()
+    return {'workers': config.getint('encoder', 'workers', fallback=0),
+            'kind': config.get('encoder', 'kind', fallback='thread')}
+
+
+def get_sequence_file():
+    """
+    :return: (string) file keeping the sequence number of the records across restarts
+    """
+    return _get_config().get('client', 'sequence_file', fallback='record-seq.state')
+
+
+def get_msg_counter_file():
+    """
+    :return: (string) file keeping the message ids across restarts
+    """
+    return _get_config().get('client', 'msg_counter_file', fallback='msg-counter.state')
+
+
+def get_logging_settings():
+    """
+    :return: (dict) settings of the logging, see [logging] in client.config
+    """
+    config = _get_config()
+    return {'level': config.get('logging', 'level', fallback='INFO').upper(),
+            'file': config.get('logging', 'file', fallback='client.log'),
+            'max_bytes': config.getint('logging', 'max_bytes', fallback=5 * 1024 * 1024),
+            'backup_count': config.getint('logging', 'backup_count', fallback=3),
+            'console': config.getboolean('logging', 'console', fallback=True),
+            'queue_size': config.getint('logging', 'queue_size', fallback=10000),
+            'rate_limit': config.getint('logging', 'rate_limit', fallback=10),
+            'rate_interval': config.getfloat('logging', 'rate_interval', fallback=60)}
+
+
+def get_profiling_settings():
+    """
+    :return: (dict) settings of the profiler, see [profiling] in client.config
+    """
+    config = _get_config()
+    return {'enabled': config.getboolean('profiling', 'enabled', fallback=False),
+            'directory': config.get('profiling', 'directory', fallback='.'),
+            'interval': config.getfloat('profiling', 'interval', fallback=0.01),
+            'slow_callback': config.getfloat('profiling', 'slow_callback', fallback=0.1)}
+
+
+def is_rfpi_enabled():
+    return _get_config().getboolean('rfpi', 'enabled', fallback=True)
+
+
+def is_zigbee_enabled():
+    return _get_config().getboolean('zigbee', 'enabled', fallback=True)
@@ -0,0 +1,118 @@
+import collections
+import logging
+import time
+from datetime import datetime
+from multiprocessing.sharedctypes import RawValue
+
+_logger = logging.getLogger(__name__)
+
+# the local clock runs from the monotonic clock, so the synchronized timestamps
+# neither jump when ntp sets the wall clock nor when it is set by hand. the bases
+# are taken on import, before the reader processes are forked.
+_wall_base = time.time()
+_monotonic_base = time.monotonic()
+
+# the estimate of the server clock, written by the main process only
+# and read by the readers: offset to the local clock at the local time
+# 'estimated_at', drift of the local clock, negative uncertainty until synchronized
+_offset = RawValue('d', 0.0)
+_drift = RawValue('d', 0.0)
+_estimated_at = RawValue('d', 0.0)
+_uncertainty = RawValue('d', -1.0)
+
+# the largest drift believed, as ntp does (500 ppm)
+_MAX_DRIFT = 0.0005
+
+
+def local_time():
+    """
+    :return: (float) seconds since epoch by the local monotonic clock
+    """
+    return _wall_base + (time.monotonic() - _monotonic_base)
+
+
+def timestamp():
+    """
+    :return: (float) seconds since epoch by the clock of the server, as far as it is known.
+    the wall clock until the first synchronization (e.g. [clock] sync=false or a server
+    not answering TIME_SYNC), so a wall clock set by ntp after the start is taken up
+    """
+    if _uncertainty.value < 0:
+        return time.time()
+    local = local_time()
+    return local + _offset.value + _drift.value * (local - _estimated_at.value)
+
+
+def now():
+    """
+    used instead of datetime.now() to stamp the measurements
+    :return: (datetime) the current time by the clock of the server
+    """
+    return datetime.fromtimestamp(timestamp())
+
+
+def get_offset():
+    """
+    :return: (dict) 'offset' of the timestamps to the local clock now and its
+    'uncertainty' in seconds, None if the clock has not been synchronized yet
+    """
+    local = local_time()
+    uncertainty = _uncertainty.value
+    if uncertainty < 0:
+        return {'offset': time.time() - local, 'uncertainty': None}
+    return {'offset': _offset.value + _drift.value * (local - _estimated_at.value),
+            'uncertainty': uncertainty}
+
+
+class ClockSync():
+    """
+    estimates the offset of the local clock to the clock of the server
+    from ntp style exchanges: the client sends its time t1, the server
+    answers with the times it received (t2) and answered (t3) the request,
+    the client receives the answer at t4.
+
+    of the last 'filter_size' exchanges the one with the shortest round trip
+    is taken, as it is the least disturbed by queueing. the offset follows
+    it smoothly and the drift of the local clock is estimated from the change
+    of the offset over time. the uncertainty is half of its round trip.
+    """
+
+    def __init__(self, filter_size=8, smoothing=0.3):
+        """
+        :param filter_size: (int) number of exchanges the best one is chosen from
+        :param smoothing: (float) weight of a new estimate, 1 to take it as it is
+        """
+        self._samples = collections.deque(maxlen=filter_size)
+        self._smoothing = smoothing
+        self._synchronized = False
+
+    def sample(self, t1, t2, t3, t4):
+        """
+        takes the times of an exchange, t1 and t4 by local_time()
+        :return: (tuple) offset and round trip delay of the exchange
+        """
+        offset = ((t2 - t1) + (t3 - t4)) / 2
+        delay = (t4 - t1) - (t3 - t2)
+        self._samples.append((delay, offset, t4))
+        best_delay, best_offset, best_at = min(self._samples)
+
+        if not self._synchronized:
+            _offset.value = best_offset
+            _drift.value = 0.0
+            self._synchronized = True
+        elif best_at <= _estimated_at.value:
+            # the best exchange has been taken already
+            return offset, delay
+        else:
+            elapsed = best_at - _estimated_at.value
+            predicted = _offset.value + _drift.value * elapsed
+            estimate = predicted + self._smoothing * (best_offset - predicted)
+            drift = _drift.value + self._smoothing * ((estimate - _offset.value) / elapsed - _drift.value)
+            _drift.value = max(-_MAX_DRIFT, min(_MAX_DRIFT, drift))
+            _offset.value = estimate
+        _estimated_at.value = best_at
+        _uncertainty.value = max(best_delay, 0) / 2
+
+        _logger.debug("#debug:clock-synchronized#offset:%.6f#delay:%.6f#drift:%.9f",
+                      _offset.value, delay, _drift.value)
+        return offset, delay
@@ -0,0 +1,80 @@
+import collections
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# attributes which differ between two receptions of the same frame
+_RECEPTION_ATTRIBUTES = ('id', 'ts')
+
+
+class Deduplicator():
+    """
+    detects the same frame received by overlapping radios
+
+    two measurements are the same frame if they have the same type, device
+    and values, their timestamps are at most 'window' seconds apart and they
+    were received by different radios: a device repeating its values is
+    received by the same radio again. memory is bounded by the number of
+    measurements within one window
+    """
+
+    def __init__(self, window=0.5):
+        """
+        :param window: (float) seconds in which a repeated frame is a duplicate, well below
+        the shortest reporting interval of the devices, or their next report is dropped
+        """
+        self._window = window
+
+        # key of a measurement -> {source: timestamp it has been received last by the source}
+        self._seen = {}
+
+        # (timestamp, key, source) in the order of arrival, for expiring _seen
+        self._arrivals = collections.deque()
+
+        self._duplicates = 0
+
+    @staticmethod
+    def key(msg):
+        """
+        :param msg: an instance of an object representing a measurement
+        :return: (tuple) the hashable content of the measurement without
+        the attributes which differ between receptions
+        """
+        return tuple(sorted((name, value) for name, value in msg.__dict__.items()
+                            if name not in _RECEPTION_ATTRIBUTES))
+
+    def is_duplicate(self, msg, source=None):
+        """
+        :param msg: an instance of an object representing a measurement
+        :param source: the radio (e.g. the number of its queue) the measurement was received by
+        :return: (bool) True if the same frame was already seen within the window from another source
+        """
+        ts = msg.ts.timestamp()
+
+        # forget the measurements which are out of the window
+        while self._arrivals and self._arrivals[0][0] < ts - self._window:
+            old_ts, old_key, old_source = self._arrivals.popleft()
+            seen = self._seen.get(old_key)
+            if seen is not None and seen.get(old_source) == old_ts:
+                del seen[old_source]
+                if not seen:
+                    del self._seen[old_key]
+
+        key = Deduplicator.key(msg)
+        seen = self._seen.setdefault(key, {})
+        duplicate = any(other != source and abs(ts - last) <= self._window for other, last in seen.items())
+
+        # every reception is kept, the next frame is compared to the last one of each radio
+        seen[source] = ts
+        self._arrivals.append((ts, key, source))
+
+        if duplicate:
+            self._duplicates += 1
+            _logger.debug("#debug:duplicate-frame-dropped#type:%s#duplicates:%s", msg.type, self._duplicates)
+        return duplicate
+
+    def get_duplicates(self):
+        """
+        :return: (int) number of duplicates detected so far
+        """
+        return self._duplicates
@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+import uuid
+
+from util import cfg
+
+_logger = logging.getLogger(__name__)
+
+# the table of this process, see get_device_table()
+_table = None
+
+# the field holding the id of the device in the measurements of a server without
+# the device table (the 'devices' feature of the handshake), by measurement type
+_LEGACY_FIELDS = {'plug_measurement': 'mac_address'}
+_LEGACY_FIELD = 'deviceid'
+
+
+def legacy_field(measurement_type):
+    """
+    :return: (string) the field of the id of the device in a measurement of the type, as sent before the handles
+    """
+    return _LEGACY_FIELDS.get(measurement_type, _LEGACY_FIELD)
+
+
+def normalize(device):
+    """
+    :param device: uuid (string or uuid.UUID) of a RFPi node or mac address of an XBee
+    :return: (string) the canonical form, lower case uuid or upper case mac address
+    """
+    device = str(device).strip()
+    try:
+        return str(uuid.UUID(device))
+    except ValueError:
+        return device.upper()
+
+
+class DeviceTable():
+    """
+    interns the ids of the devices (the uuids of the RFPi nodes and the mac
+    addresses of the XBees) as small integer handles
+
+    the measurements only carry the handle of their device, the table
+    (handle -> id) is sent to the server once per connection. the table is
+    kept in a file, so a handle never changes its device, not even for the
+    measurements in the buffered file after the configuration changed.
+    """
+
+    def __init__(self, file_name=None):
+        """
+        :param file_name: (string) file the table is kept in, None to keep it in memory only
+        """
+        self._file_name = file_name
+        # id -> handle and handle -> id
+        self._handles = {}
+        self._devices = {}
+
+        if file_name and os.path.exists(file_name):
+            try:
+                with open(file_name) as fin:
+                    for device, handle in json.load(fin).items():
+                        self._handles[device] = handle
+                        self._devices[handle] = device
+            except (IOError, ValueError) as e:
+                _logger.error("#error:could-not-read-the-device-table#file:%s#error:%s", file_name, e)
+
+    def __len__(self):
+        return len(self._handles)
+
+    def add(self, devices):
+        """
+        gives the devices which do not have one yet a handle
+        :param devices: list of ids (see normalize)
+        """
+        new = False
+        for device in devices:
+            device = normalize(device)
+            if device and device not in self._handles:
+                handle = max(self._devices, default=0) + 1
+                self._handles[device] = handle
+                self._devices[handle] = device
+                new = True
+        if new:
+            self._save()
+
+    def _save(self):
+        if not self._file_name:
+            return
+        try:
+            with open(self._file_name, 'w') as fout:
+                json.dump(self._handles, fout, indent=1, sort_keys=True)
+        except IOError as e:
+            _logger.error("#error:could-not-write-the-device-table#file:%s#error:%s", self._file_name, e)
+
+    def handle(self, device):
+        """
+        :param device: id of a device (see normalize)
+        :return: (int) its handle, None for an unknown device
+        """
+        return self._handles.get(normalize(device))
+
+    def device(self, handle):
+        """
+        :return: (string) id of the device with the handle, None if unknown
+        """
+        return self._devices.get(handle)
+
+    def to_dict(self):
+        """
+        :return: (dict) handle -> id, as sent to the server
+        """
+        return dict(self._devices)
+
+    def to_legacy(self, reading):
+        """
+        :param reading: (dict) a measurement referring to its device by handle
+        :return: (dict) a copy with the id of the device in its legacy field instead, see legacy_field.
+        a reading without a known handle (e.g. buffered before the table) keeps the id it carries
+        """
+        legacy = dict(reading)
+        field = legacy_field(legacy.get('type'))
+        device = self.device(legacy.pop('device', None))
+        if device is None:
+            return legacy
+        if field == _LEGACY_FIELD:
+            # the nodes of the RFPi were sent as uuid.UUID, the mac addresses as strings
+            try:
+                device = uuid.UUID(device)
+            except ValueError:
+                pass
+        legacy[field] = device
+        return legacy
+
+    def from_legacy(self, reading):
+        """
+        :param reading: (dict) a measurement carrying the id of its device in its legacy field
+        :return: (dict) a copy with the handle of the device instead, which is added if it is new
+        """
+        reading = dict(reading)
+        device = reading.pop(legacy_field(reading.get('type')), None)
+        if device:
+            self.add([device])
+        reading['device'] = self.handle(device) if device else None
+        return reading
+
+
+def create_device_table():
+    """
+    creates the table of all the devices in client.config
+    :return: (DeviceTable)
+    """
+    table = DeviceTable(cfg.get_device_table_file())
+    table.add(cfg.get_device_ids())
+    _logger.info("#info:device-table-created#devices:%s", len(table))
+    return table
+
+
+def get_device_table():
+    """
+    :return: (DeviceTable) the table of this process, created on the first call.
+    it has to be created before the reader processes are started, which inherit it
+    """
+    global _table
+    if _table is None:
+        _table = create_device_table()
+    return _table
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+
+from util import clock
+
+_logger = logging.getLogger(__name__)
+
+# gaps learned before the expected interval is trusted
+_WARMUP_GAPS = 8
+
+# weight of a new gap in the moving average of the expected interval
+_INTERVAL_WEIGHT = 1 / 16
+
+# counters of a device in a health batch, in this order
+FIELDS = ('received', 'missed', 'duplicates', 'decode_failures', 'interval', 'max_gap', 'silent')
+
+
+class _DeviceHealth():
+    """
+    the reception of one device, a fixed number of counters whatever the number of its frames
+    """
+    __slots__ = ('last_ts', 'interval', 'gaps', 'long_gaps', 'received', 'missed', 'duplicates', 'max_gap')
+
+    def __init__(self):
+        self.last_ts = None
+        # expected seconds between two frames, None until the first gap
+        self.interval = None
+        # gaps seen so far, up to _WARMUP_GAPS
+        self.gaps = 0
+        # long gaps in a row, the device may have slowed down
+        self.long_gaps = 0
+        # the counters since the last health batch
+        self.received = 0
+        self.missed = 0
+        self.duplicates = 0
+        self.max_gap = 0
+
+
+class HealthMonitor():
+    """
+    accounts for the reception of every device, so radio loss can be told
+    apart from uplink loss: the server compares the frames it got with the
+    ones the client received.
+
+    every frame taken from the readers (see util.source_queue.MergedQueue) is
+    recorded, the duplicates received by another radio separately. the expected
+    interval of a device is learned from its gaps (the shortest of the first
+    ones, then a moving average of the regular ones). a gap longer than
+    'gap_factor' intervals counts the frames missed in it, if a device keeps
+    reporting slower its interval is learned again. the frames which could not
+    be decoded are counted by the readers (see util.supervisor.ReaderStats).
+
+    every 'interval' seconds the counters are sent to the server as one
+    HealthMessage (see CommunicationModule.send_health) and started again,
+    if the batch could not be sent they keep adding up until the next one.
+    """
+
+    def __init__(self, decode_failures=None, interval=300, gap_factor=1.5):
+        """
+        :param decode_failures: callable returning the total decode failures, handle -> count
+        (see Supervisor.get_decode_failures), None if they are not counted
+        :param interval: (float) seconds between two health batches
+        :param gap_factor: (float) a gap of more than this many intervals has missed frames
+        """
+        self._decode_failures = decode_failures
+        self._interval = interval
+        self._gap_factor = gap_factor
+
+        # handle -> _DeviceHealth
+        self._devices = {}
+
+        # the totals of the decode failures at the last health batch
+        self._reported_failures = {}
+        self._since = clock.local_time()
+        self._batches = 0
+
+    def record(self, msg, duplicate=False):
+        """
+        called for every frame taken from the readers
+        :param msg: an instance of an object representing a measurement
+        :param duplicate: (bool) True if the same frame was received by another radio before
+        """
+        health = self._devices.get(msg.device)
+        if health is None:
+            health = self._devices[msg.device] = _DeviceHealth()
+        if duplicate:
+            health.duplicates += 1
+            return
+
+        health.received += 1
+        ts = msg.ts.timestamp()
+        if health.last_ts is not None and ts > health.last_ts:
+            self._gap(health, ts - health.last_ts)
+        health.last_ts = ts
+
+    def _gap(self, health, gap):
+        health.max_gap = max(health.max_gap, gap)
+        if health.gaps < _WARMUP_GAPS:
+            # the shortest gap, the first ones may have lost frames already
+            health.gaps += 1
+            health.interval = gap if health.interval is None else min(health.interval, gap)
+            return
+
+        if gap <= self._gap_factor * health.interval:
+            health.long_gaps = 0
+            health.interval += _INTERVAL_WEIGHT * (gap - health.interval)
+            return
+
+        health.missed += max(0, int(round(gap / health.interval)) - 1)
+        health.long_gaps += 1
+        if health.long_gaps >= _WARMUP_GAPS:
+            _logger.info("#info:device-reports-slower-learning-its-interval-again#interval:%.1f#gap:%.1f",
+                         health.interval, gap)
+            health.gaps = health.long_gaps = 0
+            health.interval = None
+
+    def summary(self):
+        """
+        the counters of every device since the last summary, which are started again
+        :return: (dict) handle -> list of the values of FIELDS, the durations in seconds
+        """
+        failures = self._decode_failures() if self._decode_failures else {}
+        now = clock.timestamp()
+        devices = {}
+        for handle in set(self._devices) | set(failures):
+            health = self._devices.get(handle) or _DeviceHealth()
+            failed = failures.get(handle, 0) - self._reported_failures.get(handle, 0)
+            devices[handle] = [health.received, health.missed, health.duplicates, failed,
+                               round(health.interval, 3) if health.interval else None, round(health.max_gap, 3),
+                               round(now - health.last_ts, 3) if health.last_ts else None]
+            health.received = health.missed = health.duplicates = health.max_gap = 0
+        self._reported_failures = failures
+        return devices
+
+    def _restore(self, devices, reported_failures):
+        """
+        adds the counters of a summary which could not be sent back
+        """
+        for handle, values in devices.items():
+            health = self._devices.get(handle)
+            if health is not None:
+                health.received += values[0]
+                health.missed += values[1]
+                health.duplicates += values[2]
+                health.max_gap = max(health.max_gap, values[5])
+        self._reported_failures = reported_failures
+
+    @asyncio.coroutine
+    def report(self, communication_module):
+        """
+        sends a health batch every interval seconds, runs next to the Reporter in its event loop
+        :param communication_module: (CommunicationModule) the connection to the server
+        """
+        while True:
+            yield from asyncio.sleep(self._interval)
+            if not communication_module.is_connected():
+                continue
+            period = clock.local_time() - self._since
+            reported_failures = self._reported_failures
+            devices = self.summary()
+            try:
+                sent = yield from communication_module.send_health(period, FIELDS, devices)
+            except Exception as e:
+                _logger.warn("#warn:could-not-send-the-health-batch#error:%s", e)
+                sent = False
+            if sent:
+                self._since = clock.local_time()
+                self._batches += 1
+            else:
+                self._restore(devices, reported_failures)
+
+    def get_diagnostics(self):
+        """
+        :return: (dict) devices, frames missed and duplicates since the last health batch, used by the profiler
+        """
+        return {'devices': len(self._devices),
+                'missed': sum(health.missed for health in self._devices.values()),
+                'duplicates': sum(health.duplicates for health in self._devices.values()),
+                'batches': self._batches}
@@ -1,18 +1,169 @@
+import atexit
 import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
 
+from util import cfg
 
-def setup_logging():
-    logging.basicConfig(level=logging.DEBUG)
-    formatter = logging.Formatter('#ts:%(asctime)s#level:%(levelname)s#name:%(name)s%(message)s')
+_FORMAT = '#ts:%(asctime)s#level:%(levelname)s#name:%(name)s%(message)s'
 
-    err_handler = logging.FileHandler('errorlog-client.log', mode='w', delay=True)
+# the listener writing the records of this process
+_listener = None
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    lets at most 'limit' records of the same message (logger and format
+    string, not the values) pass within 'interval' seconds, records of level
+    ERROR and above always pass. the number of suppressed records is
+    appended to the first record passing in the next interval.
+
+    meant for the messages logged for every reading, so that a flood of
+    e.g. '#warn:corrupted-data' neither costs the formatting nor fills the SD card
+    """
+
+    def __init__(self, limit=10, interval=60):
+        super().__init__()
+        self._limit = limit
+        self._interval = interval
+        # (logger name, msg) -> [start of the interval, passed, suppressed]
+        self._counts = {}
+        # start of the interval the expired messages were last dropped in
+        self._swept = time.time()
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self._limit <= 0 or record.levelno >= logging.ERROR:
+            return True
+
+        key = (record.name, record.msg)
+        now = time.time()
+        with self._lock:
+            if now - self._swept >= self._interval:
+                self._sweep(now)
+            count = self._counts.get(key)
+            if count is None or now - count[0] >= self._interval:
+                suppressed = count[2] if count else 0
+                self._counts[key] = [now, 1, 0]
+                if suppressed:
+                    record.msg = '%s#suppressed:%s' % (record.msg, suppressed)
+                return True
+            if count[1] < self._limit:
+                count[1] += 1
+                return True
+            count[2] += 1
+            return False
+
+    def _sweep(self, now):
+        """
+        drops the messages whose interval has expired, so that the messages
+        carrying changing values don't pile up. a message with suppressed
+        records is kept one more interval to report them when it comes again
+        """
+        self._swept = now
+        self._counts = dict(
+            (key, count) for key, count in self._counts.items()
+            if now - count[0] < (2 * self._interval if count[2] else self._interval))
+
+
+class _InProcessQueueHandler(logging.handlers.QueueHandler):
+    """
+    hands the records to the listener thread of the same process
+
+    the caller only merges the message with its arguments, the arguments may
+    be changed by it right after. formatting (timestamps, exceptions) and the
+    writing are left to the listener thread. only a queue pickling the records
+    (a multiprocessing.Queue) gets them formatted by the caller.
+    """
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        if isinstance(self.queue, queue.Queue):
+            record.msg = record.getMessage()
+            record.args = None
+            return record
+        return super().prepare(record)
+
+    def enqueue(self, record):
+        # never block or fail the caller, the writer is behind (slow SD card)
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _create_handlers(settings, suffix=''):
+    formatter = logging.Formatter(_FORMAT)
+    name, extension = os.path.splitext(settings['file'])
+
+    err_handler = logging.handlers.RotatingFileHandler(
+        'errorlog-%s%s%s' % (os.path.basename(name), suffix, extension),
+        maxBytes=settings['max_bytes'], backupCount=settings['backup_count'], delay=True)
     err_handler.setLevel(logging.ERROR)
+    # the listener does not look at the level of its handlers
+    err_handler.addFilter(lambda record: record.levelno >= logging.ERROR)
     err_handler.setFormatter(formatter)
 
-    logging.getLogger('').addHandler(err_handler)
-
-    fh = logging.FileHandler('client.log')
+    fh = logging.handlers.RotatingFileHandler(
+        '%s%s%s' % (name, suffix, extension),
+        maxBytes=settings['max_bytes'], backupCount=settings['backup_count'], delay=True)
     fh.setLevel(logging.DEBUG)
     fh.setFormatter(formatter)
 
-    logging.getLogger('').addHandler(fh)
\ No newline at end of file
+    handlers = [err_handler, fh]
+    if settings['console']:
+        console = logging.StreamHandler()
+        console.setFormatter(formatter)
+        handlers.append(console)
+    return handlers
+
+
+def setup_logging(process_name=None, settings=None):
+    """
+    sets up the logging of this process: the callers only put the records
+    into a queue, a background thread formats and writes them into size
+    rotated files. repeated messages below ERROR are rate limited.
+
+    :param process_name: (string) None for the main process, the name of a
+    reader process otherwise. every process has its own writer thread and
+    files (e.g. client.rfpi-ttyAMA0.log) so that no two processes rotate the same file
+    :param settings: (dict) as returned by cfg.get_logging_settings, read from client.config if None
+    """
+    global _listener
+
+    settings = settings or cfg.get_logging_settings()
+    suffix = '.%s' % process_name if process_name else ''
+
+    # a forked process inherits the handlers but not the listener thread
+    if _listener is not None and process_name is None:
+        _listener.stop()
+
+    log_queue = queue.Queue(maxsize=settings['queue_size'])
+    queue_handler = _InProcessQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(settings['rate_limit'], settings['rate_interval']))
+
+    root = logging.getLogger('')
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(settings['level'])
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, *_create_handlers(settings, suffix))
+    _listener.start()
+    if process_name is None:
+        atexit.register(stop_logging)
+
+
+def stop_logging():
+    """
+    writes the records still in the queue and stops the writer thread
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
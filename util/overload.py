@@ -0,0 +1,223 @@
+import fcntl
+import logging
+import os
+import pickle
+import queue
+import time
+from contextlib import contextmanager
+from multiprocessing.sharedctypes import RawValue
+
+_logger = logging.getLogger(__name__)
+
+# what a reader does with a reading when its queue is full
+DROP_NEW = 'drop_new'
+SPILL = 'spill'
+DROP_OLDEST = 'drop_oldest'
+DOWNSAMPLE = 'downsample'
+BLOCK = 'block'
+POLICIES = (DROP_NEW, SPILL, DROP_OLDEST, DOWNSAMPLE, BLOCK)
+
+# seconds between two tries of a blocked reader
+_BLOCK_INTERVAL = 0.05
+
+# the queue is downsampled once it is filled that much
+_DOWNSAMPLE_FILL = 0.5
+
+_COUNTERS = ('spilled', 'dropped_oldest', 'downsampled', 'blocked', 'dropped')
+
+
+@contextmanager
+def locked(file):
+    """
+    holds an exclusive lock on an open file, the buffered file is
+    written by the Reporter and the spilling readers at the same time
+    """
+    fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+    try:
+        yield file
+    finally:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+
+
+def _is_current(file, file_name):
+    """
+    :return: (bool) True if the open file still is the one named file_name
+    """
+    try:
+        return os.path.samestat(os.fstat(file.fileno()), os.stat(file_name))
+    except FileNotFoundError:
+        return False
+
+
+@contextmanager
+def appending(file_name):
+    """
+    opens the buffered file for appending and holds its lock. the Reporter
+    renames the file once it starts sending it (see Reporter._read_buffered),
+    a writer which opened it before gets the new file instead
+    """
+    while True:
+        with open(file_name, 'ab') as fout, locked(fout):
+            if _is_current(fout, file_name):
+                yield fout
+                fout.flush()
+                return
+
+
+def spill(file_name, msg):
+    """
+    appends a measurement to the buffered file of the Reporter
+    """
+    with appending(file_name) as fout:
+        pickle.dump(msg, fout)
+
+
+class OverloadQueue():
+    """
+    the bounded queue of a reader together with what happens to a reading
+    when the queue is full, i.e. the Reporter does not keep up (no uplink,
+    waiting for acks):
+
+        drop_new: the reading is dropped
+        spill: the reading is appended to the buffered file of the Reporter
+        drop_oldest: the oldest reading of the queue is dropped instead
+        downsample: from half full on, only one reading per device is kept
+                    every 'downsample_interval' seconds, then drop_new
+        block: the reader waits up to 'block_timeout' seconds for free space,
+               then drop_new. the serial port may overflow meanwhile.
+
+    so the memory stays bounded no matter how long the uplink is down.
+    the counters are kept in shared memory, the policy is applied in the
+    reader (thread or process), the Reporter reads through the same object.
+    """
+
+    def __init__(self, source_queue, capacity, policy=DROP_NEW, buffer_file='buffered-data.p',
+                 downsample_interval=10, block_timeout=5):
+        """
+        :param source_queue: the bounded queue (queue.Queue, multiprocessing.Queue or util.shm_ring.RecordRing)
+        :param capacity: (int) maximum size of the queue
+        :param policy: (string) one of POLICIES
+        :param buffer_file: (string) buffered file of the Reporter, for spill
+        :param downsample_interval: (float) seconds between two kept readings of a device, for downsample
+        :param block_timeout: (float) seconds a reader waits for space, for block
+        """
+        if policy not in POLICIES:
+            raise ValueError("unknown overload policy: %s" % policy)
+        if policy == DROP_OLDEST and hasattr(source_queue, 'read_batch'):
+            # only the Reporter may take from a ring
+            raise ValueError("the overload policy drop_oldest does not work with a ring")
+
+        self._queue = source_queue
+        self._capacity = capacity
+        self._policy = policy
+        self._buffer_file = buffer_file
+        self._downsample_interval = downsample_interval
+        self._block_timeout = block_timeout
+        self._counters = dict((name, RawValue('L', 0)) for name in _COUNTERS)
+
+        # device -> time of its last kept reading, only used by the reader
+        self._last_kept = {}
+
+    def _count(self, name):
+        self._counters[name].value += 1
+
+    def get_counters(self):
+        """
+        :return: (dict) how often each policy kicked in, 'dropped' are the readings lost
+        """
+        counters = dict((name, counter.value) for name, counter in self._counters.items())
+        counters['policy'] = self._policy
+        return counters
+
+    def put_nowait(self, msg):
+        """
+        called by the reader
+        :raises queue.Full: if the reading was dropped (or downsampled away)
+        """
+        if self._policy == DOWNSAMPLE and not self._keep(msg):
+            # dropped as well, the reader counts it so
+            self._count('downsampled')
+            raise queue.Full
+
+        try:
+            self._queue.put_nowait(msg)
+            return
+        except queue.Full:
+            pass
+
+        if self._policy == SPILL:
+            try:
+                spill(self._buffer_file, msg)
+                self._count('spilled')
+                return
+            except IOError as e:
+                _logger.error("#error:could-not-spill#file:%s#error:%s", self._buffer_file, e)
+
+        elif self._policy == DROP_OLDEST:
+            try:
+                # a multiprocessing.Queue may still be flushing its last put
+                self._queue.get(True, _BLOCK_INTERVAL)
+                self._count('dropped_oldest')
+                self._queue.put_nowait(msg)
+                return
+            except (queue.Empty, queue.Full):
+                pass
+
+        elif self._policy == BLOCK:
+            self._count('blocked')
+            deadline = time.time() + self._block_timeout
+            while time.time() < deadline:
+                time.sleep(_BLOCK_INTERVAL)
+                try:
+                    self._queue.put_nowait(msg)
+                    return
+                except queue.Full:
+                    pass
+
+        self._count('dropped')
+        raise queue.Full
+
+    def put(self, msg, block=True, timeout=None):
+        self.put_nowait(msg)
+
+    def _keep(self, msg):
+        """
+        :return: (bool) False if the reading is downsampled away
+        """
+        if self._queue.qsize() < self._capacity * _DOWNSAMPLE_FILL:
+            return True
+        device = (msg.type, msg.device)
+        now = time.time()
+        if now - self._last_kept.get(device, 0) < self._downsample_interval:
+            return False
+        self._last_kept[device] = now
+        return True
+
+    def empty(self):
+        return self._queue.empty()
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def get(self, block=True, timeout=None):
+        return self._queue.get(block, timeout)
+
+    def get_nowait(self):
+        return self._queue.get_nowait()
+
+    def get_batch(self, max_count):
+        """
+        :return: list of up to max_count readings, taken as a batch if the queue supports it
+        """
+        if hasattr(self._queue, 'get_batch'):
+            return self._queue.get_batch(max_count)
+        batch = []
+        while len(batch) < max_count:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def get_overruns(self):
+        return self._queue.get_overruns() if hasattr(self._queue, 'get_overruns') else 0
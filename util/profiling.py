@@ -0,0 +1,336 @@
+import collections
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+from util import cfg
+
+_logger = logging.getLogger(__name__)
+
+# stages are only timed while profiling is switched on
+_enabled = False
+
+# name of the stage -> [count, total seconds, max seconds]
+_stages = {}
+# the dump runs in the loop or a thread of its own, see Profiler.install
+_stages_lock = threading.Lock()
+
+# the profiler of this process, see install()
+_profiler = None
+
+
+class _Timer():
+    __slots__ = ('_name', '_start')
+
+    def __init__(self, name):
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.time() - self._start
+        with _stages_lock:
+            timing = _stages.get(self._name)
+            if timing is None:
+                _stages[self._name] = [1, elapsed, elapsed]
+            else:
+                timing[0] += 1
+                timing[1] += elapsed
+                if elapsed > timing[2]:
+                    timing[2] = elapsed
+        return False
+
+
+class _NoTimer():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NO_TIMER = _NoTimer()
+
+
+def stage(name):
+    """
+    times a stage of the pipeline while profiling is switched on:
+
+        with profiling.stage('rfpi.decode'):
+            data = self.decoder.decode(line)
+
+    :param name: (string) name of the stage in the dump
+    :return: a context manager, doing nothing while profiling is off
+    """
+    if not _enabled:
+        return _NO_TIMER
+    return _Timer(name)
+
+
+class StackSampler(threading.Thread):
+    """
+    samples the stacks of all threads of this process and counts them
+    in the collapsed format of flame graphs ('file:function;...  count')
+    """
+
+    def __init__(self, interval):
+        threading.Thread.__init__(self, daemon=True)
+        self._interval = interval
+        self._running = threading.Event()
+        # the sampled stacks are counted while the dump copies them
+        self._lock = threading.Lock()
+        self.samples = collections.Counter()
+
+    def run(self):
+        self._running.set()
+        while self._running.is_set():
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('%s:%s' % (os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                with self._lock:
+                    self.samples[';'.join(reversed(stack))] += 1
+            time.sleep(self._interval)
+
+    def stop(self):
+        self._running.clear()
+
+    def snapshot(self):
+        """
+        :return: (collections.Counter) a copy of the samples taken so far
+        """
+        with self._lock:
+            return collections.Counter(self.samples)
+
+
+class _SlowCallbackHandler(logging.Handler):
+    """
+    keeps the slow callback warnings of asyncio (only logged in debug mode)
+    """
+    def __init__(self, size=1000):
+        logging.Handler.__init__(self, logging.WARNING)
+        self.records = collections.deque(maxlen=size)
+
+    def emit(self, record):
+        self.records.append('%.3f %s' % (record.created, record.getMessage()))
+
+
+class Profiler():
+    """
+    opt-in profiling of a running client, switched on and off with a signal
+    (SIGUSR1 by default). while on, the stacks of all threads are sampled,
+    the stages are timed and the asyncio loop reports slow callbacks.
+    switching off, or the dump signal (SIGUSR2), writes everything together
+    with the values of the probes (queue depths, buffer sizes, ...) into
+    files for offline analysis.
+
+    the main process forwards the signals to the reader processes,
+    which write their own files.
+
+    nothing is done in the signal handlers themselves, they could interrupt
+    the logging or a timer holding its lock: the main process handles the
+    signals in its asyncio loop, the readers in a thread woken up by the
+    handler through a pipe.
+    """
+
+    def __init__(self, name, directory='.', interval=0.01, slow_callback=0.1,
+                 toggle_signal=signal.SIGUSR1, dump_signal=signal.SIGUSR2):
+        """
+        :param name: (string) name of the process, part of the file names
+        :param directory: (string) directory the files are written into
+        :param interval: (float) seconds between two stack samples
+        :param slow_callback: (float) seconds an asyncio callback may take before it is reported
+        """
+        self._name = name
+        self._directory = directory
+        self._interval = interval
+        self._slow_callback = slow_callback
+        self._toggle_signal = toggle_signal
+        self._dump_signal = dump_signal
+        self._probes = collections.OrderedDict()
+        self._children = None
+        self._loop = None
+        self._sampler = None
+        self._slow_callbacks = None
+        self._started = None
+        # written by the signal handler without an asyncio loop, see _handle_signals
+        self._wakeup = None
+
+    def add_probe(self, name, probe):
+        """
+        :param name: (string) name of the value in the dump
+        :param probe: a callable returning a json serializable value, e.g. a queue depth
+        """
+        self._probes[name] = probe
+
+    def set_children(self, children):
+        """
+        :param children: a callable returning the pids the signals are forwarded to
+        """
+        self._children = children
+
+    def install(self, loop=None):
+        """
+        installs the signal handlers
+        :param loop: the asyncio loop of this process, if there is one
+        """
+        self._loop = loop
+        if loop is not None:
+            loop.add_signal_handler(self._toggle_signal, self._handle_toggle, self._toggle_signal)
+            loop.add_signal_handler(self._dump_signal, self._handle_dump, self._dump_signal)
+            return
+
+        read_fd, self._wakeup = os.pipe()
+        threading.Thread(target=self._handle_signals, args=(read_fd,), daemon=True).start()
+        signal.signal(self._toggle_signal, self._notify)
+        signal.signal(self._dump_signal, self._notify)
+
+    def _notify(self, signum, frame):
+        # only wakes up _handle_signals
+        os.write(self._wakeup, bytes([signum]))
+
+    def _handle_signals(self, read_fd):
+        while True:
+            for signum in os.read(read_fd, 64):
+                try:
+                    if signum == self._toggle_signal:
+                        self._handle_toggle(signum)
+                    else:
+                        self._handle_dump(signum)
+                except Exception as e:
+                    _logger.error("#error:could-not-handle-profiling-signal#signal:%s", signum)
+                    _logger.exception(e)
+
+    def _forward(self, signum):
+        if self._children is None:
+            return
+        for pid in self._children():
+            try:
+                os.kill(pid, signum)
+            except OSError as e:
+                _logger.warn("#warn:could-not-forward-signal#pid:%s#error:%s", pid, e)
+
+    def _handle_toggle(self, signum):
+        if self.is_running():
+            self.stop()
+        else:
+            self.start()
+        self._forward(signum)
+
+    def _handle_dump(self, signum):
+        self.dump()
+        self._forward(signum)
+
+    def is_running(self):
+        return self._sampler is not None
+
+    def start(self):
+        global _enabled
+        if self.is_running():
+            return
+        _logger.info("#info:profiling-started#name:%s", self._name)
+        with _stages_lock:
+            _stages.clear()
+        _enabled = True
+        self._started = time.time()
+
+        self._sampler = StackSampler(self._interval)
+        self._sampler.start()
+
+        if self._loop is not None:
+            self._slow_callbacks = _SlowCallbackHandler()
+            logging.getLogger('asyncio').addHandler(self._slow_callbacks)
+            self._loop.slow_callback_duration = self._slow_callback
+            self._loop.set_debug(True)
+
+    def stop(self):
+        """
+        switches profiling off and dumps the results
+        """
+        global _enabled
+        if not self.is_running():
+            return
+        _enabled = False
+        self._sampler.stop()
+        if self._loop is not None:
+            self._loop.set_debug(False)
+            logging.getLogger('asyncio').removeHandler(self._slow_callbacks)
+        self.dump()
+        self._sampler = None
+        self._slow_callbacks = None
+        _logger.info("#info:profiling-stopped#name:%s", self._name)
+
+    def dump(self):
+        """
+        writes the stage timings, the probes and the slow callbacks into
+        diagnostics-<name>-<time>.json and the sampled stacks into stacks-<name>-<time>.txt
+        """
+        now = time.time()
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(now))
+
+        with _stages_lock:
+            stages = dict((name, {'count': count, 'total_s': round(total, 6),
+                                  'mean_ms': round(total / count * 1000, 3), 'max_ms': round(maximum * 1000, 3)})
+                          for name, (count, total, maximum) in _stages.items())
+
+        probes = collections.OrderedDict()
+        for name, probe in self._probes.items():
+            try:
+                probes[name] = probe()
+            except Exception as e:
+                probes[name] = 'error: %s' % e
+
+        diagnostics = {'name': self._name, 'pid': os.getpid(), 'time': now,
+                       'profiling_since': self._started if self.is_running() else None,
+                       'stages': stages, 'probes': probes,
+                       'slow_callbacks': list(self._slow_callbacks.records) if self._slow_callbacks else []}
+
+        file_name = os.path.join(self._directory, 'diagnostics-%s-%s.json' % (self._name, stamp))
+        try:
+            with open(file_name, 'w') as fout:
+                json.dump(diagnostics, fout, indent=2, default=str)
+
+            if self._sampler is not None:
+                with open(os.path.join(self._directory, 'stacks-%s-%s.txt' % (self._name, stamp)), 'w') as fout:
+                    for stack, count in self._sampler.snapshot().most_common():
+                        fout.write('%s %s\n' % (stack, count))
+            _logger.info("#info:diagnostics-dumped#file:%s", file_name)
+        except IOError as e:
+            _logger.error("#error:could-not-write-diagnostics#file:%s#error:%s", file_name, e)
+
+
+def install(name, loop=None, settings=None):
+    """
+    creates and installs the profiler of this process
+    :param name: (string) name of the process
+    :param loop: the asyncio loop of this process, if there is one
+    :param settings: (dict) as returned by cfg.get_profiling_settings, read from client.config if None
+    :return: (Profiler)
+    """
+    global _profiler, _enabled
+    settings = settings or cfg.get_profiling_settings()
+
+    # a forked reader process inherits the state of its parent
+    _enabled = False
+
+    _profiler = Profiler(name, settings['directory'], settings['interval'], settings['slow_callback'])
+    _profiler.install(loop)
+    if settings['enabled']:
+        _profiler.start()
+    return _profiler
+
+
+def get_profiler():
+    """
+    :return: (Profiler) the profiler of this process, None if none was installed
+    """
+    return _profiler
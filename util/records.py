@@ -0,0 +1,95 @@
+import math
+import struct
+from datetime import datetime
+
+from dto.rfdatatypes import PowerMeasurement
+from dto.temphdatatypes import TempHumidityMeasurements
+from dto.zigbeedatatypes import Plugmeasurement
+
+# fixed size encoding of a measurement:
+# type code, handle of the device (see util.devices, 0 for None),
+# timestamp (seconds since epoch), up to six values (nan for None)
+_RECORD = struct.Struct('<B3xId6d')
+RECORD_SIZE = _RECORD.size
+
+_NAN = float('nan')
+_NO_VALUES = (_NAN,) * 6
+
+# how the values are restored: 'i' int, 'f' float, 'onoff' the 'ON'/'OFF' strings
+_INT, _FLOAT, _ONOFF = 'i', 'f', 'onoff'
+
+# type code -> (class, [(attribute, kind)])
+_TYPES = {
+    1: (PowerMeasurement,
+        [('power1', _INT), ('power2', _INT), ('power3', _INT), ('power4', _INT), ('vrms', _FLOAT), ('temp', _INT)]),
+    2: (TempHumidityMeasurements,
+        [('temp', _FLOAT), ('temp_external', _FLOAT), ('humidity', _FLOAT), ('battery', _FLOAT)]),
+    3: (Plugmeasurement,
+        [('load', _INT), ('irms', _INT), ('vrms', _INT), ('freq', _FLOAT), ('work', _FLOAT), ('pow', _ONOFF)]),
+}
+
+# 'type' attribute of a measurement -> type code
+_CODES = {'power_measurement': 1, 'temp_hum_measurement': 2, 'plug_measurement': 3}
+
+# 'type' attribute of a measurement -> [(attribute, kind)] of its values
+FIELDS = dict((name, _TYPES[code][1]) for name, code in _CODES.items())
+
+
+def encode_value(value, kind):
+    """
+    :param kind: one of the kinds in FIELDS
+    :return: (float) the value, nan for None
+    """
+    if value is None:
+        return _NAN
+    if kind == _ONOFF:
+        return 1.0 if value == 'ON' else 0.0
+    return float(value)
+
+
+def decode_value(value, kind):
+    """
+    :param kind: one of the kinds in FIELDS
+    :return: the value as in the measurement, None for nan
+    """
+    if math.isnan(value):
+        return None
+    if kind == _INT:
+        return int(value)
+    if kind == _ONOFF:
+        return 'ON' if value else 'OFF'
+    return value
+
+
+def encode_into(buffer, offset, msg):
+    """
+    writes a measurement as a fixed size record into a buffer
+    :param buffer: a writable buffer, e.g. the shared memory of a RecordRing
+    :param offset: (int) position of the record in the buffer
+    :param msg: a PowerMeasurement, TempHumidityMeasurements or Plugmeasurement
+    :raises KeyError: for other types of measurements
+    """
+    code = _CODES[msg.type]
+    cls, fields = _TYPES[code]
+    values = tuple(encode_value(getattr(msg, name), kind) for name, kind in fields) + _NO_VALUES[len(fields):]
+    _RECORD.pack_into(buffer, offset, code, msg.device or 0, msg.ts.timestamp(), *values)
+
+
+def decode(view):
+    """
+    restores a measurement from its record
+    :param view: a buffer (e.g. memoryview) holding exactly one record
+    :return: a PowerMeasurement, TempHumidityMeasurements or Plugmeasurement
+    """
+    record = _RECORD.unpack_from(view)
+    cls, fields = _TYPES[record[0]]
+    ts = datetime.fromtimestamp(record[2])
+    device = record[1] or None
+    if cls is Plugmeasurement:
+        msg = Plugmeasurement(ts, device)
+    else:
+        msg = cls(ts, *([None] * len(fields)))
+        msg.device = device
+    for (name, kind), value in zip(fields, record[3:]):
+        setattr(msg, name, decode_value(value, kind))
+    return msg
@@ -0,0 +1,91 @@
+import logging
+import os
+
+_logger = logging.getLogger(__name__)
+
+
+class SequenceCounter():
+    """
+    a persistent, monotonically increasing counter
+
+    the counter does not write every value to the disk. it reserves blocks
+    of 'block_size' values and only stores the end of the reserved block.
+    after a restart counting continues at the end of the last reserved
+    block, so a value is never handed out twice, at the cost of a gap of
+    at most 'block_size' values after a crash.
+    """
+
+    def __init__(self, file_name, block_size=1000):
+        """
+        :param file_name: (string) file keeping the end of the reserved block
+        :param block_size: (int) number of values reserved with one write
+        """
+        self._file_name = file_name
+        self._block_size = block_size
+        self._next = self._load()
+        self._reserved = self._next
+
+    def _load(self):
+        """
+        :return: (int) the value to continue at, 1 if there is no file yet
+        :raise ValueError: if the file is corrupted. starting from 1 again would make the
+        server drop every new record as already seen, so the client must not start
+        until the file is repaired (or removed, once the server forgot this client)
+        """
+        try:
+            with open(self._file_name, 'r') as fin:
+                content = fin.read().strip()
+        except FileNotFoundError:
+            return 1
+        try:
+            value = int(content)
+        except ValueError:
+            _logger.error("#error:corrupted-sequence-file#file:%s#content:%r", self._file_name, content[:32])
+            raise ValueError("corrupted sequence file: %s" % self._file_name)
+        _logger.info("#info:sequence-resumed#file:%s#at:%s", self._file_name, value)
+        return value
+
+    def _reserve(self):
+        """
+        stores the end of the next block, written to a temporary
+        file and renamed so a crash never leaves a broken file behind
+        """
+        reserved = self._next + self._block_size
+        temp_name = self._file_name + '.tmp'
+        with open(temp_name, 'w') as fout:
+            fout.write(str(reserved))
+            fout.flush()
+            os.fsync(fout.fileno())
+        os.replace(temp_name, self._file_name)
+        self._reserved = reserved
+
+    def next(self):
+        """
+        :return: (int) the next value of the counter
+        """
+        if self._next >= self._reserved:
+            self._reserve()
+        value = self._next
+        self._next += 1
+        return value
+
+    def current(self):
+        """
+        :return: (int) the last value handed out, 0 if there was none
+        """
+        return self._next - 1
+
+
+def to_ranges(values):
+    """
+    compacts sequence numbers into ranges
+    :param values: iterable of ints
+    :return: list of (first, last) tuples, e.g. [1, 2, 3, 7] -> [(1, 3), (7, 7)]
+    """
+    ranges = []
+    for value in sorted(values):
+        if ranges and value == ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], value)
+        else:
+            ranges.append((value, value))
+    return ranges
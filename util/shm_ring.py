@@ -0,0 +1,132 @@
+import logging
+import multiprocessing
+import queue
+from multiprocessing.sharedctypes import RawArray, RawValue
+
+from util import records
+
+_logger = logging.getLogger(__name__)
+
+# the positions are 32 bit counters which wrap around
+_MASK = 0xFFFFFFFF
+
+
+class RecordRing():
+    """
+    a ring of fixed size measurement records in shared memory,
+    written by exactly one reader process and read by the Reporter
+
+    the producer writes a record and then advances the head, the consumer
+    reads the records up to the head and then advances the tail. so each
+    position has exactly one writer. the head and the tail are only read and
+    written holding a lock, which is a memory barrier: without it a weakly
+    ordered cpu (the arm of a raspberry pi) may show the new head to the
+    consumer before the record. the records themselves are written and read
+    outside of the lock. when the ring is full the new record is dropped and
+    counted as an overrun.
+
+    the memory is allocated with multiprocessing.sharedctypes, the ring has
+    to be created before the reader process is started.
+
+    offers the queue interface used by the readers (put_nowait) and the
+    Reporter (empty, qsize, get, get_nowait) plus get_batch
+    """
+
+    def __init__(self, capacity=4096):
+        """
+        :param capacity: (int) number of records the ring holds, a power of
+        two so that the wrapping positions keep pointing to the same records
+        """
+        if capacity <= 0 or capacity & (capacity - 1):
+            raise ValueError("capacity of the ring must be a power of two: %s" % capacity)
+        self._capacity = capacity
+        self._buffer = RawArray('B', capacity * records.RECORD_SIZE)
+        self._view = memoryview(self._buffer)
+        self._head = RawValue('I', 0)
+        self._tail = RawValue('I', 0)
+        self._overruns = RawValue('I', 0)
+        self._lock = multiprocessing.Lock()
+
+    def __getstate__(self):
+        # memoryviews can not be pickled, the shared memory
+        # is passed on by multiprocessing
+        state = self.__dict__.copy()
+        del state['_view']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._view = memoryview(self._buffer)
+
+    def qsize(self):
+        return (self._head.value - self._tail.value) & _MASK
+
+    def empty(self):
+        return self._head.value == self._tail.value
+
+    def get_overruns(self):
+        """
+        :return: (int) number of records dropped because the ring was full
+        """
+        return self._overruns.value
+
+    def put_nowait(self, msg):
+        """
+        called by the reader, encodes the measurement into the next record
+        :raises queue.Full: if the ring is full, the record is counted as overrun
+        """
+        with self._lock:
+            head = self._head.value
+            tail = self._tail.value
+        if (head - tail) & _MASK >= self._capacity:
+            self._overruns.value = (self._overruns.value + 1) & _MASK
+            raise queue.Full
+        records.encode_into(self._buffer, (head % self._capacity) * records.RECORD_SIZE, msg)
+        with self._lock:
+            self._head.value = (head + 1) & _MASK
+
+    def put(self, msg, block=True, timeout=None):
+        self.put_nowait(msg)
+
+    def read_batch(self, max_count):
+        """
+        :param max_count: (int) maximum number of records
+        :return: list of memoryviews on the next records, valid until release is called
+        """
+        with self._lock:
+            tail = self._tail.value
+            head = self._head.value
+        count = min((head - tail) & _MASK, max_count)
+        size = records.RECORD_SIZE
+        views = []
+        for position in range(tail, tail + count):
+            offset = (position % self._capacity) * size
+            views.append(self._view[offset:offset + size])
+        return views
+
+    def release(self, count):
+        """
+        hands the next 'count' records back to the producer
+        """
+        with self._lock:
+            self._tail.value = (self._tail.value + count) & _MASK
+
+    def get_batch(self, max_count):
+        """
+        :param max_count: (int) maximum number of measurements
+        :return: list of the next measurements, decoded straight from the shared memory
+        """
+        views = self.read_batch(max_count)
+        batch = [records.decode(view) for view in views]
+        self.release(len(views))
+        return batch
+
+    def get_nowait(self):
+        batch = self.get_batch(1)
+        if not batch:
+            raise queue.Empty
+        return batch[0]
+
+    def get(self, block=True, timeout=None):
+        # the Reporter only gets after checking empty()
+        return self.get_nowait()
@@ -0,0 +1,133 @@
+import logging
+import queue
+import time
+
+_logger = logging.getLogger(__name__)
+
+# seconds between two looks into the source queues
+# while a blocking get is waiting
+_POLL_INTERVAL = 0.05
+
+
+class MergedQueue():
+    """
+    merges the bounded queues of several readers into the one queue the
+    Reporter reads from
+
+    every reader has its own queue, so a flooding reader fills up and drops
+    from its own queue only. the queues are read round robin, so it
+    cannot delay the readings of the other readers either.
+
+    offers the part of the queue interface used by the Reporter:
+    empty(), qsize() and get()
+    """
+
+    def __init__(self, deduplicator=None, health=None):
+        """
+        :param deduplicator: (util.dedup.Deduplicator) drops frames received
+        by more than one radio, None to keep all readings
+        :param health: (util.health.HealthMonitor) records every frame and
+        duplicate taken from the source queues, None for no accounting
+        """
+        self._queues = []
+        self._next = 0
+        self._deduplicator = deduplicator
+        self._health = health
+
+    def add(self, source_queue):
+        """
+        :param source_queue: queue of a single reader
+        """
+        self._queues.append(source_queue)
+
+    def empty(self):
+        return all(source_queue.empty() for source_queue in self._queues)
+
+    def qsize(self):
+        return sum(source_queue.qsize() for source_queue in self._queues)
+
+    def sizes(self):
+        """
+        :return: list of the sizes of the source queues
+        """
+        return [source_queue.qsize() for source_queue in self._queues]
+
+    def get(self, block=True, timeout=None):
+        """
+        gets the next reading from the next non empty source queue
+        :return: the reading, or None if it was a duplicate of an earlier reading
+        :raises queue.Empty: if non blocking or timed out and all queues are empty
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            for _ in range(len(self._queues)):
+                source = self._next
+                source_queue = self._queues[source]
+                self._next = (self._next + 1) % len(self._queues)
+                try:
+                    msg = source_queue.get_nowait()
+                except queue.Empty:
+                    continue
+
+                if msg and self._is_duplicate(msg, source):
+                    return None
+                return msg
+
+            if not block or (deadline is not None and time.time() >= deadline):
+                raise queue.Empty
+            time.sleep(_POLL_INTERVAL)
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def get_batch(self, max_count):
+        """
+        takes up to max_count readings, going once round robin over the source
+        queues. sources offering get_batch themselves (util.shm_ring.RecordRing)
+        are read as a batch.
+        :return: list of readings without the duplicates, may be empty
+        """
+        batch = []
+        for _ in range(len(self._queues)):
+            if len(batch) >= max_count:
+                break
+            source = self._next
+            source_queue = self._queues[source]
+            self._next = (self._next + 1) % len(self._queues)
+            if hasattr(source_queue, 'get_batch'):
+                taken = source_queue.get_batch(max_count - len(batch))
+            else:
+                taken = []
+                while len(batch) + len(taken) < max_count:
+                    try:
+                        taken.append(source_queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+            if self._deduplicator or self._health:
+                taken = [msg for msg in taken if msg and not self._is_duplicate(msg, source)]
+            batch.extend(taken)
+        return batch
+
+    def _is_duplicate(self, msg, source):
+        """
+        :param source: (int) number of the source queue the measurement was taken from
+        """
+        duplicate = self._deduplicator is not None and self._deduplicator.is_duplicate(msg, source)
+        if self._health is not None:
+            self._health.record(msg, duplicate)
+        return duplicate
+
+    def get_overload_counters(self):
+        """
+        :return: (list) counters of the overload policy of every source queue, see util.overload
+        """
+        return [source_queue.get_counters() for source_queue in self._queues
+                if hasattr(source_queue, 'get_counters')]
+
+    def get_overruns(self):
+        """
+        :return: (int) records dropped by the source queues which count their overruns
+        """
+        return sum(source_queue.get_overruns() for source_queue in self._queues
+                   if hasattr(source_queue, 'get_overruns'))
@@ -0,0 +1,346 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+
+_logger = logging.getLogger(__name__)
+
+# devices whose decode failures are counted on their own, by handle
+_DEVICE_SLOTS = 256
+
+# why the frames were rejected, see rfpi.decoder.Decoder
+_REJECTIONS = ('shape', 'node', 'tokens', 'range')
+
+
+class ReaderStats():
+    """
+    counters of a single reader, kept in shared memory so that the
+    Supervisor can read them no matter if the reader is a process or a thread
+
+    there is only one writer (the reader), so no lock is needed
+    """
+    def __init__(self):
+        self._readings = multiprocessing.RawValue('L', 0)
+        self._errors = multiprocessing.RawValue('L', 0)
+        self._dropped = multiprocessing.RawValue('L', 0)
+        self._last_reading = multiprocessing.RawValue('d', 0.0)
+        # frames which could not be decoded by the handle of their device,
+        # the ones of unknown devices (and larger handles) in the first slot
+        self._decode_failures = multiprocessing.RawArray('L', _DEVICE_SLOTS)
+        self._rejections = multiprocessing.RawArray('L', len(_REJECTIONS))
+
+    def record(self):
+        """
+        called by the reader for every measurement put into the shared queue
+        """
+        self._readings.value += 1
+        self._last_reading.value = time.time()
+
+    def record_error(self):
+        """
+        called by the reader for every line/frame which could not be handled
+        """
+        self._errors.value += 1
+
+    def record_decode_failure(self, device):
+        """
+        called by the reader for every frame of a device which could not be decoded into a measurement
+        :param device: (int) handle of the device which sent it, None if unknown
+        """
+        self._decode_failures[device if device and device < _DEVICE_SLOTS else 0] += 1
+
+    def record_rejection(self, reason):
+        """
+        called by the decoder for every frame it rejected
+        :param reason: (string) one of 'shape', 'node', 'tokens' and 'range'
+        """
+        self._rejections[_REJECTIONS.index(reason)] += 1
+
+    def record_drop(self):
+        """
+        called by the reader for every measurement dropped because its queue was full
+        """
+        self._dropped.value += 1
+
+    def get_readings(self):
+        return self._readings.value
+
+    def get_errors(self):
+        return self._errors.value
+
+    def get_dropped(self):
+        return self._dropped.value
+
+    def get_decode_failures(self):
+        """
+        :return: (dict) handle (None for the unknown devices) -> number of frames which could not be decoded
+        """
+        return dict((handle or None, count) for handle, count in enumerate(self._decode_failures) if count)
+
+    def get_rejections(self):
+        """
+        :return: (dict) reason -> number of frames rejected for it
+        """
+        return dict(zip(_REJECTIONS, self._rejections))
+
+    def get_last_reading(self):
+        """
+        :return: (float) time of the last reading, 0 if there was none yet
+        """
+        return self._last_reading.value
+
+
+class UplinkBacklog():
+    """
+    the number of measurements waiting for the uplink, kept in shared memory,
+    written in the process of the Reporter (see watch) and read by the readers
+    """
+    def __init__(self):
+        self._backlog = multiprocessing.RawValue('L', 0)
+
+    def get(self):
+        return self._backlog.value
+
+    @asyncio.coroutine
+    def watch(self, measure, interval=5):
+        """
+        updates the backlog every interval seconds, runs next to the Reporter in its event loop
+        :param measure: callable returning the backlog, e.g. Reporter.get_backlog
+        """
+        while True:
+            try:
+                self._backlog.value = measure()
+            except Exception as e:
+                _logger.warn("#warn:could-not-measure-the-uplink-backlog#error:%s", e)
+            yield from asyncio.sleep(interval)
+
+
+class _SupervisedReader():
+    """
+    book keeping of the Supervisor for one reader
+    """
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.stats = ReaderStats()
+        self.reader = None
+        # a terminated reader process which has not exited yet
+        self.stopping = None
+        self.started = 0
+        self.restarts = 0
+        self.backoff = 0
+        self.next_start = 0
+        self.stalled = False
+        self.reported_readings = 0
+        self.reported_errors = 0
+        self.reported_dropped = 0
+
+
+class Supervisor():
+    """
+    starts the serial readers, watches their liveness and throughput and
+    restarts them with an exponential backoff, reopening the serial port,
+    whenever they died
+    """
+
+    def __init__(self, check_interval=2, stall_timeout=120, restart_stalled=False,
+                 min_backoff=1, max_backoff=60, report_interval=300):
+        """
+        :param check_interval: (float) seconds between two checks of the readers
+        :param stall_timeout: (float) seconds without a reading after which a reader is reported as stalled
+        :param restart_stalled: (bool) terminate and restart stalled reader processes
+        :param min_backoff: (float) seconds to wait before the first restart
+        :param max_backoff: (float) upper limit of the doubled waiting time between restarts
+        :param report_interval: (float) seconds between two throughput reports
+        """
+        self._check_interval = check_interval
+        self._stall_timeout = stall_timeout
+        self._restart_stalled = restart_stalled
+        self._min_backoff = min_backoff
+        self._max_backoff = max_backoff
+        self._report_interval = report_interval
+        self._last_report = time.time()
+        self._readers = []
+
+    def add(self, name, factory):
+        """
+        :param name: (string) name of the reader used in the logs
+        :param factory: a callable taking a ReaderStats and returning a
+        new, not yet started reader (RFPi, ZigBeeReader, or their thread variants)
+        """
+        self._readers.append(_SupervisedReader(name, factory))
+
+    def get_readers(self):
+        """
+        :return: list of the currently running readers
+        """
+        return [supervised.reader for supervised in self._readers if supervised.reader]
+
+    def get_reader(self, name):
+        """
+        :param name: (string) name the reader was added with
+        :return: the running reader, None if it is not running
+        """
+        for supervised in self._readers:
+            if supervised.name == name:
+                return supervised.reader
+
+    def get_pids(self):
+        """
+        :return: list of the process ids of the running reader processes
+        """
+        return [reader.pid for reader in self.get_readers()
+                if isinstance(reader, multiprocessing.Process) and reader.is_alive()]
+
+    def get_diagnostics(self):
+        """
+        :return: (dict) name -> counters of every reader, used by the profiler
+        """
+        return dict((supervised.name, {'readings': supervised.stats.get_readings(),
+                                       'errors': supervised.stats.get_errors(),
+                                       'dropped': supervised.stats.get_dropped(),
+                                       'rejected': supervised.stats.get_rejections(),
+                                       'restarts': supervised.restarts,
+                                       'stalled': supervised.stalled,
+                                       'alive': supervised.reader is not None and supervised.reader.is_alive()})
+                    for supervised in self._readers)
+
+    def get_decode_failures(self):
+        """
+        :return: (dict) handle -> frames which could not be decoded, of all readers since the start
+        """
+        failures = {}
+        for supervised in self._readers:
+            for handle, count in supervised.stats.get_decode_failures().items():
+                failures[handle] = failures.get(handle, 0) + count
+        return failures
+
+    def start(self):
+        """
+        starts all readers, a reader which could not be started
+        is retried by the next check
+        """
+        for supervised in self._readers:
+            self._start(supervised)
+
+    def _start(self, supervised):
+        # the reader opens and sets up its serial port itself once started,
+        # so starting does not wait for the radios
+        try:
+            reader = supervised.factory(supervised.stats)
+            reader.start()
+        except Exception as e:
+            _logger.error("#error:could-not-start-reader#name:%s", supervised.name)
+            _logger.exception(e)
+            self._schedule_restart(supervised)
+            return
+
+        supervised.reader = reader
+        supervised.started = time.time()
+        supervised.stalled = False
+        _logger.info("#info:reader-started#name:%s#restarts:%s", supervised.name, supervised.restarts)
+
+    def _schedule_restart(self, supervised):
+        # readers which have been running for a while are restarted
+        # quickly again, the ones dying right away are backed off
+        if supervised.started and time.time() - supervised.started > self._max_backoff:
+            supervised.backoff = self._min_backoff
+        else:
+            supervised.backoff = min(max(supervised.backoff * 2, self._min_backoff), self._max_backoff)
+        supervised.next_start = time.time() + supervised.backoff
+        supervised.started = 0
+        _logger.warn("#warn:restarting-reader#name:%s#in:%ss", supervised.name, supervised.backoff)
+
+    def _stop(self, supervised):
+        reader = supervised.reader
+        supervised.reader = None
+        if reader is None:
+            return
+        if isinstance(reader, multiprocessing.Process) and reader.is_alive():
+            # not joined here, that would block the event loop of the Reporter,
+            # check() starts the reader again once the process has exited
+            reader.terminate()
+            supervised.stopping = reader
+        try:
+            # a reader thread opened the serial port
+            # in this process, close it before it is opened again
+            reader.tear_down()
+        except Exception as e:
+            _logger.warn("#warn:could-not-close-the-serial-port#name:%s#error:%s", supervised.name, e)
+
+    def check(self):
+        """
+        restarts dead readers whose backoff has passed and reports stalls,
+        a terminated reader process is started again once it has exited
+        """
+        now = time.time()
+        for supervised in self._readers:
+            if supervised.reader is not None and not supervised.reader.is_alive():
+                _logger.error("#error:reader-died#name:%s", supervised.name)
+                self._stop(supervised)
+                supervised.restarts += 1
+                self._schedule_restart(supervised)
+
+            if supervised.stopping is not None:
+                if supervised.stopping.is_alive():
+                    if now >= supervised.next_start and hasattr(supervised.stopping, 'kill'):
+                        # it did not exit on SIGTERM within its backoff
+                        supervised.stopping.kill()
+                    continue
+                supervised.stopping.join()
+                supervised.stopping = None
+
+            if supervised.reader is None:
+                if now >= supervised.next_start:
+                    self._start(supervised)
+                continue
+
+            last = max(supervised.stats.get_last_reading(), supervised.started)
+            if now - last > self._stall_timeout:
+                if not supervised.stalled:
+                    _logger.warn("#warn:reader-stalled#name:%s#no-reading-since:%.0fs", supervised.name, now - last)
+                    supervised.stalled = True
+                if self._restart_stalled and isinstance(supervised.reader, multiprocessing.Process):
+                    self._stop(supervised)
+                    supervised.restarts += 1
+                    self._schedule_restart(supervised)
+            elif supervised.stalled:
+                _logger.info("#info:reader-recovered#name:%s", supervised.name)
+                supervised.stalled = False
+
+        if now - self._last_report >= self._report_interval:
+            self.report(now - self._last_report)
+            self._last_report = now
+
+    def report(self, elapsed):
+        """
+        logs the throughput of every reader since the last report
+        :param elapsed: (float) seconds since the last report
+        """
+        for supervised in self._readers:
+            readings = supervised.stats.get_readings()
+            errors = supervised.stats.get_errors()
+            dropped = supervised.stats.get_dropped()
+            _logger.info("#info:reader-throughput#name:%s#readings:%s#per-sec:%.2f#errors:%s#dropped:%s"
+                         "#restarts:%s#alive:%s",
+                         supervised.name, readings - supervised.reported_readings,
+                         (readings - supervised.reported_readings) / elapsed,
+                         errors - supervised.reported_errors, dropped - supervised.reported_dropped,
+                         supervised.restarts, supervised.reader is not None and supervised.reader.is_alive())
+            supervised.reported_readings = readings
+            supervised.reported_errors = errors
+            supervised.reported_dropped = dropped
+
+    @asyncio.coroutine
+    def watch(self):
+        """
+        checks the readers every check_interval seconds,
+        runs next to the Reporter in its event loop
+        """
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                _logger.error("#error:unpredicted-exception-while-supervising-readers")
+                _logger.exception(e)
+            yield from asyncio.sleep(self._check_interval)
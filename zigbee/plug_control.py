@@ -0,0 +1,261 @@
+import collections
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+_UNKNOWN_ADDR = b'\xff\xfe'
+
+# deliver_status of a tx_status frame for a delivered command
+_DELIVERED = b'\x00'
+
+# weight of a new change of the load in its moving average
+_ACTIVITY_WEIGHT = 0.25
+
+# relative change of the interval worth a command to the plug
+_MIN_CHANGE = 0.25
+
+# frame ids of the radio, 0 asks for no tx_status
+_FRAME_IDS = 255
+
+
+def mac_to_address(mac):
+    """
+    :param mac: (string) mac address of an XBee, e.g. '00:13:A2:00:40:B8:F7:A1'
+    :return: (bytes) its 64 bit address, None if it is not a complete mac address
+    """
+    try:
+        address = bytes.fromhex(mac.replace(':', ''))
+    except ValueError:
+        return None
+    return address if len(address) == 8 else None
+
+
+class _Plug():
+    """
+    what is known of one plug meter
+    """
+    __slots__ = ('mac', 'address', 'txt', 'last_change', 'last_ts', 'last_load', 'activity')
+
+    def __init__(self, mac, address):
+        self.mac = mac
+        self.address = address
+        # the reporting interval last sent to the plug, None if it could not be delivered
+        self.txt = None
+        self.last_change = 0
+        self.last_ts = None
+        self.last_load = None
+        # moving average of the change of its load, watts per second
+        self.activity = None
+
+
+class PlugControl():
+    """
+    sets up every plug meter on its own and adapts its reporting interval (TXT)
+
+    the commands are sent with a frame id, the radio answers each with a
+    tx_status frame telling whether the plug got it (see handle_status). all
+    plugs are set up at once, a command which was not delivered within
+    'timeout' seconds is sent again up to 'retries' times. while all 255
+    frame ids wait for their tx_status, the commands are queued and sent
+    as the tx_status frames free the ids.
+
+    the interval of a plug follows the change of its load: a plug whose load
+    changes by 'busy_change' watts per second or more reports every 'min_txt'
+    seconds, one changing by 'idle_change' or less every 'max_txt' seconds,
+    and in between on a logarithmic scale. while more than 'backlog_high'
+    measurements wait for the uplink (see util.supervisor.UplinkBacklog) the
+    intervals are stretched by the backlog. a plug gets a new interval at most
+    every 'hold' seconds and only if it differs enough from the one it has.
+
+    used by the ZigBee reader, which reads the tx_status frames and the
+    measurements and calls check at least every second while the mesh is
+    quiet, so there is no thread of its own.
+    """
+
+    def __init__(self, xbee, plugmeters, backlog=None, txt=4, rgb='off,off,on', retries=3, timeout=5,
+                 adaptive=True, min_txt=2, max_txt=60, busy_change=5.0, idle_change=0.5,
+                 backlog_high=10000, hold=60):
+        """
+        :param xbee: (xbee.ZigBee) the radio
+        :param plugmeters: list of the mac addresses of the plug meters
+        :param backlog: (util.supervisor.UplinkBacklog) measurements waiting for the uplink, None to ignore it
+        :param txt: (int) reporting interval set up first, seconds
+        :param rgb: (string) colors of the led of the plugs
+        :param retries: (int) times a command which was not delivered is sent again
+        :param timeout: (float) seconds to wait for the tx_status of a command
+        :param adaptive: (bool) adapt the reporting intervals, False to keep txt
+        """
+        self._xbee = xbee
+        self._backlog = backlog
+        self._txt = txt
+        self._rgb = rgb
+        self._retries = retries
+        self._timeout = timeout
+        self._adaptive = adaptive
+        self._min_txt = min_txt
+        self._max_txt = max_txt
+        self._busy_change = busy_change
+        self._idle_change = idle_change
+        self._backlog_high = backlog_high
+        self._hold = hold
+
+        # 64 bit address -> _Plug
+        self._plugs = {}
+        for mac in plugmeters:
+            address = mac_to_address(mac)
+            if address is None:
+                logger.warn("#warn:not-a-mac-address-of-a-plug-meter:%s", mac)
+                continue
+            self._plugs[address] = _Plug(mac, address)
+
+        # frame id -> (plug, command, attempts, deadline) of the commands not confirmed yet
+        self._pending = {}
+        self._next_frame_id = 0
+        # (plug, command, attempts) of the commands waiting for a free frame id
+        self._queued = collections.deque()
+
+        self._delivered = 0
+        self._retried = 0
+        self._failed = 0
+        self._txt_changes = 0
+
+    def set_up(self):
+        """
+        sends the setup commands to all plugs, without waiting for the confirmations
+        """
+        for plug in self._plugs.values():
+            self.send(plug, b'SET POW=ON\n')
+            self._set_txt(plug, self._txt)
+            self.send(plug, ('SET RGB=%s\n' % self._rgb).encode('ascii'))
+
+    def _frame_id(self):
+        """
+        :return: (int) a frame id not waiting for its tx_status, there must be one
+        """
+        while True:
+            self._next_frame_id = self._next_frame_id % _FRAME_IDS + 1
+            if self._next_frame_id not in self._pending:
+                return self._next_frame_id
+
+    def send(self, plug, command, attempts=0):
+        """
+        sends a command to a plug, it is sent again if it is not confirmed in time.
+        it is queued while no frame id is free
+        """
+        self._queued.append((plug, command, attempts))
+        self._send_queued()
+
+    def _send_queued(self):
+        """
+        sends the queued commands as far as there are free frame ids
+        """
+        while self._queued and len(self._pending) < _FRAME_IDS:
+            plug, command, attempts = self._queued.popleft()
+            frame_id = self._frame_id()
+            self._pending[frame_id] = (plug, command, attempts + 1, time.time() + self._timeout)
+            self._xbee.tx(frame_id=bytes([frame_id]), dest_addr_long=plug.address, dest_addr=_UNKNOWN_ADDR,
+                          data=command)
+
+    def _set_txt(self, plug, txt):
+        plug.txt = txt
+        plug.last_change = time.time()
+        self.send(plug, ('SET TXT=%d\n' % txt).encode('ascii'))
+
+    def handle_status(self, response):
+        """
+        :param response: (dict) a tx_status frame of the radio
+        """
+        entry = self._pending.pop(ord(response['frame_id']), None)
+        if entry is None:
+            return
+        plug, command, attempts, deadline = entry
+        if response.get('deliver_status') == _DELIVERED:
+            self._delivered += 1
+            self._send_queued()
+        else:
+            self._retry(plug, command, attempts, 'status-%s' % response.get('deliver_status'))
+
+    def _retry(self, plug, command, attempts, reason):
+        if attempts <= self._retries:
+            self._retried += 1
+            self.send(plug, command, attempts)
+            return
+        self._failed += 1
+        self._send_queued()
+        logger.warn("#warn:command-not-delivered#plug:%s#command:%s#reason:%s", plug.mac, command.strip(), reason)
+        if command.startswith(b'SET TXT='):
+            # set again 'hold' seconds later
+            plug.txt = None
+            plug.last_change = time.time()
+
+    def observe(self, address, measurement):
+        """
+        called for every measurement of a plug
+        :param address: (bytes) 64 bit address of the plug
+        :param measurement: (dto.zigbeedatatypes.Plugmeasurement)
+        """
+        plug = self._plugs.get(address)
+        if plug is None or measurement.load is None:
+            return
+        ts = measurement.ts.timestamp()
+        if plug.last_ts is not None and ts > plug.last_ts:
+            change = abs(measurement.load - plug.last_load) / (ts - plug.last_ts)
+            plug.activity = change if plug.activity is None else \
+                plug.activity + _ACTIVITY_WEIGHT * (change - plug.activity)
+        plug.last_ts = ts
+        plug.last_load = measurement.load
+
+    def target_txt(self, plug):
+        """
+        :return: (int) the reporting interval the plug should have, seconds
+        """
+        if plug.activity is None:
+            txt = self._txt
+        elif plug.activity >= self._busy_change:
+            txt = self._min_txt
+        elif plug.activity <= self._idle_change:
+            txt = self._max_txt
+        else:
+            share = math.log(self._busy_change / plug.activity) / math.log(self._busy_change / self._idle_change)
+            txt = self._min_txt * (self._max_txt / self._min_txt) ** share
+
+        backlog = self._backlog.get() if self._backlog else 0
+        if backlog > self._backlog_high:
+            txt *= backlog / self._backlog_high
+        return int(round(min(max(txt, self._min_txt), self._max_txt)))
+
+    def check(self):
+        """
+        sends the commands again which were not confirmed in time and adapts
+        the intervals of the plugs, called by the reader after every frame
+        """
+        now = time.time()
+        for frame_id, (plug, command, attempts, deadline) in list(self._pending.items()):
+            if deadline < now:
+                del self._pending[frame_id]
+                self._retry(plug, command, attempts, 'timeout')
+
+        if not self._adaptive:
+            return
+        for plug in self._plugs.values():
+            if now - plug.last_change < self._hold:
+                continue
+            txt = self.target_txt(plug)
+            if plug.txt is None or abs(txt - plug.txt) >= _MIN_CHANGE * plug.txt:
+                logger.debug("#debug:reporting-interval#plug:%s#txt:%s#activity:%s", plug.mac, txt, plug.activity)
+                self._txt_changes += 1
+                self._set_txt(plug, txt)
+
+    def get_diagnostics(self):
+        """
+        :return: (dict) counters of the commands and the intervals of the plugs
+        """
+        return {'pending': len(self._pending),
+                'queued': len(self._queued),
+                'delivered': self._delivered,
+                'retried': self._retried,
+                'failed': self._failed,
+                'txt_changes': self._txt_changes,
+                'txt': dict((plug.mac, plug.txt) for plug in self._plugs.values())}
@@ -1,27 +1,81 @@
-from datetime import datetime
 import logging
 import multiprocessing
+import os
 from pickle import dump
+import queue
+import threading
 import time
+import serial
 from dto.zigbeedatatypes import Plugmeasurement
-from zigbee.zigbee_interface_reader import open_zigbee_serialport
+from zigbee.plug_control import PlugControl
+from zigbee.zigbee_interface_reader import frame_waiting, open_zigbee_serialport
 from util import zigbeeconfig
+from util import clock, profiling
+from util.devices import get_device_table
+from util.logger_factory import setup_logging
 
 logger = logging.getLogger(__name__)
 
+# number of frames in a row which may fail before
+# the reader gives up and leaves it to the Supervisor
+_MAX_SUCCESSIVE_ERRORS = 100
+
+# seconds the reader waits for a frame before it checks the commands
+# to the plugs anyway, so retries and intervals don't stall on a quiet mesh
+_CHECK_INTERVAL = 1
 
-class ZigBeeReader(multiprocessing.Process):
-    def __init__(self, queue, devicemapping):
-        multiprocessing.Process.__init__(self, daemon=True)
 
+class ZigBeeReaderBase():
+    """
+    reads the frames of the XBee radio and parses them into measurements,
+    use ZigBeeReader to run it in its own process or ZigBeeReaderThread
+    to run it inside the process of the Reporter
+    """
+    def __init__(self, queue, devicemapping, com_port='/dev/ttyUSB0', com_baud=9600, stats=None,
+                 control_settings=None, backlog=None):
+        """
+        :param queue: the bounded queue of this reader, read by the Reporter
+        :param devicemapping: dictionary mac address -> 'plugmeter'/'multisensor'
+        :param com_port: (string): path to COM port of the XBee radio
+        :param com_baud: (int)
+        :param stats: (util.supervisor.ReaderStats) counters read by the Supervisor
+        :param control_settings: (dict) keyword arguments of PlugControl, None to set
+        up all devices by one broadcast (zigbeeconfig.initial_setup) instead
+        :param backlog: (util.supervisor.UplinkBacklog) read by the PlugControl
+        """
+        self._com_port = com_port
+        self._com_baud = com_baud
         self.queue = queue
         self.devicemapping = devicemapping
+        self.zigbee = None
+        self._control_settings = control_settings
+        self._backlog = backlog
+        self.control = None
+
+        # 64 bit address -> (parser, handle of the device) of the registered devices
+        self._sources = {}
+        self._stats = stats
 
-    def mac_address_to_str(self, mac):
+    @staticmethod
+    def mac_address_to_str(mac):
         return ':'.join("{:02X}".format(c) for c in mac)
 
-    def parse_plugmeasurement(self, ts, mac_adress, resp):
-        pms = Plugmeasurement(ts, mac_adress)
+    def lookup(self, source):
+        """
+        :param source: (bytes) 64 bit address of the sender of a frame
+        :return: (tuple) its parser ('plugmeter', 'multisensor' or None) and the handle
+        of its device, the address is only formatted for the first frame of a device
+        """
+        known = self._sources.get(source)
+        if known is None:
+            mac = self.mac_address_to_str(source)
+            known = (self.devicemapping.get(mac), get_device_table().handle(mac))
+            if known[0]:
+                self._sources[source] = known
+        return known
+
+    def parse_plugmeasurement(self, ts, device, resp):
+        pms = Plugmeasurement(ts, device)
         for item in resp['rf_data'].decode('utf-8').split('\n'):
             if '=' in item:
                 k, valv = item.split('=')
@@ -42,36 +96,135 @@ class ZigBeeReader(multiprocessing.Process):
 
     def parse_response(self, resp, count):
         try:
-            source = self.mac_address_to_str(resp['source_addr_long'])
-            parser = self.devicemapping.get(source)
-            logger.debug("#debug:start-parsing#from:%s#count:%s" % (source, count))
+            source = resp['source_addr_long']
+            parser, device = self.lookup(source)
+            logger.debug("#debug:start-parsing#from:%s#count:%s", device, count)
             if parser == 'plugmeter':
-                return self.parse_plugmeasurement(datetime.now(), source, resp)
+                return self.parse_plugmeasurement(clock.now(), device, resp)
             elif parser == 'multisensor':
                 logger.warn("#warn:no-multisensor")
             else:
-                logger.warn("#warn:unregistered-device#id:%s" % source)
+                logger.warn("#warn:unregistered-device#id:%s", self.mac_address_to_str(source))
         except KeyError:
-            logger.error("#erorr:-unknown-msg-read %s " % resp)
+            logger.error("#erorr:-unknown-msg-read %s ", resp)
         except:
-            logger.error("#error:dumping-res#cnt:%s" % count)
+            logger.error("#error:dumping-res#cnt:%s", count)
             dump(resp, open("error-%s.p" % count, "wb"))
 
+    def _put(self, data):
+        """
+        puts a measurement into the queue of this reader, the measurement
+        is dropped if the queue is full (the Reporter does not keep up)
+        """
+        try:
+            self.queue.put_nowait(data)
+        except queue.Full:
+            if self._stats:
+                self._stats.record_drop()
+            return
+        if self._stats:
+            self._stats.record()
+
     def set_up(self):
-        self.zigbee = open_zigbee_serialport()
-        logger.debug("#debug:setting-up-all-zigbee-devices")
-        zigbeeconfig.initial_setup(self.zigbee)
+        self.zigbee = open_zigbee_serialport(self._com_port, self._com_baud)
+        if self._control_settings is None:
+            logger.debug("#debug:setting-up-all-zigbee-devices")
+            zigbeeconfig.initial_setup(self.zigbee)
+            return
+
+        # the confirmations are read by run()
+        plugmeters = [mac for mac, kind in self.devicemapping.items() if kind == 'plugmeter']
+        logger.debug("#debug:setting-up-the-plug-meters#count:%s", len(plugmeters))
+        self.control = PlugControl(self.zigbee, plugmeters, self._backlog, **self._control_settings)
+        self.control.set_up()
+
+    def tear_down(self):
+        """
+        closes the serial port of the radio, called by the Supervisor
+        before a new reader is opening the port again
+        """
+        if self.zigbee:
+            self.zigbee.serial.close()
 
     def run(self):
+        """
+        reads and parses the frames of the radio, returns when the serial port
+        fails or _MAX_SUCCESSIVE_ERRORS frames in a row could not be read,
+        the Supervisor then starts a new reader with a freshly opened port
+
+        the radio is opened and set up here, in parallel to the other
+        readers and to the Reporter connecting to the server
+        """
+        if self.zigbee is None:
+            try:
+                self.set_up()
+            except serial.SerialException as e:
+                logger.error("#error:could-not-set-up-the-radio-on-%s", self._com_port)
+                logger.exception(e)
+                return
+
         count = 0
+        errors = 0
         while True:
             count = count + 1
             try:
+                if self.control and not frame_waiting(self.zigbee, _CHECK_INTERVAL):
+                    self.control.check()
+                    continue
                 response = self.zigbee.wait_read_frame()
-                parsed = self.parse_response(response, count)
-                self.queue.put(parsed)
+                if response.get('id') == 'tx_status' and self.control:
+                    # the confirmation of a command to a plug
+                    self.control.handle_status(response)
+                    self.control.check()
+                    continue
+                with profiling.stage('zigbee.parse'):
+                    parsed = self.parse_response(response, count)
+                if parsed:
+                    self._put(parsed)
+                    if self.control:
+                        self.control.observe(response['source_addr_long'], parsed)
+                elif self._stats and 'rf_data' in response:
+                    # a frame of a device, not a response of the radio itself
+                    self._stats.record_decode_failure(self.lookup(response['source_addr_long'])[1])
+                if self.control:
+                    self.control.check()
                 logger.debug("#debug:read-msg-from-zigbee")
+                errors = 0
+            except serial.SerialException as e:
+                logger.error("#error:serial-port-failed-while-reading-from-Zigbee")
+                logger.exception(e)
+                return
             except Exception as e:
                 logger.error("#error:while-reading-from-Zigbee")
+                logger.exception(e)
+                if self._stats:
+                    self._stats.record_error()
+                errors += 1
+                if errors >= _MAX_SUCCESSIVE_ERRORS:
+                    logger.error("#error:giving-up-after-successive-errors#errors:%s", errors)
+                    return
                 time.sleep(0.5)
-                self.run()
+
+
+class ZigBeeReader(ZigBeeReaderBase, multiprocessing.Process):
+    def __init__(self, queue, devicemapping, com_port='/dev/ttyUSB0', com_baud=9600, stats=None,
+                 control_settings=None, backlog=None):
+        multiprocessing.Process.__init__(self, daemon=True)
+        ZigBeeReaderBase.__init__(self, queue, devicemapping, com_port, com_baud, stats, control_settings, backlog)
+
+    def run(self):
+        # the log writer thread and the profiler of the
+        # parent do not exist in this process
+        name = 'zigbee-%s' % os.path.basename(self._com_port)
+        setup_logging(name)
+        profiler = profiling.install(name)
+        profiler.add_probe('queue', self.queue.qsize)
+        profiler.add_probe('plugs', lambda: self.control.get_diagnostics() if self.control else None)
+        ZigBeeReaderBase.run(self)
+
+
+class ZigBeeReaderThread(ZigBeeReaderBase, threading.Thread):
+    def __init__(self, queue, devicemapping, com_port='/dev/ttyUSB0', com_baud=9600, stats=None,
+                 control_settings=None, backlog=None):
+        threading.Thread.__init__(self, daemon=True)
+        ZigBeeReaderBase.__init__(self, queue, devicemapping, com_port, com_baud, stats, control_settings, backlog)
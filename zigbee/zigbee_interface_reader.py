@@ -1,8 +1,29 @@
-from xbee import ZigBee
 import serial
+import time
+
 
 def open_zigbee_serialport(com_port='/dev/ttyUSB0', com_baud=9600):
+    # imported here, the xbee package is only needed on clients with a radio
+    from xbee import ZigBee
+
     ser = serial.Serial(com_port, com_baud)
     xbee = ZigBee(ser)
     return xbee
 
+
+def frame_waiting(xbee, timeout, poll=0.01):
+    """
+    waits up to timeout seconds for bytes of a frame on the serial port of the radio,
+    polling the port the way the xbee package does while reading a frame
+
+    :param xbee: the ZigBee of open_zigbee_serialport
+    :param timeout: seconds to wait
+    :param poll: seconds between two looks at the port
+    :return: True if bytes are waiting, False if the port stayed quiet
+    """
+    deadline = time.time() + timeout
+    while not xbee.serial.inWaiting():
+        if time.time() >= deadline:
+            return False
+        time.sleep(poll)
+    return True